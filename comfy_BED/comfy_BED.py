@@ -1,14 +1,37 @@
 import argparse
 import textwrap
 import os
-import csv
+import io
 import xml.etree.ElementTree as ET
 import datetime
 import six
 import logging
 import sys
+import collections
 
-from comfy_BED_web import checkCurrentLrgStatus, getLrgFromWeb
+from comfy_BED_convert import GenomeMapping, parseStrand, convertExons
+from comfy_BED_errors import InvalidInputError, InvalidTranscriptError
+from comfy_BED_input import STDIN_INPUT, LRG_XML_SUFFIXES, isLrgXmlPath, openLrgXml
+from comfy_BED_xml import getXmlBackend
+from comfy_BED_timing import timeStage, addBytes, startTimings, stopTimings
+from comfy_BED_logs import LOG_LEVELS, LOG_FORMATS, startLogging
+from comfy_BED_model import (LrgModel, asLrgModel, getRootLrgId, splitTranscripts, splitGenomeBuilds, codingTranscript,
+                             convertTranscript, flankExons, mergeExons)
+
+# everything logs to the comfy_BED logger, which only writes anywhere once logging is set up
+# (by setUpLogs for the command line, or by the calling program when used as a library)
+logger = logging.getLogger('comfy_BED')
+logger.addHandler(logging.NullHandler())
+
+# one exon of a transcript on a genome build, as returned by convert
+ExonRecord = collections.namedtuple('ExonRecord', ['chrom', 'start', 'end', 'exon', 'lrg_id', 'transcript'])
+
+# the transcript name given to the merged regions of the selected transcripts
+MERGED_TRANSCRIPT_NAME = 'merged'
+
+# the genome builds that can be asked for by name, along with the coord
+# systems of their patches (e.g. 'GRCh38.p12') and 'all', see isGenomeBuild
+GENOME_BUILDS = ('GRCh37', 'GRCh38')
 
 # load arguments
 def getArgs():
@@ -30,6 +53,12 @@ def getArgs():
         python comfy_BED.py -l ~/Documents/LRG_1.xml -t t1,t2 -g GRCh38
           Loads a local copy of LRG_1 and outputs a BED file in GRCh38 for each of 
           transcript 1 and transcript 2
+
+        python comfy_BED.py -l ~/Documents/LRG_1.xml -t t1 -g GRCh37 GRCh38
+          Outputs LRG_1_t1_GRCh37.bed and LRG_1_t1_GRCh38.bed from one read of the LRG
+
+        gunzip -c ~/Documents/LRG_1.xml.gz | python comfy_BED.py -l - -t t1
+          Reads the LRG from stdin (comfy_BED.py can also read LRG_1.xml.gz itself)
         '''
     ))
 
@@ -39,8 +68,12 @@ def getArgs():
     # path to local xml
     input_method.add_argument(
         '-l', '--local_input', action='store', 
-        help='The filepath to a local input LRG xml file'
-    )
+        help=textwrap.dedent(
+        '''
+        The filepath to a local input LRG xml file, which can be gzip or bzip2
+        compressed (.xml.gz or .xml.bz2). Use - to read the xml from stdin.
+        '''
+    ))
 
     # web option
     input_method.add_argument(
@@ -57,30 +90,394 @@ def getArgs():
         '-t', '--transcripts', action='store', 
         help=textwrap.dedent(
         '''
-        List of transcript to include
+        List of transcript to include, or 'all' for every transcript
         '''
     ))
 
     # genome build options
     parser.add_argument(
-        '-g', '--genome_build', action='store', 
-        choices=['GRCh37', 'GRCh38'], default='GRCh37',
+        '-g', '--genome_build', action='store', nargs='+',
+        type=genomeBuildArg, default=['GRCh37'],
         help=textwrap.dedent(
         '''
         Select genome build from 'GRCh37' or 'GRCh38'. Defaults to GRCh37.
+        Give more than one (e.g. -g GRCh37 GRCh38), or any coord system the LRG
+        is mapped onto (e.g. GRCh38.p12), or 'all' for every assembly in the LRG,
+        to write a BED file for each build from one read of the LRG. With more
+        than one build, the build is added to the BED file names.
+        '''
+    ))
+
+    # annotation index
+    parser.add_argument(
+        '-x', '--annotation_index', action='store',
+        help=textwrap.dedent(
+        '''
+        An annotation index made by comfy_BED_index.py. Local input files in the index
+        are loaded from it instead of parsing the xml.
         '''
     ))
+    addRegionArgs(parser)
+    addOutputArgs(parser)
+    addWebArgs(parser)
+    addTimingArgs(parser)
+    addLogArgs(parser)
     return parser.parse_args()
 
 
-def setUpLogs(args, now):
+def isGenomeBuild(genome_builds):
+    '''
+    Whether genome builds can be converted to: each of the comma separated
+    builds must be in GENOME_BUILDS, a patch of one (e.g. 'GRCh38.p12'), or
+    'all' for every assembly the LRG is mapped onto
+    '''
+    genome_builds = [genome_build.strip() for genome_build in genome_builds.split(',')]
+    return all(genome_build == 'all' or genome_build.split('.')[0] in GENOME_BUILDS for genome_build in genome_builds)
+
+
+def genomeBuildArg(genome_builds):
+    '''
+    argparse type for genome build options, see isGenomeBuild
+    '''
+    if not isGenomeBuild(genome_builds):
+        raise argparse.ArgumentTypeError("invalid genome build: '{}' (choose from {}, a patch of one or 'all')".format(
+            genome_builds, ', '.join(GENOME_BUILDS)))
+    return genome_builds
+
+
+def addRegionArgs(parser):
+    '''
+    Add the region options (coding only, flanks and merging) to an argparse parser
+    '''
+    # coding regions
+    parser.add_argument(
+        '--coding', action='store_true',
+        help='Only output the coding part of each exon (from the LRG coding_region), leaving out UTR-only exons'
+    )
+
+    # flanks
+    parser.add_argument(
+        '--flank', action='store', type=int, default=0,
+        help='Add this many bases of intron to each side of each exon. Defaults to 0.'
+    )
+
+    # merging
+    parser.add_argument(
+        '--merge', action='store_true',
+        help=textwrap.dedent(
+        '''
+        Merge the exons of the selected transcripts (use -t all for every transcript)
+        into one set of regions, collapsing overlaps, written to <LRG ID>_merged.bed
+        '''
+    ))
+
+
+def addOutputArgs(parser):
+    '''
+    Add the BED output options to an argparse parser
+    '''
+    # combined output file
+    parser.add_argument(
+        '-o', '--output_file', action='store',
+        help=textwrap.dedent(
+        '''
+        Write the exons of every transcript to this one BED file (or to stdout for '-'),
+        instead of a file per transcript. The 4th column is <LRG ID>_<transcript>_<exon>.
+        '''
+    ))
+
+    # sorting
+    parser.add_argument(
+        '--sort', action='store_true',
+        help='Sort the BED rows by chromosome and position'
+    )
+
+    # compression
+    parser.add_argument(
+        '--bgzip', action='store_true',
+        help='BGZF compress the BED output (readable by gzip), adding .gz to BED file names'
+    )
+
+    # tabix index
+    parser.add_argument(
+        '--tabix', action='store_true',
+        help='Write a tabix index (<BED file>.tbi) of the BED output. Turns on --sort and --bgzip.'
+    )
+
+
+def addWebArgs(parser):
+    '''
+    Add the web cache options to an argparse parser
+    '''
+    # web cache directory
+    parser.add_argument(
+        '-c', '--cache_dir', action='store',
+        help=textwrap.dedent(
+        '''
+        Directory to cache LRG xml files, LRG ID searches and LRG statuses from the
+        web in, so they are only downloaded again once they are out of date.
+        '''
+    ))
+
+    # offline cache
+    parser.add_argument(
+        '--cache_only', action='store_true',
+        help='Only use the cache, never query the web. Requires --cache_dir.'
+    )
+
+    # status snapshot
+    parser.add_argument(
+        '-s', '--status_file', action='store',
+        help=textwrap.dedent(
+        '''
+        A tab separated file of LRG IDs and their status (public or pending), made by
+        comfy_BED_web.py. LRGs in the file don't have their status checked on the web.
+        '''
+    ))
+
+    # identifier index
+    parser.add_argument(
+        '-i', '--id_index', action='store',
+        help=textwrap.dedent(
+        '''
+        An identifier index made by comfy_BED_ids.py. Identifiers in the index are
+        resolved to LRG IDs without searching the web.
+        '''
+    ))
+
+
+def addTimingArgs(parser):
+    '''
+    Add the timing and profiling options to an argparse parser
+    '''
+    # stage timings
+    parser.add_argument(
+        '--timings', action='store',
+        help=textwrap.dedent(
+        '''
+        Append the wall time, bytes read/written, HTTP requests and peak memory of
+        each stage of the run (fetch, parse, status, mapping, convert, write) to this
+        file as JSON lines, or write them to stderr for '-'
+        '''
+    ))
+    parser.add_argument(
+        '--timing_table', action='store_true',
+        help='Print a table of the timings of each stage to stderr at the end of the run'
+    )
+
+    # profiling
+    parser.add_argument(
+        '--profile', action='store',
+        help='Run under cProfile and save the profile to this file, to read with pstats'
+    )
+    parser.add_argument(
+        '--trace_memory', action='store_true',
+        help='Trace memory allocations with tracemalloc (Python 3 only), adding the peak allocated in each stage to the timings'
+    )
+
+
+def setUpTimings(args):
+    '''
+    Start timing each stage of the run if args.timings or args.timing_table
+    were given, and tracing memory if args.trace_memory was
+
+    Output -
+    timings: The RunTimings being recorded, or None if the run isn't being timed.
+    '''
+    if args.trace_memory:
+        from comfy_BED_timing import startMemoryTrace
+        startMemoryTrace()
+    if args.timings or args.timing_table:
+        return startTimings()
+    return None
+
+
+def reportTimings(args, timings, **extra):
+    '''
+    Write the stage timings of a run to args.timings, and print them as a table
+    if args.timing_table was given. extra fields are added to every JSON line.
+    '''
+    if timings is None:
+        return
+    from comfy_BED_timing import writeTimings, formatTimingTable
+    records = timings.toRecords()
+    if args.timings:
+        writeTimings(records, args.timings, **extra)
+    if args.timing_table:
+        table = formatTimingTable(records)
+        logger.info("Stage timings:\n%s", table)
+        sys.stderr.write(table + '\n')
+
+
+def addLogArgs(parser):
+    '''
+    Add the logging options to an argparse parser
+    '''
+    parser.add_argument(
+        '--log_file', action='store',
+        help=textwrap.dedent(
+        '''
+        File to append the logs to, or '-' for stderr. Defaults to a file for the day,
+        e.g. 2024-01-31_comfy_BED.log
+        '''
+    ))
+    parser.add_argument(
+        '--log_level', action='store', choices=LOG_LEVELS, default='DEBUG',
+        help='The lowest level of message to log. Defaults to DEBUG.'
+    )
+    parser.add_argument(
+        '--log_format', action='store', choices=LOG_FORMATS, default='text',
+        help=textwrap.dedent(
+        '''
+        text lines, or json lines with the run ID, the correlation ID (the LRG or file
+        being worked on) and the process of each message. Defaults to text.
+        '''
+    ))
+
+
+def setUpLogs(args, now, multiprocess=False):
     '''
     Makes a log file to help with spotting errors in LRG-to-BED conversion
-    Log file name ends with .log and will contain the current date, LRG ID, and 'comfy_BED'
-    Log file created by day and appends to day
+    Log file name ends with .log and will contain the current date and 'comfy_BED',
+    unless args.log_file is given. Log file created by day and appends to day.
+    Records are written by a background thread, see comfy_BED_logs.startLogging.
+    With multiprocess, records logged by worker processes go through it too.
+    '''
+    log_filename = getattr(args, 'log_file', None) or now.strftime("%Y-%m-%d") + "_comfy_BED" + ".log"
+    run_id = startLogging(log_filename, getattr(args, 'log_level', 'DEBUG'), getattr(args, 'log_format', 'text'),
+                          multiprocess=multiprocess)
+    logger.debug('Logging run %s to %s', run_id, log_filename)
+
+
+def setUpWeb(args):
+    '''
+    Cache web queries in args.cache_dir, and load LRG statuses from
+    args.status_file and identifiers from args.id_index, if they were given
+    '''
+    if args.cache_only and not args.cache_dir:
+        logger.error('--cache_only needs a --cache_dir')
+        raise InvalidInputError('--cache_only needs a --cache_dir')
+    from comfy_BED_web import setCache, loadStatusSnapshot, loadIdIndex
+    if args.cache_dir:
+        from comfy_BED_cache import LrgWebCache
+        setCache(LrgWebCache(args.cache_dir, offline=args.cache_only))
+        logger.info("Caching web queries in: %s", args.cache_dir)
+    if args.status_file:
+        loadStatusSnapshot(args.status_file)
+    if args.id_index:
+        loadIdIndex(args.id_index)
+
+
+# Paths (below the root element) of the only LRG elements that comfy_BED reads.
+# Everything else, including the genomic, cDNA and protein <sequence> blobs,
+# is dropped by the parser before it is ever built.
+LRG_KEEP_PATHS = frozenset([
+    ('fixed_annotation',),
+    ('fixed_annotation', 'id'),
+    ('fixed_annotation', 'transcript'),
+    ('fixed_annotation', 'transcript', 'exon'),
+    ('fixed_annotation', 'transcript', 'exon', 'coordinates'),
+    ('fixed_annotation', 'transcript', 'coding_region'),
+    ('fixed_annotation', 'transcript', 'coding_region', 'coordinates'),
+    ('updatable_annotation',),
+    ('updatable_annotation', 'annotation_set'),
+    ('updatable_annotation', 'annotation_set', 'mapping'),
+    ('updatable_annotation', 'annotation_set', 'mapping', 'mapping_span'),
+    ('updatable_annotation', 'annotation_set', 'mapping', 'mapping_span', 'diff'),
+])
+LRG_TEXT_PATHS = frozenset([
+    ('fixed_annotation', 'id'),
+])
+LRG_READ_CHUNK_SIZE = 64 * 1024
+
+
+class LrgTreeTarget(object):
+    '''
+    ElementTree parser target that only builds the parts of an LRG file
+    listed in keep_paths, and only keeps the text of elements in text_paths.
+    The root element is always kept so that non-LRG input can still be
+    recognised by its tag.
+    If stop_at_lrg_set is True, 'done' is set once the 'lrg' annotation set
+    (which holds the genome mappings) has been read, and anything fed after
+    that is ignored.
+    '''
+    def __init__(self, keep_paths=LRG_KEEP_PATHS, text_paths=LRG_TEXT_PATHS, stop_at_lrg_set=True):
+        self.keep_paths = keep_paths
+        self.text_paths = text_paths
+        self.stop_at_lrg_set = stop_at_lrg_set
+        self.builder = ET.TreeBuilder()
+        self.path = []
+        self.skip_depth = 0
+        self.done = False
+
+    def start(self, tag, attrib):
+        if self.done:
+            return
+        if self.skip_depth or (self.path and tuple(self.path[1:]) + (tag,) not in self.keep_paths):
+            self.skip_depth += 1
+            return
+        self.path.append(tag)
+        self.builder.start(tag, attrib)
+
+    def end(self, tag):
+        if self.done:
+            return
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+        self.path.pop()
+        elem = self.builder.end(tag)
+        if self.stop_at_lrg_set and tag == 'annotation_set' and elem.get('type') == 'lrg':
+            self.done = True
+
+    def data(self, data):
+        if not self.done and not self.skip_depth and tuple(self.path[1:]) in self.text_paths:
+            self.builder.data(data)
+
+    def close(self):
+        # close any elements left open by stopping early
+        while self.path:
+            self.builder.end(self.path.pop())
+        return self.builder.close()
+
+
+def loadLrgXml(source, target=None):
+    '''
+    Incrementally parse an LRG file, keeping only the LRG ID, the fixed
+    annotation transcript/exon coordinates and the mapping spans.
+    Reading stops as soon as the genome mappings have been parsed.
+    With the lxml xml backend (see comfy_BED_xml) the tree is built in C
+    instead, and pruned as each element ends.
+
+    Input -
+    source: String filepath (which can be gzip or bzip2 compressed, or '-'
+      for stdin, see openLrgXml), or a file-like object opened in binary mode.
+    target: Optional LrgTreeTarget, to keep a different set of elements.
+
+    Output -
+    root: Element. The (pruned) root of the LRG, which can be passed to
+      checkValidTranscripts, getGenomeMapping and getLrgExons as normal.
+      Malformed or truncated xml raises an InvalidXmlError with either backend.
     '''
-    log_filename = now.strftime("%Y-%m-%d") + "_comfy_BED" + ".log"
-    logging.basicConfig(filename=log_filename, level=logging.DEBUG)
+    if isinstance(source, six.string_types):
+        with openLrgXml(source) as lrg_file:
+            return loadLrgXml(lrg_file, target)
+
+    xml_backend = getXmlBackend()
+    if target is None and xml_backend.builds_lrg_tree:
+        parser = xml_backend.makeLrgParser(LRG_KEEP_PATHS)
+    else:
+        parser = xml_backend.makeTargetParser(target or LrgTreeTarget())
+    while not parser.done:
+        chunk = source.read(LRG_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        addBytes(len(chunk))
+        parser.feed(chunk)
+
+    if parser.done:
+        logger.info("Stopped reading LRG file once the genome mappings were parsed")
+    return parser.close()
 
 
 def checkValidTranscripts(input_transcript_list, root):
@@ -91,16 +488,16 @@ def checkValidTranscripts(input_transcript_list, root):
     '''
     for input_transcript in input_transcript_list:
         lrg_transcript_list = []
-        for lrg_transcript in root.iter('transcript'):
+        for lrg_transcript in getXmlBackend().transcripts(root):
             lrg_transcript_list.append(str(lrg_transcript.get('name')))
         if str(input_transcript) not in lrg_transcript_list:
-            logging.error("This transcript name is not valid: " + str(input_transcript))
-            logging.error("Valid transcript names are:")
+            logger.error("This transcript name is not valid: %s", input_transcript)
+            logger.error("Valid transcript names are:")
             for i in lrg_transcript_list:
                 if i != "None":
-                    logging.info(str(i))
-            logging.info("Cancelling comfy_BED")
-            raise ValueError("Invalid transcript name")
+                    logger.info('%s', i)
+            logger.info("Cancelling comfy_BED")
+            raise InvalidTranscriptError("Invalid transcript name: " + str(input_transcript))
 
 
 def getLrgExons(transcript, lrg_id):
@@ -108,16 +505,16 @@ def getLrgExons(transcript, lrg_id):
     Make a dictionary (key is string exon label, value is tuple of 'start' and 'end' 
     positions as integers)
     '''
+    xml_backend = getXmlBackend()
     transcript_dict = {}
-    for exon in transcript.iter('exon'):
+    for exon in xml_backend.exons(transcript):
         name = 'exon_{}'.format(exon.get('label'))
         #from coordinates
-        for coordinate in exon.iter('coordinates'):
-            if coordinate.get('coord_system') == lrg_id:
-                start = int(coordinate.get('start'))
-                end = int(coordinate.get('end'))
+        for coordinate in xml_backend.coordinates(exon, lrg_id):
+            start = int(coordinate.get('start'))
+            end = int(coordinate.get('end'))
         transcript_dict[name] = (start, end)
-    logging.info("Fetched start and end coordinates of LRG exons")
+    logger.info("Fetched start and end coordinates of LRG exons")
     return(transcript_dict)
 
 
@@ -128,15 +525,14 @@ def getGenomeMapping(root, genome_build):
     positions will be used to convert between LRG numbering and 
     genome numbering.
     '''
-    for mapping in root.iter('mapping'):
-        if str(mapping.get('coord_system')).startswith(genome_build):
-            chr = 'chr{}'.format(mapping.get('other_name'))
-
-            for m_span in mapping.iter('mapping_span'):
-                start = int(m_span.get('other_start'))
-                end = int(m_span.get('other_end'))
-                strand = str(m_span.get('strand'))
-    logging.info("Obtained the LRG and genomic coordinates of the start and end of the selected LRG gene")
+    for mapping in getXmlBackend().mappings(root, genome_build):
+        chr = 'chr{}'.format(mapping.get('other_name'))
+
+        for m_span in mapping.iter('mapping_span'):
+            start = int(m_span.get('other_start'))
+            end = int(m_span.get('other_end'))
+            strand = str(m_span.get('strand'))
+    logger.info("Obtained the LRG and genomic coordinates of the start and end of the selected LRG gene")
     return(chr, start, end, strand)
 
 
@@ -162,110 +558,389 @@ def calculateGenomicPositions(transcript_dict, chrom, gen_start, gen_end, strand
     list_of_exons: List of tuples, one per exon in the transcript_dict.
         Each tuple contains the chromosome, genome start coordinate,
         genome end coordinate and exon label.
+
+    This is kept for callers that only have the start, end and strand of the
+    mapping, which is taken as a single gap-free span. LRGs are converted with
+    the full piecewise mapping by convertExons, see comfy_BED_convert.
     '''
-    # open empty list to add each exon tuple to
-    list_of_exons = []
-
-    # loop through exon dictionary, extract exon name, lrg start and end
-    # use six library for iterating as it has support for both python 2 and 3
-    for transcript in six.iteritems(transcript_dict):
-        exon_label = str(transcript[0])
-        lrg_start = int(transcript[1][0])
-        lrg_end = int(transcript[1][1])
-
-        # if strand is 5' -> 3'
-        if strand == '1':
-            gen_exon_start = gen_start + lrg_start - 1
-            gen_exon_end = gen_start + lrg_end - 1
-            list_of_exons.append((chrom, gen_exon_start, gen_exon_end, exon_label))
-
-        # if strand is 3' -> 5'
-        elif strand == '-1':
-            exon_length = lrg_end - lrg_start
-            gen_exon_end = gen_end - lrg_end + 1
-            gen_exon_start = gen_exon_end + exon_length
-            # start and end are switch round because bed files should have the smallest value first
-            list_of_exons.append((chrom, gen_exon_end, gen_exon_start, exon_label))
-        else:
-            # raise a value error if strand is anything other than 1 or -1
-            raise ValueError('Cannot determine strand')
-    logging.info("Converted LRG start-and-end coordinates, to genomic coordinates, for the user-selected genome build and transcript")
-    return list_of_exons
+    # the span covers the whole LRG, however far the exons go
+    lrg_end = max([gen_end - gen_start + 1] + [int(end) for start, end in transcript_dict.values()])
+    genome_mapping = GenomeMapping(chrom, [(1, lrg_end, gen_start, gen_end, parseStrand(strand), [])])
+    return convertExons(transcript_dict, genome_mapping)
 
 
 def writeToFile(lrg_status, lrg_status_message, data_list, file_name, now):
     '''
     Take a list of tuples and look through and write as a tab separated file
     '''
+    import csv
     with open(file_name, 'wb') as out:
         out.writelines('#BED file generated at: ' + now.strftime("%Y-%m-%d %H:%M") + '\n')
         out.writelines('#' + str(lrg_status) + ": " + str(lrg_status_message) + '\n')
         writer = csv.writer(out, delimiter='\t')
         for row in data_list:
             writer.writerow(row)
-    logging.info("Wrote exon start-and-end coordinates, for the user-selected genome build and transcript, to BED file")
-    logging.info("The BED file is named: " + file_name)
+    logger.info("Wrote exon start-and-end coordinates, for the user-selected genome build and transcript, to BED file")
+    logger.info("The BED file is named: %s", file_name)
 
 
-def main():
-    args = getArgs()
-    now = datetime.datetime.now()
-
-    # set up logs
-    setUpLogs(args, now)
-    logging.info("comfy_BED started running at: " + str(now))
+def loadLrgInput(local_input=None, web_input=None, annotation_index=None):
+    '''
+    Load an LRG from either a local file or the LRG web API, and return the
+    root of the (pruned) element tree made by loadLrgXml.
+    Local files can be gzip or bzip2 compressed (.xml.gz or .xml.bz2), and
+    '-' reads the xml from stdin.
+    If an annotation index (made by comfy_BED_index.py) is given, local files
+    that are in it are loaded from the index instead of being parsed.
+    '''
+    if local_input == STDIN_INPUT:
+        with timeStage('parse'):
+            root = loadLrgXml(local_input)
 
-    # load data from either local input or web api
-    if args.local_input:
+    elif local_input:
         # check that input file is valid
-        assert os.path.isfile(args.local_input), 'The input is not a file.'
-        assert args.local_input.endswith('.xml'), 'The input file is not an xml file.'
+        if not os.path.isfile(local_input):
+            logger.error('The input is not a file: %s', local_input)
+            raise InvalidInputError('The input is not a file.')
+        if not isLrgXmlPath(local_input):
+            logger.error('The input file is not an xml file: %s', local_input)
+            logger.error('Local input files must end with one of: %s', ', '.join(LRG_XML_SUFFIXES))
+            raise InvalidInputError('The input file is not an xml file.')
+
+        with timeStage('parse'):
+            root = None
+            if annotation_index:
+                # imported here as comfy_BED_index imports this module
+                from comfy_BED_index import loadLrgFromIndex
+                root = loadLrgFromIndex(annotation_index, local_input)
+                if root is None:
+                    logger.info("The input file is not in the annotation index, or has changed since it was indexed")
+
+            # make xml element tree object, only keeping the elements that are used
+            if root is None:
+                root = loadLrgXml(os.path.abspath(local_input))
+
+    elif web_input:
+        # get xml as string from web api and make into xml element tree object
+        from comfy_BED_web import getLrgFromWeb
+        with timeStage('fetch'):
+            xml_string = getLrgFromWeb(web_input)
+        with timeStage('parse'):
+            root = loadLrgXml(io.BytesIO(xml_string.encode('utf-8')))
 
-        # make xml element tree object
-        tree = ET.parse(os.path.abspath(args.local_input))
-        root = tree.getroot()
+    else:
+        logger.error('No LRG input given, give either a local file or a web input')
+        raise InvalidInputError('No LRG input given')
 
-    elif args.web_input:
-        # get xml as string from web api and make into xml element tree object
-        xml_string = getLrgFromWeb(args.web_input)
-        root = ET.fromstring(xml_string)
+    return root
+
+
+def loadLrgSource(source, web=False, annotation_index=None):
+    '''
+    Load an LRG from any of the inputs the library API accepts. Nothing is
+    fetched from the web unless web is True.
+
+    Input -
+    source: An LrgModel or parsed LRG root Element, the LRG xml as a
+      string/bytes, a file-like object of the xml opened in binary mode, or a
+      filepath to an LRG xml file. With web=True, any other string is looked
+      up on the web as an LRG identifier.
+    web: Boolean. Allow identifiers to be fetched from the LRG web API.
+    annotation_index: String. Optional annotation index to load local files from.
+
+    Output -
+    root: Element. The (pruned) root of the LRG, or the LrgModel if that was the source.
+    '''
+    if isinstance(source, LrgModel) or ET.iselement(source):
+        return source
+    if hasattr(source, 'read'):
+        return loadLrgXml(source)
+    if not isinstance(source, (six.binary_type, six.text_type)):
+        raise InvalidInputError('Cannot load an LRG from a {}'.format(type(source).__name__))
+
+    # xml text, rather than a filepath or identifier
+    if source.lstrip()[:1] in (b'<', u'<'):
+        if isinstance(source, six.text_type):
+            source = source.encode('utf-8')
+        return loadLrgXml(io.BytesIO(source))
+    if os.path.isfile(source) or not web:
+        return loadLrgInput(local_input=source, annotation_index=annotation_index)
+    return loadLrgInput(web_input=source)
+
+
+def convertLrg(lrg, transcripts, genome_build, coding_only=False, flank=0, merge=False):
+    '''
+    Convert the exons of the selected transcripts of a loaded LRG to genomic
+    positions. Unlike makeBedRecords the status of the LRG isn't looked up, so
+    nothing is fetched from the web.
 
-    # test that file is an lrg (root.tag should be LRG)
-    assert root.tag.upper() == "LRG", 'The input file is not an LRG file'
-    if root.tag.upper() != "LRG":
-        logging.error("The input file is not an LRG file")
+    Input -
+    lrg: LrgModel, or the root Element of the LRG from loadLrgInput.
+    transcripts: Comma separated string (e.g. 't1,t2') or list of transcript
+      names, which must match the names in the LRG exactly. 'all' selects every transcript.
+    genome_build: String. 'GRCh37' or 'GRCh38'.
+    coding_only: Boolean. Only convert the coding part of each exon, see codingTranscript.
+    flank: Integer. Bases of intron to add to each side of each exon.
+    merge: Boolean. Merge the exons of all the selected transcripts into their union, see mergeExons.
 
-    # get lrg id
-    for levels in root.iter('fixed_annotation'):
-        lrg_id = levels.find('id').text
-        logging.info("LRG_ID: " + lrg_id)
+    Output -
+    lrg_id: String. The LRG ID.
+    transcript_records: List of (transcript name, list of exon tuples from convertTranscript),
+      one per selected transcript, in the order they were asked for. When merging,
+      there is one record, named 'merged', of the merged regions.
+    '''
+    if flank < 0:
+        logger.error("The flank must not be negative: %s", flank)
+        raise InvalidInputError('Invalid flank: {}'.format(flank))
+    with timeStage('parse'):
+        model = asLrgModel(lrg)
+    logger.info("LRG_ID: %s", model.lrg_id)
+    #check whether the transcripts are valid, and cancel everything if they aren't
+    selected_transcripts = model.selectTranscripts(splitTranscripts(transcripts))
+    # (every mapping span and diff, so LRGs with gaps or indels against the genome convert correctly)
+    logger.info("Genome build: %s", genome_build)
+    with timeStage('mapping'):
+        genome_mapping = model.getGenomeMapping(genome_build)
+    logger.info("Chromosome: %s", genome_mapping.chrom)
+    logger.info("Strand: %s", genome_mapping.strand)
+    logger.info("Start position of gene on %s: %s", genome_build, genome_mapping.other_start)
+    logger.info("End position of gene on %s: %s", genome_build, genome_mapping.other_end)
+    # calculate genomic coordinates of the exon boundaries, depending on strand orientation
+    transcript_records = []
+    with timeStage('convert'):
+        for transcript in selected_transcripts:
+            logger.info("Started BED production for transcript: %s", transcript.name)
+            if coding_only:
+                transcript = codingTranscript(transcript)
+            list_of_exons = convertTranscript(transcript, genome_mapping)
+            if flank:
+                list_of_exons = flankExons(list_of_exons, flank)
+            transcript_records.append((transcript.name, list_of_exons))
+        if merge:
+            transcript_records = [(MERGED_TRANSCRIPT_NAME, mergeExons(transcript_records))]
+            logger.info("Merged the transcripts into %s regions", len(transcript_records[0][1]))
+    logger.info("Converted LRG start-and-end coordinates, to genomic coordinates, for the user-selected genome build and transcripts")
+    return model.lrg_id, transcript_records
+
+
+def makeBedRecords(lrg, transcripts, genome_build, coding_only=False, flank=0, merge=False):
+    '''
+    Run the LRG-to-BED conversion on a loaded LRG, without writing any files.
+
+    Input -
+    lrg: LrgModel, or the root Element of the LRG from loadLrgInput.
+    transcripts: Comma separated string (e.g. 't1,t2') or list of transcript names.
+    genome_build: String. 'GRCh37' or 'GRCh38'.
+    coding_only, flank, merge: The regions to make, see convertLrg.
 
+    Output -
+    lrg_id: String. The LRG ID.
+    lrg_status, lrg_status_message: Strings. Public or pending, and the message for the BED header.
+    transcript_records: List of (transcript name, list of exon tuples from convertTranscript),
+      one per selected transcript.
+    '''
     #check whether this LRG ID is public or pending *as of the time of running*, throw warning if pending
-    publicOrPrivate, publicOrPrivateMessage = checkCurrentLrgStatus(lrg_id)
-    #check whether the transcript is valid, and cancel everything if it isn't
-    input_transcript_list = args.transcripts.split(",")
-    checkValidTranscripts(input_transcript_list, root)
-    # extract chr, start, end, strand from mapping region of xml
-    logging.info("Genome build: " + str(args.genome_build))
-    chrom, genome_start, genome_end, genome_strand = getGenomeMapping(root, args.genome_build)
-    logging.info("Chromosome: " + chrom)
-    logging.info("Strand: " + genome_strand)
-    logging.info("Start position of gene on " + args.genome_build + ": " + str(genome_start))
-    logging.info("End position of gene on " + args.genome_build + ": " + str(genome_end))    # extract the exon boundries - lrg numbering - make into python dict
-    # calculate genomic coordinates, depending on strand orientation
-    for transcript in root.iter('transcript'):
-        transcript_name = str(transcript.get('name'))
-        if transcript_name in args.transcripts:
-            logging.info("Started BED production for transcript: " + transcript_name)
-            transcript_dict = getLrgExons(transcript, lrg_id)
-            exon_genomic_positions = calculateGenomicPositions(transcript_dict, chrom, genome_start, genome_end, genome_strand)
+    #(only looked up once per run, and not at all if it is in the status snapshot)
+    from comfy_BED_web import getLrgStatus
+    model = asLrgModel(lrg)
+    with timeStage('status'):
+        publicOrPrivate, publicOrPrivateMessage = getLrgStatus(model.lrg_id)
+    lrg_id, transcript_records = convertLrg(model, transcripts, genome_build, coding_only, flank, merge)
+    return lrg_id, publicOrPrivate, publicOrPrivateMessage, transcript_records
+
+
+def makeBuildBedRecords(lrg, transcripts, genome_builds, coding_only=False, flank=0, merge=False):
+    '''
+    Run the LRG-to-BED conversion on a loaded LRG for one or more genome
+    builds, reading the LRG and looking up its status only once.
+
+    Input -
+    lrg: LrgModel, or the root Element of the LRG from loadLrgInput.
+    transcripts: Comma separated string (e.g. 't1,t2') or list of transcript names.
+    genome_builds: List or comma separated string of genome builds ('GRCh37',
+      'GRCh38') or coord systems the LRG is mapped onto (e.g. 'GRCh38.p12').
+      'all' is every assembly the LRG is mapped onto.
+    coding_only, flank, merge: The regions to make, see convertLrg.
+
+    Output -
+    lrg_id: String. The LRG ID.
+    lrg_status, lrg_status_message: Strings. Public or pending, and the message for the BED header.
+    build_records: List of (genome build, transcript_records) tuples, one per
+      genome build, with transcript_records as from makeBedRecords.
+    '''
+    from comfy_BED_web import getLrgStatus
+    model = asLrgModel(lrg)
+    genome_builds = splitGenomeBuilds(genome_builds, model)
+    if not genome_builds:
+        logger.error("No genome builds to convert %s to", model.lrg_id)
+        raise InvalidInputError('No genome builds given')
+    with timeStage('status'):
+        publicOrPrivate, publicOrPrivateMessage = getLrgStatus(model.lrg_id)
+    build_records = []
+    for genome_build in genome_builds:
+        lrg_id, transcript_records = convertLrg(model, transcripts, genome_build, coding_only, flank, merge)
+        build_records.append((genome_build, transcript_records))
+    return model.lrg_id, publicOrPrivate, publicOrPrivateMessage, build_records
+
+
+def addBuildToPath(path, genome_build):
+    '''
+    Add a genome build to a BED file name, before the .bed extension,
+    e.g. panel.bed.gz -> panel_GRCh38.bed.gz
+    '''
+    directory, file_name = os.path.split(path)
+    extension = file_name.find('.bed')
+    if extension == -1:
+        extension = len(file_name)
+    return os.path.join(directory, file_name[:extension] + '_' + genome_build + file_name[extension:])
+
+
+def convert(source, transcripts, genome_build='GRCh37', web=False, annotation_index=None,
+            coding_only=False, flank=0, merge=False):
+    '''
+    Library entry point: convert the exons of LRG transcripts to genomic
+    positions, and return them rather than writing BED files. Nothing is
+    written, no logging is set up, and the web is only used if web is True
+    (the LRG status isn't looked up, as it is only needed for BED headers).
+    Failures raise the exceptions in comfy_BED_errors.
+
+    Input -
+    source: An LrgModel or parsed LRG root Element, LRG xml as a string/bytes,
+      a binary file-like object, a filepath or (with web=True) an LRG identifier.
+    transcripts: List of transcript names, or a comma separated string, e.g. 't1,t2'.
+    genome_build: String. 'GRCh37' or 'GRCh38'.
+    web: Boolean. Allow the LRG to be fetched from the LRG web API.
+    annotation_index: String. Optional annotation index to load local files from.
+    coding_only, flank, merge: The regions to make, see convertLrg. Merged
+      regions have the transcript 'merged'.
+
+    Output -
+    records: List of ExonRecords (chrom, start, end, exon, lrg_id, transcript),
+      grouped by transcript, with each exon's smallest coordinate first.
+    '''
+    root = loadLrgSource(source, web, annotation_index)
+    lrg_id, transcript_records = convertLrg(root, transcripts, genome_build, coding_only, flank, merge)
+    return [ExonRecord(chrom, start, end, exon, lrg_id, transcript_name)
+            for transcript_name, exons in transcript_records
+            for chrom, start, end, exon in exons]
+
+
+def makeBedFiles(lrg, transcripts, genome_build, now, output_dir='.', sort=False, compress=False, index=False,
+                 coding_only=False, flank=0, merge=False):
+    '''
+    Run the LRG-to-BED conversion on a loaded LRG and write one BED file
+    per selected transcript, and per genome build if there is more than one
+    (named <LRG ID>_<transcript>_<build>.bed).
 
+    Input -
+    lrg: LrgModel, or the root Element of the LRG from loadLrgInput.
+    transcripts: Comma separated string (e.g. 't1,t2') or list of transcript names.
+    genome_build: String. 'GRCh37' or 'GRCh38', or a list of genome builds, see makeBuildBedRecords.
+    now: datetime. Time of the run, written to the BED header.
+    output_dir: String. Directory to write the BED files into.
+    sort, compress, index: Booleans. Sort the rows by position, BGZF compress
+      the files (named .bed.gz) and write tabix indexes, see BedOutput.
+    coding_only, flank, merge: The regions to make, see convertLrg. The merged
+      regions are written to <LRG ID>_merged.bed.
+
+    Output -
+    file_names: List of the BED files that were written.
+    '''
+    # imported here so that runs which don't write BED files don't import it
+    from comfy_BED_output import BedOutput
+    lrg_id, lrg_status, lrg_status_message, build_records = makeBuildBedRecords(
+        lrg, transcripts, genome_build, coding_only, flank, merge)
+    file_names = []
+    for genome_build, transcript_records in build_records:
+        for transcript_name, exon_genomic_positions in transcript_records:
             # output in tab delimted text file
-            #TODO add header, option to change filename, sorting
-            file_name = '{}_{}.bed'.format(lrg_id, transcript_name)
-            writeToFile(publicOrPrivate, publicOrPrivateMessage, exon_genomic_positions, file_name, now)
-            logging.info("Completed BED production for transcript: " + transcript_name)
-    logging.info("comfy_BED run complete")
+            file_name = os.path.join(output_dir, '{}_{}.bed'.format(lrg_id, transcript_name))
+            if len(build_records) > 1:
+                file_name = addBuildToPath(file_name, genome_build)
+            if compress or index:
+                file_name += '.gz'
+            with timeStage('write'), BedOutput(file_name, sort, compress, index) as bed_output:
+                bed_output.writeComment('BED file generated at: ' + now.strftime("%Y-%m-%d %H:%M"))
+                bed_output.writeComment(str(lrg_status) + ": " + str(lrg_status_message))
+                bed_output.writeRows(exon_genomic_positions)
+            logger.info("The BED file is named: %s", file_name)
+            file_names.append(file_name)
+            logger.info("Completed BED production for transcript: %s", transcript_name)
+    return file_names
+
+
+def writeCombinedBed(bed_records, output_file, now, sort=False, compress=False, index=False):
+    '''
+    Write the exons of every transcript of one or more LRGs to a single BED
+    file, or to stdout. Each row's name is <LRG ID>_<transcript>_<exon>.
+
+    Input -
+    bed_records: Iterable of (lrg_id, lrg_status, lrg_status_message, transcript_records)
+      tuples from makeBedRecords. Rows are written as each one comes, unless they are sorted.
+    output_file: String. The file to write, or '-' for stdout.
+    now: datetime. Time of the run, written to the BED header.
+    sort, compress, index: Booleans, see BedOutput.
+
+    Output -
+    lrg_ids: List of the LRG IDs that were written.
+    '''
+    from comfy_BED_output import BedOutput
+    lrg_ids = []
+    with timeStage('write'), BedOutput(output_file, sort, compress, index) as bed_output:
+        bed_output.writeComment('BED file generated at: ' + now.strftime("%Y-%m-%d %H:%M"))
+        for lrg_id, lrg_status, lrg_status_message, transcript_records in bed_records:
+            bed_output.writeComment('{} {}: {}'.format(lrg_id, lrg_status, lrg_status_message))
+            for transcript_name, exon_genomic_positions in transcript_records:
+                bed_output.writeRows((chrom, start, end, '{}_{}_{}'.format(lrg_id, transcript_name, exon))
+                                     for chrom, start, end, exon in exon_genomic_positions)
+            lrg_ids.append(lrg_id)
+    return lrg_ids
+
+
+def runConversion(args, now):
+    '''
+    Load the LRG and write its BED files, as set by the command line arguments
+    '''
+    # load data from either local input or web api
+    root = loadLrgInput(args.local_input, args.web_input, args.annotation_index)
+
+    if args.output_file:
+        lrg_id, lrg_status, lrg_status_message, build_records = makeBuildBedRecords(
+            root, args.transcripts, args.genome_build, args.coding, args.flank, args.merge)
+        if len(build_records) > 1 and args.output_file == '-':
+            logger.error("Only one genome build can be written to stdout")
+            raise InvalidInputError('Cannot write more than one genome build to stdout')
+        for genome_build, transcript_records in build_records:
+            output_file = args.output_file
+            if len(build_records) > 1:
+                output_file = addBuildToPath(output_file, genome_build)
+            writeCombinedBed([(lrg_id, lrg_status, lrg_status_message, transcript_records)],
+                             output_file, now, args.sort, args.bgzip, args.tabix)
+    else:
+        makeBedFiles(root, args.transcripts, args.genome_build, now,
+                     sort=args.sort, compress=args.bgzip, index=args.tabix,
+                     coding_only=args.coding, flank=args.flank, merge=args.merge)
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+
+    # set up logs
+    setUpLogs(args, now)
+    logger.info("comfy_BED started running at: %s", now)
+    setUpWeb(args)
+    timings = setUpTimings(args)
+    try:
+        if args.profile:
+            from comfy_BED_timing import runProfiled
+            runProfiled(runConversion, args.profile, args, now)
+        else:
+            runConversion(args, now)
+    finally:
+        stopTimings()
+        reportTimings(args, timings)
+    logger.info("comfy_BED run complete")
 
 if __name__ == '__main__':
     main()
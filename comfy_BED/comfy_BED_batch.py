@@ -0,0 +1,334 @@
+from __future__ import print_function
+
+import argparse
+import textwrap
+import os
+import re
+import glob
+import datetime
+import logging
+import multiprocessing
+
+from comfy_BED import (setUpLogs, addLogArgs, setUpWeb, addWebArgs, addTimingArgs, reportTimings, loadLrgInput,
+                       makeBedFiles, genomeBuildArg, isGenomeBuild)
+from comfy_BED_web import LRG_STATUSES, checkLrgStatuses
+from comfy_BED_input import isLrgXmlPath, stripLrgXmlSuffix, openLrgXml, INPUT_READ_CHUNK_SIZE
+from comfy_BED_logs import logCorrelation
+from comfy_BED_timing import RunTimings, startTimings, stopTimings, startMemoryTrace, writeTimings
+
+logger = logging.getLogger('comfy_BED')
+
+# LRG IDs, and the <id> of an LRG file, which is near its start
+LRG_ID_PATTERN = re.compile(r'^LRG_\d+$')
+LRG_ID_ELEMENT_PATTERN = re.compile(br'<id>\s*(LRG_\d+)\s*</id>')
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Runs comfy_BED over many LRGs at once, spread over a pool of processes.
+
+        examples:
+        python comfy_BED_batch.py -m panel_manifest.tsv -p 8
+          Makes the BED files listed in the manifest, using 8 processes
+
+        python comfy_BED_batch.py -d "~/Documents/LRGs/*.xml" -t t1 -g GRCh38
+          Makes a GRCh38 BED file of transcript 1 for every LRG xml in the directory
+        '''
+    ))
+
+    # make option to include either a manifest or a directory glob (not both)
+    input_method = parser.add_mutually_exclusive_group(required=True)
+
+    # manifest file
+    input_method.add_argument(
+        '-m', '--manifest', action='store',
+        help=textwrap.dedent(
+        '''
+        A tab separated file with one LRG per line: a filepath to a local LRG xml
+        file or an LRG identifier, the transcripts (e.g. t1,t2) and optionally the
+        genome build. Lines starting with '#' are ignored.
+        '''
+    ))
+
+    # directory glob
+    input_method.add_argument(
+        '-d', '--directory_glob', action='store',
+        help='A glob matching local LRG xml files, e.g. "LRGs/*.xml"'
+    )
+
+    # transcript options, used with a directory glob
+    parser.add_argument(
+        '-t', '--transcripts', action='store', default='t1',
+        help=textwrap.dedent(
+        '''
+        List of transcripts to include for every file matching the directory glob.
+        Defaults to t1.
+        '''
+    ))
+
+    # genome build options
+    parser.add_argument(
+        '-g', '--genome_build', action='store',
+        type=genomeBuildArg, default='GRCh37',
+        help=textwrap.dedent(
+        '''
+        Genome build for every file matching the directory glob, and for manifest
+        lines without a build. Defaults to GRCh37. Takes the same builds as
+        comfy_BED.py -g, with more than one separated by commas.
+        '''
+    ))
+
+    # number of processes
+    parser.add_argument(
+        '-p', '--processes', action='store', type=int, default=multiprocessing.cpu_count(),
+        help='Number of worker processes. Defaults to the number of CPUs.'
+    )
+
+    # output directory
+    parser.add_argument(
+        '-o', '--output_dir', action='store', default='.',
+        help='Directory to write the BED files to. Defaults to the current directory.'
+    )
+
+    # annotation index
+    parser.add_argument(
+        '-x', '--annotation_index', action='store',
+        help='An annotation index made by comfy_BED_index.py, to load indexed files from.'
+    )
+    addWebArgs(parser)
+    addTimingArgs(parser)
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+def readManifest(manifest_path, default_genome_build='GRCh37'):
+    '''
+    Read a batch manifest into a list of batch items
+
+    Input -
+    manifest_path: String. Path to a tab separated manifest, with columns of
+      LRG (filepath or identifier), transcripts and optionally genome build
+      (any builds comfy_BED.py -g takes, comma separated, see isGenomeBuild).
+    default_genome_build: String. Build used for lines without one.
+
+    Output -
+    batch_items: List of (lrg, transcripts, genome_build) tuples.
+    '''
+    batch_items = []
+    with open(manifest_path) as manifest:
+        for line_number, line in enumerate(manifest, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) not in (2, 3):
+                logger.error('Manifest line %s should have 2 or 3 columns: %s', line_number, line)
+                raise ValueError('Invalid manifest line {}'.format(line_number))
+            genome_build = fields[2] if len(fields) == 3 else default_genome_build
+            if not isGenomeBuild(genome_build):
+                logger.error('Manifest line %s has an invalid genome build: %s', line_number, genome_build)
+                raise ValueError('Invalid genome build on manifest line {}'.format(line_number))
+            batch_items.append((fields[0], fields[1], genome_build))
+    logger.info('Read %s items from manifest %s', len(batch_items), manifest_path)
+    return batch_items
+
+
+def globBatchItems(directory_glob, transcripts, genome_build):
+    '''
+    Make a list of batch items, one per local LRG file matching a glob
+    '''
+    file_names = sorted(glob.glob(os.path.expanduser(directory_glob)))
+    logger.info('Found %s files matching %s', len(file_names), directory_glob)
+    return [(file_name, transcripts, genome_build) for file_name in file_names]
+
+
+def isLocalInput(lrg):
+    '''
+    Batch items are local files if they exist or end with .xml (.xml.gz, .xml.bz2), otherwise LRG identifiers
+    '''
+    return os.path.isfile(lrg) or isLrgXmlPath(lrg)
+
+
+def readLocalLrgId(xml_path):
+    '''
+    The LRG ID of a local LRG file, from its name (e.g. LRG_1 for LRGs/LRG_1.xml.gz)
+    or else from the <id> near the start of the file. None if neither has one.
+    '''
+    lrg_id = stripLrgXmlSuffix(xml_path)
+    if LRG_ID_PATTERN.match(lrg_id):
+        return lrg_id
+    try:
+        with openLrgXml(xml_path) as lrg_file:
+            match = LRG_ID_ELEMENT_PATTERN.search(lrg_file.read(INPUT_READ_CHUNK_SIZE))
+    except (EnvironmentError, ValueError) as error:
+        logger.info('Could not read the LRG ID of %s: %r', xml_path, error)
+        return None
+    return match.group(1).decode('ascii') if match else None
+
+
+def prefetchLrgStatuses(batch_items):
+    '''
+    Look up the statuses of all the batch items in one bulk query, before
+    the batch is split between processes. Local files are looked up by the
+    LRG ID in their name, or in the file (see readLocalLrgId).
+    '''
+    lrg_ids = set()
+    for lrg, transcripts, genome_build in batch_items:
+        lrg_id = readLocalLrgId(lrg) if isLocalInput(lrg) else lrg
+        if lrg_id is not None and LRG_ID_PATTERN.match(lrg_id) and lrg_id not in LRG_STATUSES:
+            lrg_ids.add(lrg_id)
+    if lrg_ids:
+        try:
+            checkLrgStatuses(lrg_ids)
+        except Exception as error:
+            # each item will look its status up on its own instead
+            logger.error('Could not prefetch LRG statuses: %r', error)
+
+
+def convertBatchItem(batch_job):
+    '''
+    Worker function, runs the comfy_BED pipeline for a single batch item.
+    Any error is caught and returned, so that one bad LRG doesn't stop the batch.
+    Everything it logs has the item's lrg as its correlation ID.
+
+    Input -
+    batch_job: Tuple of (batch_item, output_dir, now, annotation_index), where
+      batch_item is a (lrg, transcripts, genome_build) tuple. lrg is treated as a local file if
+      it exists or ends with .xml (or .xml.gz/.xml.bz2), otherwise as an identifier for the web API.
+
+    Output -
+    Tuple of the batch_item, True/False for success, and either the list of BED
+    files written or the error message.
+    '''
+    batch_item, output_dir, now, annotation_index = batch_job
+    lrg, transcripts, genome_build = batch_item
+    with logCorrelation(lrg):
+        try:
+            if isLocalInput(lrg):
+                root = loadLrgInput(local_input=lrg, annotation_index=annotation_index)
+            else:
+                root = loadLrgInput(web_input=lrg)
+            file_names = makeBedFiles(root, transcripts, genome_build, now, output_dir)
+            return (batch_item, True, file_names)
+        except Exception as error:
+            logger.error('Batch item %s failed: %r', lrg, error)
+            return (batch_item, False, repr(error))
+
+
+def timeBatchItem(batch_job):
+    '''
+    Worker function, runs convertBatchItem while timing each stage
+
+    Output -
+    Tuple of the result of convertBatchItem, and the timing records of the item.
+    '''
+    timings = startTimings()
+    try:
+        return convertBatchItem(batch_job), timings.toRecords()
+    finally:
+        stopTimings()
+
+
+def runBatch(batch_items, processes, output_dir='.', now=None, annotation_index=None,
+             timings=None, timings_file=None):
+    '''
+    Run the comfy_BED pipeline over a list of batch items. With more than one
+    process the items are spread over a multiprocessing pool, otherwise they
+    are run one after another in this process.
+
+    If timings (a RunTimings) is given, each item's stages are timed, and
+    added to it. The timings of each item are also appended to timings_file
+    as JSON lines (with the item's lrg), if it is given.
+
+    Output -
+    results: List of (batch_item, success, files or error) tuples, in the same
+      order as batch_items.
+    '''
+    if now is None:
+        now = datetime.datetime.now()
+    prefetchLrgStatuses(batch_items)
+    batch_jobs = [(batch_item, output_dir, now, annotation_index) for batch_item in batch_items]
+    logger.info('Running batch of %s items with %s processes', len(batch_jobs), processes)
+
+    worker = convertBatchItem if timings is None else timeBatchItem
+    if processes > 1 and len(batch_jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(batch_jobs)))
+        try:
+            results = pool.map(worker, batch_jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [worker(batch_job) for batch_job in batch_jobs]
+
+    if timings is not None:
+        timed_results = results
+        results = []
+        for result, records in timed_results:
+            timings.addRecords(records)
+            if timings_file:
+                writeTimings(records, timings_file, lrg=result[0][0])
+            results.append(result)
+    return results
+
+
+def summariseBatch(results):
+    '''
+    Print and log a per-item summary of a batch run, returns the number of failures
+    '''
+    failures = 0
+    for batch_item, success, outcome in results:
+        lrg, transcripts, genome_build = batch_item
+        if success:
+            line = 'OK\t{}\t{}\t{}\t{}'.format(lrg, transcripts, genome_build, ','.join(outcome))
+            logger.info('Batch item succeeded: %s', line)
+        else:
+            failures += 1
+            line = 'FAILED\t{}\t{}\t{}\t{}'.format(lrg, transcripts, genome_build, outcome)
+            logger.error('Batch item failed: %s', line)
+        print(line)
+    print('{} succeeded, {} failed'.format(len(results) - failures, failures))
+    return failures
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+
+    # set up logs, worker processes log through this one
+    setUpLogs(args, now, multiprocess=args.processes > 1)
+    logger.info("comfy_BED batch started running at: %s", now)
+    setUpWeb(args)
+
+    if args.manifest:
+        batch_items = readManifest(args.manifest, args.genome_build)
+    else:
+        batch_items = globBatchItems(args.directory_glob, args.transcripts, args.genome_build)
+
+    # each item is timed in the process that runs it, then the timings are added together
+    timings = RunTimings() if args.timings or args.timing_table else None
+    if args.trace_memory:
+        startMemoryTrace()
+    if args.profile:
+        from comfy_BED_timing import runProfiled
+        results = runProfiled(runBatch, args.profile, batch_items, args.processes, args.output_dir, now,
+                              args.annotation_index, timings, args.timings)
+    else:
+        results = runBatch(batch_items, args.processes, args.output_dir, now, args.annotation_index,
+                           timings, args.timings)
+    failures = summariseBatch(results)
+    reportTimings(args, timings, lrg='all')
+    logger.info("comfy_BED batch run complete")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
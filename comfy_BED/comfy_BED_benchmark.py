@@ -0,0 +1,314 @@
+from __future__ import print_function
+
+import argparse
+import textwrap
+import os
+import sys
+import glob
+import json
+import shutil
+import datetime
+import tempfile
+import subprocess
+import timeit
+
+from comfy_BED import loadLrgXml, getRootLrgId, GENOME_BUILDS
+from comfy_BED_model import buildLrgModel, convertTranscript
+
+# the directory of the comfy_BED scripts, which the timed runs are started in
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# modules that are slow to import, and are only needed by some runs
+HEAVY_MODULES = ('requests', 'numpy', 'csv', 'sqlite3', 'multiprocessing')
+
+BENCHMARK_REPEATS = 10
+BENCHMARK_TOLERANCE = 0.25
+
+# genome builds that every file is converted to when measuring throughput
+THROUGHPUT_BUILDS = ('GRCh37', 'GRCh38')
+
+# the measurements that are compared to a baseline, the others depend too much on the machine
+REGRESSION_MEASUREMENTS = ('import_net', 'first_bed_net', 'parse_per_file', 'convert_per_file', 'write_per_file',
+                           'batch')
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Measures how long comfy_BED takes to start: the time to import it, and
+        the time for a local (-l) run to make its first BED file. Each is the
+        median of several runs in a new interpreter, and is also given with the
+        time to start the interpreter taken off.
+
+        Also measures throughput over many LRG files (-d, or --synthetic to make
+        large synthetic LRGs): the time per file to parse, convert every
+        transcript onto both builds and write the BED rows, and the time to run
+        them all through comfy_BED_batch.py.
+
+        examples:
+        python comfy_BED_benchmark.py -l ../tests/test_data/LRG_5.xml -o startup.json
+          Measures start-up and saves the results
+
+        python comfy_BED_benchmark.py -l ../tests/test_data/LRG_5.xml -b startup.json
+          Measures start-up again, and exits with an error if it has got slower
+
+        python comfy_BED_benchmark.py --synthetic 8 -n 3 -o throughput.json
+          Measures throughput over 8 synthetic LRGs and saves the results
+        '''
+    ))
+
+    # local LRG file to make the BED from
+    parser.add_argument(
+        '-l', '--local_input', action='store',
+        help='The filepath to a local LRG xml file to time making a BED file from'
+    )
+
+    # LRG files to measure throughput over
+    parser.add_argument(
+        '-d', '--directory_glob', action='store',
+        help='A glob matching local LRG xml files to measure throughput over, e.g. "LRGs/*.xml"'
+    )
+    parser.add_argument(
+        '--synthetic', action='store', type=int,
+        help='Measure throughput over this many synthetic LRGs, made by comfy_BED_synthetic.py'
+    )
+    parser.add_argument(
+        '-p', '--processes', action='store', type=int, default=1,
+        help='Number of processes for the batch throughput run. Defaults to 1.'
+    )
+
+    # transcript options
+    parser.add_argument(
+        '-t', '--transcripts', action='store', default='t1',
+        help='Transcripts to make BED files for. Defaults to t1.'
+    )
+
+    # genome build options
+    parser.add_argument(
+        '-g', '--genome_build', action='store',
+        choices=GENOME_BUILDS, default='GRCh37',
+        help="Select genome build from 'GRCh37' or 'GRCh38'. Defaults to GRCh37."
+    )
+
+    # number of runs
+    parser.add_argument(
+        '-n', '--repeats', action='store', type=int, default=BENCHMARK_REPEATS,
+        help='Number of runs to take the median of. Defaults to {}.'.format(BENCHMARK_REPEATS)
+    )
+
+    # results file
+    parser.add_argument(
+        '-o', '--output_file', action='store',
+        help='A JSON file to save the results to, to use as a later baseline'
+    )
+
+    # baseline to compare to
+    parser.add_argument(
+        '-b', '--baseline', action='store',
+        help='A JSON results file from an earlier run, to check for regressions against'
+    )
+    parser.add_argument(
+        '--tolerance', action='store', type=float, default=BENCHMARK_TOLERANCE,
+        help=textwrap.dedent(
+        '''
+        How much slower than the baseline a measurement can be before it counts
+        as a regression, as a fraction. Defaults to {}.
+        '''.format(BENCHMARK_TOLERANCE)
+    ))
+    args = parser.parse_args()
+    if not (args.local_input or args.directory_glob or args.synthetic):
+        parser.error('one of -l, -d or --synthetic is needed')
+    return args
+
+
+def timeCommand(command, repeats, cwd=SCRIPT_DIR):
+    '''
+    Median wall clock time, in seconds, of running a command repeats times.
+    The command has to succeed every time.
+    '''
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeats):
+            start = timeit.default_timer()
+            return_code = subprocess.call(command, cwd=cwd, stdout=devnull, stderr=devnull)
+            times.append(timeit.default_timer() - start)
+            if return_code != 0:
+                raise RuntimeError('Benchmark command failed: ' + ' '.join(command))
+    times.sort()
+    return times[len(times) // 2]
+
+
+def getImportedModules(module_name='comfy_BED'):
+    '''
+    The HEAVY_MODULES that importing a comfy_BED module loads, in a new interpreter
+    '''
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import sys, {}; print(" ".join(sorted(sys.modules)))'.format(module_name)],
+        cwd=SCRIPT_DIR)
+    loaded = set(output.decode('utf-8').split())
+    return [module for module in HEAVY_MODULES if module in loaded]
+
+
+def measureStartup(xml_path, transcripts='t1', genome_build='GRCh37', repeats=BENCHMARK_REPEATS):
+    '''
+    Time starting the interpreter, importing comfy_BED, and a local run
+    of comfy_BED.py making BED files. The run uses a status snapshot so it
+    doesn't go to the web, and writes its BED files and log to a temporary
+    directory.
+
+    Output -
+    results: Dictionary of measurement name to median time in seconds. The
+      '_net' times have the interpreter start-up time taken off.
+    '''
+    xml_path = os.path.abspath(xml_path)
+    lrg_id = getRootLrgId(loadLrgXml(xml_path))
+    run_dir = tempfile.mkdtemp(prefix='comfy_BED_benchmark_')
+    try:
+        status_file = os.path.join(run_dir, 'lrg_statuses.tsv')
+        with open(status_file, 'w') as snapshot:
+            snapshot.write('{}\tpublic\n'.format(lrg_id))
+
+        interpreter = timeCommand([sys.executable, '-c', 'pass'], repeats)
+        import_time = timeCommand([sys.executable, '-c', 'import comfy_BED'], repeats)
+        first_bed = timeCommand([sys.executable, os.path.join(SCRIPT_DIR, 'comfy_BED.py'), '-l', xml_path,
+                                 '-t', transcripts, '-g', genome_build, '-s', status_file],
+                                repeats, cwd=run_dir)
+    finally:
+        shutil.rmtree(run_dir)
+    return {
+        'interpreter': interpreter,
+        'import': import_time,
+        'import_net': import_time - interpreter,
+        'first_bed': first_bed,
+        'first_bed_net': first_bed - interpreter,
+    }
+
+
+def measureThroughput(xml_paths, repeats=BENCHMARK_REPEATS, processes=1):
+    '''
+    Time each stage of converting LRG files in this process, and running them
+    all through the batch pipeline. Every transcript of every file is converted
+    onto both genome builds. Statuses come from a snapshot, so nothing goes to
+    the web, and BED files are written to a temporary directory.
+
+    Output -
+    results: Dictionary of measurement name to median time in seconds:
+      'parse_per_file', 'convert_per_file' and 'write_per_file' (loading the
+      xml into an LrgModel, converting it and writing its BED rows, per file),
+      and 'batch' (running comfy_BED_batch over all the files with processes),
+      with the number of 'files' and converted 'exons'.
+    '''
+    # imported here as they are only needed for throughput
+    from comfy_BED_output import BedOutput
+    from comfy_BED_web import loadStatusSnapshot
+    from comfy_BED_batch import runBatch
+
+    run_dir = tempfile.mkdtemp(prefix='comfy_BED_benchmark_')
+    stage_times = {'parse': [], 'convert': [], 'write': []}
+    batch_times = []
+    try:
+        for repeat in range(repeats):
+            totals = dict((stage, 0.0) for stage in stage_times)
+            lrg_ids = []
+            exon_count = 0
+            for xml_path in xml_paths:
+                start = timeit.default_timer()
+                model = buildLrgModel(loadLrgXml(xml_path))
+                parsed = timeit.default_timer()
+                rows = []
+                for genome_build in THROUGHPUT_BUILDS:
+                    genome_mapping = model.getGenomeMapping(genome_build)
+                    for transcript in model.transcripts.values():
+                        rows.extend(convertTranscript(transcript, genome_mapping))
+                converted = timeit.default_timer()
+                with BedOutput(os.path.join(run_dir, model.lrg_id + '.bed')) as bed_output:
+                    bed_output.writeRows(rows)
+                written = timeit.default_timer()
+                totals['parse'] += parsed - start
+                totals['convert'] += converted - parsed
+                totals['write'] += written - converted
+                lrg_ids.append(model.lrg_id)
+                exon_count += len(rows)
+            for stage in stage_times:
+                stage_times[stage].append(totals[stage] / len(xml_paths))
+
+            status_file = os.path.join(run_dir, 'lrg_statuses.tsv')
+            with open(status_file, 'w') as snapshot:
+                snapshot.writelines('{}\tpublic\n'.format(lrg_id) for lrg_id in lrg_ids)
+            loadStatusSnapshot(status_file)
+            batch_items = [(xml_path, 'all', ','.join(THROUGHPUT_BUILDS)) for xml_path in xml_paths]
+            start = timeit.default_timer()
+            results = runBatch(batch_items, processes, run_dir, datetime.datetime.now())
+            batch_times.append(timeit.default_timer() - start)
+            if not all(result[1] for result in results):
+                raise RuntimeError('Benchmark batch failed: ' + str([result for result in results if not result[1]]))
+    finally:
+        shutil.rmtree(run_dir)
+
+    results = dict((stage + '_per_file', sorted(times)[len(times) // 2]) for stage, times in stage_times.items())
+    results.update(batch=sorted(batch_times)[len(batch_times) // 2], files=len(xml_paths), exons=exon_count)
+    return results
+
+
+def findRegressions(results, baseline, tolerance=BENCHMARK_TOLERANCE):
+    '''
+    Compare results to a baseline from an earlier run
+
+    Output -
+    regressions: List of (name, baseline time, new time) tuples, for each of
+      the REGRESSION_MEASUREMENTS that is more than tolerance slower than the baseline.
+    '''
+    regressions = []
+    for name in sorted(results):
+        if name in REGRESSION_MEASUREMENTS and name in baseline and results[name] > baseline[name] * (1 + tolerance):
+            regressions.append((name, baseline[name], results[name]))
+    return regressions
+
+
+def main():
+    args = getArgs()
+    results = {}
+    if args.local_input:
+        results.update(measureStartup(args.local_input, args.transcripts, args.genome_build, args.repeats))
+        for name in ('interpreter', 'import', 'import_net', 'first_bed', 'first_bed_net'):
+            print('{:<17}{:>10.1f} ms'.format(name, results[name] * 1000))
+        print('heavy modules loaded by import: {}'.format(', '.join(getImportedModules()) or 'none'))
+
+    xml_paths = sorted(glob.glob(os.path.expanduser(args.directory_glob))) if args.directory_glob else []
+    synthetic_dir = None
+    try:
+        if args.synthetic:
+            from comfy_BED_synthetic import writeSyntheticLrgs
+            synthetic_dir = tempfile.mkdtemp(prefix='comfy_BED_synthetic_')
+            xml_paths += writeSyntheticLrgs(synthetic_dir, args.synthetic)
+        if xml_paths:
+            results.update(measureThroughput(xml_paths, args.repeats, args.processes))
+            print('{} files, {} exons converted per run'.format(results['files'], results['exons']))
+            for name in ('parse_per_file', 'convert_per_file', 'write_per_file', 'batch'):
+                print('{:<17}{:>10.1f} ms'.format(name, results[name] * 1000))
+    finally:
+        if synthetic_dir is not None:
+            shutil.rmtree(synthetic_dir)
+
+    if args.output_file:
+        with open(args.output_file, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = findRegressions(results, json.load(baseline_file), args.tolerance)
+        for name, baseline_time, new_time in regressions:
+            print('REGRESSION\t{}\t{:.1f} ms -> {:.1f} ms'.format(name, baseline_time * 1000, new_time * 1000))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
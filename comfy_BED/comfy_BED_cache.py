@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import errno
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import collections
+
+logger = logging.getLogger('comfy_BED')
+
+# how long each kind of web response stays fresh, in seconds
+# 'search' is an EBI search query (LRG ID resolution and checking an LRG exists),
+# 'status' is the public/pending status of an LRG and 'xml' is an LRG xml file
+DEFAULT_CACHE_TTLS = {
+    'search': 7 * 24 * 60 * 60,
+    'status': 24 * 60 * 60,
+    'xml': 24 * 60 * 60,
+}
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+CacheEntry = collections.namedtuple(
+    'CacheEntry', ['url', 'kind', 'digest', 'size', 'etag', 'last_modified', 'fetched_at', 'accessed_at'])
+
+
+class CachedResponse(object):
+    '''
+    Stands in for a requests response when the body comes from the cache
+    '''
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class LrgWebCache(object):
+    '''
+    Persistent on-disk cache of web service responses.
+
+    Response bodies are stored once each under the sha256 of their content
+    in '<cache_dir>/objects', and an sqlite index maps each url to its body,
+    the kind of response, its ETag/Last-Modified headers and the times it was
+    fetched and last used. Once the bodies take up more than max_bytes, the
+    least recently used entries are evicted.
+
+    In offline mode the cache never goes to the network: stale entries are
+    used as they are, and anything missing is an error.
+    '''
+    def __init__(self, cache_dir, ttls=None, max_bytes=DEFAULT_CACHE_MAX_BYTES, offline=False):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.ttls = dict(DEFAULT_CACHE_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.index_path = os.path.join(self.cache_dir, 'index.sqlite')
+        makeDirs(self.objects_dir)
+        with self.connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, kind TEXT, digest TEXT, size INTEGER, '
+                'etag TEXT, last_modified TEXT, fetched_at REAL, accessed_at REAL)'
+            )
+
+    def connect(self):
+        '''
+        Open the index. A new connection is used each time so the cache can be
+        shared between threads and processes.
+        '''
+        return ClosingConnection(sqlite3.connect(self.index_path, timeout=30))
+
+    def objectPath(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def get(self, url):
+        '''
+        Get the cache entry for a url and mark it as used, returns None if the url isn't cached
+        '''
+        with self.connect() as db:
+            row = db.execute('SELECT * FROM entries WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE entries SET accessed_at = ? WHERE url = ?', (time.time(), url))
+        entry = CacheEntry(*row)
+        if not os.path.isfile(self.objectPath(entry.digest)):
+            logger.warning('Cached body for %s is missing, ignoring the cache entry', url)
+            return None
+        return entry
+
+    def isFresh(self, entry):
+        '''
+        Checks whether a cache entry is younger than the TTL for its kind
+        '''
+        return time.time() - entry.fetched_at < self.ttls.get(entry.kind, 0)
+
+    def readBody(self, entry):
+        with open(self.objectPath(entry.digest), 'rb') as body_file:
+            return body_file.read()
+
+    def put(self, url, kind, content, etag=None, last_modified=None):
+        '''
+        Store a response body for a url, then evict old entries if the cache is over size
+        '''
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self.objectPath(digest)
+        if not os.path.isfile(object_path):
+            makeDirs(os.path.dirname(object_path))
+            # write to a temporary file first so a partly written body is never used
+            handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(object_path))
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(content)
+            os.rename(temp_path, object_path)
+
+        now = time.time()
+        with self.connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, kind, digest, len(content), etag, last_modified, now, now)
+            )
+        logger.info('Cached %s response for %s', kind, url)
+        self.evict()
+
+    def touch(self, url):
+        '''
+        Mark an entry as freshly fetched, after the server says it has not changed
+        '''
+        now = time.time()
+        with self.connect() as db:
+            db.execute('UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+
+    def totalSize(self):
+        '''
+        Total size in bytes of the cached bodies, counting shared bodies once
+        '''
+        with self.connect() as db:
+            return db.execute('SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM entries)').fetchone()[0]
+
+    def evict(self):
+        '''
+        Remove least recently used entries until the cache fits in max_bytes
+        '''
+        with self.connect() as db:
+            rows = db.execute('SELECT url, digest, size FROM entries ORDER BY accessed_at DESC').fetchall()
+            kept_size = 0
+            kept_digests = set()
+            evicted_urls = []
+            for url, digest, size in rows:
+                if digest in kept_digests:
+                    continue
+                if kept_size + size <= self.max_bytes:
+                    kept_size += size
+                    kept_digests.add(digest)
+                else:
+                    evicted_urls.append(url)
+            for url in evicted_urls:
+                db.execute('DELETE FROM entries WHERE url = ?', (url,))
+            live_digests = set(row[0] for row in db.execute('SELECT DISTINCT digest FROM entries'))
+
+        # remove bodies that no entry points at any more
+        for digest in set(row[1] for row in rows) - live_digests:
+            try:
+                os.remove(self.objectPath(digest))
+            except OSError:
+                pass
+        if evicted_urls:
+            logger.info('Evicted %s entries from the cache', len(evicted_urls))
+
+
+class ClosingConnection(object):
+    '''
+    Context manager that commits an sqlite connection if there was no error, then closes it
+    '''
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.connection.commit()
+        finally:
+            self.connection.close()
+
+
+def makeDirs(path):
+    '''
+    Make a directory and its parents, if it doesn't already exist
+    '''
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,289 @@
+import bisect
+import logging
+
+import six
+
+from comfy_BED_errors import NoGenomeMappingError, UnmappedPositionError
+from comfy_BED_xml import getXmlBackend
+
+# NumPy is optional, positions are converted one at a time without it.
+# It is only imported (by loadNumpy) the first time there are at least
+# NUMPY_MIN_POSITIONS positions to convert at once, as importing it takes
+# longer than converting a few transcripts without it.
+NUMPY_NOT_LOADED = object()
+numpy = NUMPY_NOT_LOADED
+NUMPY_MIN_POSITIONS = 1000
+
+logger = logging.getLogger('comfy_BED')
+
+# Mapping types of the primary assemblies, preferred over patches and alternate loci
+ASSEMBLY_MAPPING_TYPES = ('main_assembly', 'other_assembly')
+
+
+def loadNumpy():
+    '''
+    Import NumPy on first use, returns None if it isn't installed
+    '''
+    global numpy
+    if numpy is NUMPY_NOT_LOADED:
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            numpy_module = None
+        numpy = numpy_module
+    return numpy
+
+
+def makeReverseSegment(lrg_start, lrg_end, anchor, strand):
+    '''
+    Turn a segment of LRG positions into a segment of the genomic positions it
+    covers, (genomic_start, genomic_end, anchor, strand), where anchor is the
+    LRG position of genomic_start
+    '''
+    genomic_end = anchor + strand * (lrg_end - lrg_start)
+    if strand == 1:
+        return (anchor, genomic_end, lrg_start, 1)
+    return (genomic_end, anchor, lrg_end, -1)
+
+
+class GenomeMapping(object):
+    '''
+    The piecewise mapping of an LRG onto a genome build. Each mapping span is
+    split into gap-free segments at every insertion or deletion diff, and each
+    segment converts LRG positions with its own offset. Mismatch diffs don't
+    move positions, so they don't split a segment.
+
+    Input -
+    chrom: String. The chromosome, e.g. 'chr1'.
+    spans: List of (lrg_start, lrg_end, other_start, other_end, strand, diffs) tuples,
+      one per mapping span. strand is 1 or -1, diffs is a list of (type, lrg_start,
+      lrg_end, other_start, other_end) tuples.
+    '''
+    def __init__(self, chrom, spans):
+        if not spans:
+            logger.error('The genome mapping onto %s has no mapping spans', chrom)
+            raise NoGenomeMappingError('A genome mapping needs at least one mapping span')
+        self.chrom = chrom
+        self.strand = spans[0][4]
+        self.other_start = min(span[2] for span in spans)
+        self.other_end = max(span[3] for span in spans)
+
+        # segments are (lrg_start, lrg_end, anchor, strand), where anchor is the genomic position of lrg_start.
+        # Bases inserted in the LRG are converted as part of the segment before them, but only bases that
+        # are in both the LRG and the genome convert back, so the reverse segments leave insertions out.
+        segments = []
+        reverse_segments = []
+        for lrg_start, lrg_end, other_start, other_end, strand, diffs in sorted(spans):
+            segment_start = lrg_start
+            anchor = other_start if strand == 1 else other_end
+            for diff_type, diff_lrg_start, diff_lrg_end, diff_other_start, diff_other_end in sorted(
+                    diffs, key=lambda diff: diff[1]):
+                if diff_type == 'lrg_ins':
+                    # bases only in the LRG, the genome carries on from the base after the insertion
+                    split_at = diff_lrg_end + 1
+                    shared_end = diff_lrg_start - 1
+                    next_anchor = diff_other_end if strand == 1 else diff_other_start
+                elif diff_type == 'other_ins':
+                    # bases only in the genome, the LRG base after them is past the insertion
+                    split_at = diff_lrg_end
+                    shared_end = split_at - 1
+                    next_anchor = diff_other_end + 1 if strand == 1 else diff_other_start - 1
+                else:
+                    continue
+                segments.append((segment_start, split_at - 1, anchor, strand))
+                reverse_segments.append(makeReverseSegment(segment_start, shared_end, anchor, strand))
+                segment_start, anchor = split_at, next_anchor
+            segments.append((segment_start, lrg_end, anchor, strand))
+            reverse_segments.append(makeReverseSegment(segment_start, lrg_end, anchor, strand))
+        self.segments = segments
+        self.segment_starts = [segment[0] for segment in segments]
+        self.reverse_segments = sorted(segment for segment in reverse_segments if segment[0] <= segment[1])
+        self.reverse_segment_starts = [segment[0] for segment in self.reverse_segments]
+        # NumPy copies of the segments, made the first time they are needed
+        self.segment_arrays = None
+        self.reverse_segment_arrays = None
+
+    def __repr__(self):
+        return 'GenomeMapping({!r}, {} segments)'.format(self.chrom, len(self.segments))
+
+    def toGenomic(self, lrg_positions, strict=True):
+        '''
+        Convert LRG positions to genomic positions, all in one go if NumPy is
+        installed and there are at least NUMPY_MIN_POSITIONS of them
+
+        Input -
+        lrg_positions: List (or array) of integer LRG positions.
+        strict: Boolean. If True a position that isn't in any mapping span throws
+          an UnmappedPositionError, otherwise it converts to None.
+
+        Output -
+        genomic_positions: List of integer genomic positions, in the same order.
+        '''
+        if len(lrg_positions) >= NUMPY_MIN_POSITIONS and loadNumpy() is not None:
+            if self.segment_arrays is None:
+                self.segment_arrays = numpy.array(self.segments, dtype=numpy.int64).T
+            return self.convertArray(self.segment_arrays, lrg_positions, strict, 'LRG')
+        return self.convertList(self.segments, self.segment_starts, lrg_positions, strict, 'LRG')
+
+    def toLrg(self, genomic_positions, strict=True):
+        '''
+        Convert genomic positions to LRG positions, the reverse of toGenomic.
+        Genomic positions of bases that aren't in the LRG (insertions in the
+        genome, or gaps between spans) don't convert.
+        '''
+        if len(genomic_positions) >= NUMPY_MIN_POSITIONS and loadNumpy() is not None:
+            if self.reverse_segment_arrays is None:
+                self.reverse_segment_arrays = numpy.array(self.reverse_segments, dtype=numpy.int64).reshape(-1, 4).T
+            return self.convertArray(self.reverse_segment_arrays, genomic_positions, strict, 'genomic')
+        return self.convertList(self.reverse_segments, self.reverse_segment_starts, genomic_positions, strict, 'genomic')
+
+    def convertList(self, segments, segment_starts, positions, strict, coord_system):
+        '''
+        Convert positions one at a time, with a binary search for the segment each is in
+        '''
+        converted_positions = []
+        for position in positions:
+            index = bisect.bisect_right(segment_starts, position) - 1
+            if index < 0 or position > segments[index][1]:
+                converted_positions.append(self.unmapped(position, strict, coord_system))
+                continue
+            segment_start, segment_end, anchor, strand = segments[index]
+            converted_positions.append(anchor + strand * (position - segment_start))
+        return converted_positions
+
+    def convertArray(self, segment_arrays, positions, strict, coord_system):
+        '''
+        Convert positions in one batch with NumPy
+        '''
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        starts, ends, anchors, strands = segment_arrays
+        # positions before the first segment are looked up in it, then marked as unmapped
+        indexes = (numpy.searchsorted(starts, positions, side='right') - 1).clip(0)
+        unmapped = (positions < starts[indexes]) | (positions > ends[indexes])
+        converted_positions = (anchors[indexes] + strands[indexes] * (positions - starts[indexes])).tolist()
+        for index in numpy.flatnonzero(unmapped):
+            converted_positions[index] = self.unmapped(int(positions[index]), strict, coord_system)
+        return converted_positions
+
+    def unmapped(self, position, strict, coord_system):
+        if strict:
+            logger.error('%s position %s is not in any mapping span on %s', coord_system, position, self.chrom)
+            raise UnmappedPositionError('{} position {} is not in the genome mapping'.format(coord_system, position))
+        return None
+
+
+class MappingRecord(object):
+    '''
+    One <mapping> element of an LRG, read into plain values so the xml
+    doesn't need to be walked again to make a GenomeMapping from it.
+
+    Input -
+    coord_system: String. The assembly, e.g. 'GRCh37.p13'.
+    other_name: String. The chromosome name, without 'chr'.
+    mapping_type: String. e.g. 'main_assembly' or 'patch', or None if not given.
+    spans: List of (lrg_start, lrg_end, other_start, other_end, strand, diffs) tuples,
+      with strand as written in the xml ('1' or '-1').
+    '''
+    __slots__ = ('coord_system', 'other_name', 'mapping_type', 'spans')
+
+    def __init__(self, coord_system, other_name, mapping_type, spans):
+        self.coord_system = coord_system
+        self.other_name = other_name
+        self.mapping_type = mapping_type
+        self.spans = spans
+
+    def __repr__(self):
+        return 'MappingRecord({!r}, {!r}, {} spans)'.format(self.coord_system, self.mapping_type, len(self.spans))
+
+
+def readMapping(mapping):
+    '''
+    Read a <mapping> element, with all its spans and diffs, into a MappingRecord
+    '''
+    spans = []
+    for m_span in mapping.iter('mapping_span'):
+        diffs = [(diff.get('type'), int(diff.get('lrg_start')), int(diff.get('lrg_end')),
+                  int(diff.get('other_start')), int(diff.get('other_end'))) for diff in m_span.iter('diff')]
+        spans.append((int(m_span.get('lrg_start')), int(m_span.get('lrg_end')), int(m_span.get('other_start')),
+                      int(m_span.get('other_end')), m_span.get('strand'), diffs))
+    return MappingRecord(mapping.get('coord_system'), mapping.get('other_name'), mapping.get('type'), spans)
+
+
+def isAssemblyMapping(mapping):
+    '''
+    Mappings without a type (e.g. from an annotation index) are taken to be onto the primary assembly
+    '''
+    return mapping.mapping_type is None or mapping.mapping_type in ASSEMBLY_MAPPING_TYPES
+
+
+def makeGenomeMapping(mapping_records, genome_build):
+    '''
+    Make a GenomeMapping from all the mapping spans and diffs of an LRG's
+    mapping onto a genome build, from the LRG's MappingRecords. Mappings onto
+    the primary assembly are used over mappings onto patches.
+    '''
+    mappings = [mapping for mapping in mapping_records if str(mapping.coord_system).startswith(genome_build)]
+    assembly_mappings = [mapping for mapping in mappings if isAssemblyMapping(mapping)]
+    if not mappings:
+        logger.error("The LRG has no mapping to %s", genome_build)
+        raise NoGenomeMappingError('No mapping to {}'.format(genome_build))
+    mapping = (assembly_mappings or mappings)[0]
+
+    spans = [(lrg_start, lrg_end, other_start, other_end, parseStrand(strand), diffs)
+             for lrg_start, lrg_end, other_start, other_end, strand, diffs in mapping.spans]
+    genome_mapping = GenomeMapping('chr{}'.format(mapping.other_name), spans)
+    logger.info("Loaded the %s mapping of the LRG, %s spans and %s segments",
+                genome_build, len(spans), len(genome_mapping.segments))
+    return genome_mapping
+
+
+def loadGenomeMapping(root, genome_build):
+    '''
+    Make a GenomeMapping for a genome build straight from the root of an LRG,
+    see makeGenomeMapping
+    '''
+    return makeGenomeMapping([readMapping(mapping) for mapping in getXmlBackend().mappings(root, genome_build)], genome_build)
+
+
+def parseStrand(strand):
+    '''
+    Strands are written as '1' (5' -> 3') or '-1' (3' -> 5'), anything else throws an error
+    '''
+    if strand == '1':
+        return 1
+    elif strand == '-1':
+        return -1
+    # raise a value error if strand is anything other than 1 or -1
+    raise ValueError('Cannot determine strand')
+
+
+def convertExons(transcript_dict, genome_mapping):
+    '''
+    Convert LRG exon boundary positions into genomic positions, converting the
+    starts and ends of every exon in one batch.
+
+    Input -
+    transcript_dict: Dictionary from getLrgExons, key is exon label, value is
+      tuple of LRG start and LRG end.
+    genome_mapping: GenomeMapping from loadGenomeMapping.
+
+    Output -
+    list_of_exons: List of tuples, one per exon in the transcript_dict. Each tuple
+      contains the chromosome, genome start coordinate, genome end coordinate and
+      exon label, with the smallest coordinate first.
+    '''
+    exon_labels = []
+    lrg_positions = []
+    # use six library for iterating as it has support for both python 2 and 3
+    for exon_label, (lrg_start, lrg_end) in six.iteritems(transcript_dict):
+        exon_labels.append(str(exon_label))
+        lrg_positions.extend((int(lrg_start), int(lrg_end)))
+    genomic_positions = genome_mapping.toGenomic(lrg_positions)
+
+    list_of_exons = []
+    for i, exon_label in enumerate(exon_labels):
+        start, end = genomic_positions[2 * i], genomic_positions[2 * i + 1]
+        # start and end are switched round on the 3' -> 5' strand, because bed files should have the smallest value first
+        list_of_exons.append((genome_mapping.chrom, min(start, end), max(start, end), exon_label))
+    logger.info("Converted LRG start-and-end coordinates, to genomic coordinates, for the user-selected genome build and transcript")
+    return list_of_exons
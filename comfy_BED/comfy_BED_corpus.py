@@ -0,0 +1,354 @@
+from __future__ import print_function
+
+import argparse
+import textwrap
+import os
+import json
+import glob
+import hashlib
+import datetime
+import logging
+import tempfile
+import multiprocessing
+
+from comfy_BED import setUpLogs, addLogArgs, loadLrgXml, GENOME_BUILDS
+from comfy_BED_cache import makeDirs
+from comfy_BED_model import buildLrgModel, convertTranscript
+from comfy_BED_errors import NoGenomeMappingError
+from comfy_BED_output import BedOutput
+from comfy_BED_input import LRG_XML_SUFFIXES
+from comfy_BED_logs import logCorrelation
+
+logger = logging.getLogger('comfy_BED')
+
+# the manifest and the converted rows of each file are kept in the output directory
+CORPUS_MANIFEST = 'corpus_manifest.json'
+CORPUS_PARTS_DIR = 'corpus_parts'
+
+# change when the conversion changes, so that every file is converted again
+CORPUS_FORMAT_VERSION = 1
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Converts every transcript of every LRG in a directory, and writes one
+        merged, sorted BED file per genome build. A manifest of each file's
+        content hash is kept, so running again only converts the files that
+        have been added or changed since (or every file, if the settings have
+        changed), and reuses the rows of the rest.
+
+        examples:
+        python comfy_BED_corpus.py -d ~/Documents/LRGs -o lrg_corpus
+          Writes lrg_corpus/lrg_corpus_GRCh37.bed and lrg_corpus/lrg_corpus_GRCh38.bed
+
+        python comfy_BED_corpus.py -d "~/Documents/LRGs/*.xml" -o lrg_corpus -g GRCh38 --tabix
+          Writes a compressed, tabix indexed GRCh38 BED file
+        '''
+    ))
+
+    # input directory
+    parser.add_argument(
+        '-d', '--directory', action='store', required=True,
+        help='A directory of LRG xml files, or a glob matching them, e.g. "LRGs/*.xml"'
+    )
+
+    # output directory
+    parser.add_argument(
+        '-o', '--output_dir', action='store', required=True,
+        help='Directory to write the merged BED files, the manifest and the converted rows of each file to'
+    )
+
+    # genome build options
+    parser.add_argument(
+        '-g', '--genome_builds', action='store', nargs='+',
+        choices=GENOME_BUILDS, default=list(GENOME_BUILDS),
+        help='Genome builds to write BED files for. Defaults to both.'
+    )
+
+    # number of processes
+    parser.add_argument(
+        '-p', '--processes', action='store', type=int, default=multiprocessing.cpu_count(),
+        help='Number of worker processes. Defaults to the number of CPUs.'
+    )
+
+    # output options
+    parser.add_argument(
+        '--bgzip', action='store_true',
+        help='BGZF compress the merged BED files'
+    )
+    parser.add_argument(
+        '--tabix', action='store_true',
+        help='Write a tabix index of each merged BED file. Turns on --bgzip.'
+    )
+
+    # full rebuild
+    parser.add_argument(
+        '--rebuild', action='store_true',
+        help='Convert every file, even if it is unchanged since the last run'
+    )
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+def findCorpusFiles(directory):
+    '''
+    The LRG xml files (compressed or not) in a directory, or matching a glob, sorted by path
+    '''
+    directory = os.path.expanduser(directory)
+    if os.path.isdir(directory):
+        patterns = [os.path.join(directory, '*' + suffix) for suffix in LRG_XML_SUFFIXES]
+    else:
+        patterns = [directory]
+    xml_paths = sorted(os.path.abspath(xml_path) for pattern in patterns for xml_path in glob.glob(pattern))
+    logger.info('Found %s LRG files in %s', len(xml_paths), directory)
+    return xml_paths
+
+
+def hashFile(path):
+    '''
+    The sha256 hex digest of a file's contents
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as hash_file:
+        for chunk in iter(lambda: hash_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def makeSettings(genome_builds):
+    '''
+    The settings that the converted rows depend on. Files are all converted
+    again if these differ from the settings in the manifest.
+    '''
+    return {'version': CORPUS_FORMAT_VERSION, 'genome_builds': sorted(genome_builds)}
+
+
+def loadManifest(manifest_path):
+    '''
+    Load a corpus manifest, or make an empty one if there isn't one yet
+
+    Output -
+    manifest: Dictionary with the 'settings' of the last run, the merged 'outputs'
+      it wrote, and 'files': a dictionary of xml path to a dictionary of its size,
+      mtime, sha256, lrg_id, and the number of rows or the error it failed with.
+    '''
+    if not os.path.isfile(manifest_path):
+        return {'settings': None, 'outputs': [], 'files': {}}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def writeManifest(manifest, manifest_path):
+    '''
+    Save a corpus manifest, through a temporary file so a partly written manifest is never read
+    '''
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(manifest_path)))
+    with os.fdopen(handle, 'w') as temp_file:
+        json.dump(manifest, temp_file, indent=1, sort_keys=True)
+    os.rename(temp_path, manifest_path)
+
+
+def planCorpus(xml_paths, manifest, settings, rebuild=False):
+    '''
+    Work out which files need converting. Files whose size and mtime match the
+    manifest are taken to be unchanged without reading them, other files are
+    hashed and only converted if their contents have changed.
+
+    Output -
+    to_convert: List of (xml_path, sha256) tuples of new or changed files.
+    unchanged: Dictionary of xml path to manifest entry, for the files that can be reused.
+    '''
+    reuse = not rebuild and manifest['settings'] == settings
+    to_convert = []
+    unchanged = {}
+    for xml_path in xml_paths:
+        stat = os.stat(xml_path)
+        entry = manifest['files'].get(xml_path) if reuse else None
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            unchanged[xml_path] = entry
+            continue
+        digest = hashFile(xml_path)
+        if entry is not None and entry['sha256'] == digest:
+            unchanged[xml_path] = dict(entry, size=stat.st_size, mtime=stat.st_mtime)
+        else:
+            to_convert.append((xml_path, digest))
+    logger.info('%s files to convert, %s unchanged', len(to_convert), len(unchanged))
+    return to_convert, unchanged
+
+
+def partPath(parts_dir, digest):
+    return os.path.join(parts_dir, digest + '.tsv')
+
+
+def convertCorpusFile(corpus_job):
+    '''
+    Worker function, converts every transcript of one LRG file onto each
+    genome build it maps to, and saves the rows to the file's part file
+    (named by its content hash). Builds the LRG has no mapping to are skipped.
+    Any error is caught and returned, so that one bad file doesn't stop the corpus.
+    Everything it logs has the file's name as its correlation ID.
+
+    Input -
+    corpus_job: Tuple of (xml_path, sha256, genome_builds, parts_dir).
+
+    Output -
+    entry: Dictionary for the manifest, with the file's size, mtime, sha256, and
+      either its lrg_id and number of rows, or the error.
+    '''
+    xml_path, digest, genome_builds, parts_dir = corpus_job
+    stat = os.stat(xml_path)
+    entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest}
+    with logCorrelation(os.path.basename(xml_path)):
+        try:
+            model = buildLrgModel(loadLrgXml(xml_path))
+            lines = []
+            for genome_build in genome_builds:
+                try:
+                    genome_mapping = model.getGenomeMapping(genome_build)
+                except NoGenomeMappingError:
+                    continue
+                for transcript in model.transcripts.values():
+                    for chrom, start, end, exon in convertTranscript(transcript, genome_mapping):
+                        lines.append('{}\t{}\t{}\t{}\t{}_{}_{}\n'.format(
+                            genome_build, chrom, start, end, model.lrg_id, transcript.name, exon))
+            handle, temp_path = tempfile.mkstemp(dir=parts_dir)
+            with os.fdopen(handle, 'w') as part_file:
+                part_file.writelines(lines)
+            os.rename(temp_path, partPath(parts_dir, digest))
+            entry.update(lrg_id=model.lrg_id, rows=len(lines))
+        except Exception as error:
+            logger.error('Could not convert %s: %r', xml_path, error)
+            entry['error'] = repr(error)
+    return xml_path, entry
+
+
+def mergeCorpus(entries, parts_dir, output_dir, genome_builds, now, compress=False, index=False):
+    '''
+    Merge the part files of every converted LRG into one sorted BED file per genome build
+
+    Output -
+    output_paths: List of the BED files written, in the order of genome_builds.
+    '''
+    suffix = '.bed.gz' if compress or index else '.bed'
+    output_paths = [os.path.join(output_dir, 'lrg_corpus_' + genome_build + suffix) for genome_build in genome_builds]
+    bed_outputs = dict((genome_build, BedOutput(output_path, sort=True, compress=compress, index=index))
+                       for genome_build, output_path in zip(genome_builds, output_paths))
+    try:
+        lrg_count = sum(1 for entry in entries.values() if 'error' not in entry)
+        for bed_output in bed_outputs.values():
+            bed_output.writeComment('LRG corpus BED generated at: ' + now.strftime("%Y-%m-%d %H:%M"))
+            bed_output.writeComment('Converted from {} LRG files'.format(lrg_count))
+        for xml_path in sorted(entries):
+            if 'error' in entries[xml_path]:
+                continue
+            with open(partPath(parts_dir, entries[xml_path]['sha256'])) as part_file:
+                for line in part_file:
+                    genome_build, chrom, start, end, name = line.rstrip('\n').split('\t')
+                    bed_outputs[genome_build].writeRows([(chrom, int(start), int(end), name)])
+    finally:
+        for bed_output in bed_outputs.values():
+            bed_output.close()
+    return output_paths
+
+
+def runCorpus(directory, output_dir, genome_builds=GENOME_BUILDS, processes=1, now=None,
+              compress=False, index=False, rebuild=False):
+    '''
+    Convert a corpus of LRG files, only converting the files that are new or
+    have changed since the last run, and write the merged BED file of each build.
+    The merged files are only written again if something has changed.
+
+    Output -
+    summary: Dictionary of the lists of xml paths that were 'converted',
+      'unchanged', 'failed' and 'removed' (no longer in the corpus), and the
+      merged 'outputs', or an empty list if they were already up to date.
+    '''
+    if now is None:
+        now = datetime.datetime.now()
+    genome_builds = [genome_build for genome_build in GENOME_BUILDS if genome_build in genome_builds]
+    parts_dir = os.path.join(output_dir, CORPUS_PARTS_DIR)
+    makeDirs(parts_dir)
+    manifest_path = os.path.join(output_dir, CORPUS_MANIFEST)
+    manifest = loadManifest(manifest_path)
+    settings = makeSettings(genome_builds)
+
+    xml_paths = findCorpusFiles(directory)
+    to_convert, entries = planCorpus(xml_paths, manifest, settings, rebuild)
+    corpus_jobs = [(xml_path, digest, genome_builds, parts_dir) for xml_path, digest in to_convert]
+    if processes > 1 and len(corpus_jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(corpus_jobs)))
+        try:
+            converted = pool.map(convertCorpusFile, corpus_jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        converted = [convertCorpusFile(corpus_job) for corpus_job in corpus_jobs]
+    entries.update(converted)
+
+    # part files that no file uses any more are deleted
+    part_names = set(entry['sha256'] + '.tsv' for entry in entries.values() if 'error' not in entry)
+    for part_name in os.listdir(parts_dir):
+        if part_name not in part_names:
+            os.remove(os.path.join(parts_dir, part_name))
+
+    removed = sorted(set(manifest['files']) - set(entries))
+    outputs = []
+    suffix = '.bed.gz' if compress or index else '.bed'
+    expected_outputs = [os.path.join(output_dir, 'lrg_corpus_' + genome_build + suffix) for genome_build in genome_builds]
+    if (converted or removed or manifest['outputs'] != expected_outputs
+            or not all(os.path.isfile(output_path) for output_path in expected_outputs)
+            or (index and not all(os.path.isfile(output_path + '.tbi') for output_path in expected_outputs))):
+        outputs = mergeCorpus(entries, parts_dir, output_dir, genome_builds, now, compress, index)
+    else:
+        logger.info('The merged BED files are up to date')
+
+    writeManifest({'settings': settings, 'outputs': expected_outputs, 'files': entries}, manifest_path)
+    return {
+        'converted': [xml_path for xml_path, entry in converted],
+        'unchanged': sorted(set(entries) - set(xml_path for xml_path, entry in converted)),
+        'failed': sorted(xml_path for xml_path, entry in entries.items() if 'error' in entry),
+        'removed': removed,
+        'outputs': outputs,
+    }
+
+
+def summariseCorpus(summary):
+    '''
+    Print and log a summary of a corpus run, returns the number of files that failed
+    '''
+    for xml_path in summary['failed']:
+        print('FAILED\t{}'.format(xml_path))
+    for output_path in summary['outputs']:
+        print('WROTE\t{}'.format(output_path))
+    line = '{} converted, {} unchanged, {} failed, {} removed'.format(
+        len(summary['converted']), len(summary['unchanged']), len(summary['failed']), len(summary['removed']))
+    logger.info('Corpus run: %s', line)
+    print(line)
+    return len(summary['failed'])
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    setUpLogs(args, now, multiprocess=args.processes > 1)
+    logger.info("comfy_BED corpus started running at: %s", now)
+    summary = runCorpus(args.directory, args.output_dir, args.genome_builds, args.processes, now,
+                        args.bgzip, args.tabix, args.rebuild)
+    failures = summariseCorpus(summary)
+    logger.info("comfy_BED corpus run complete")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
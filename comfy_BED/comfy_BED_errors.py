@@ -0,0 +1,73 @@
+'''
+Exceptions raised by comfy_BED, so that programs using it as a library can
+tell the kinds of failure apart. They all subclass ComfyBedError.
+
+Errors about bad input also subclass ValueError, so code written against
+the older ValueError behaviour still catches them.
+'''
+
+
+class ComfyBedError(Exception):
+    '''
+    Base class of every comfy_BED error
+    '''
+
+
+class InvalidInputError(ComfyBedError, ValueError):
+    '''
+    The input isn't a readable LRG: not a file, not an xml file or not an LRG
+    '''
+
+
+class InvalidXmlError(InvalidInputError):
+    '''
+    The input isn't well formed xml, e.g. a truncated file, whichever xml backend parsed it
+    '''
+
+
+class InvalidTranscriptError(ComfyBedError, ValueError):
+    '''
+    A requested transcript isn't in the LRG
+    '''
+
+
+class NoGenomeMappingError(ComfyBedError, ValueError):
+    '''
+    The LRG has no mapping to the requested genome build
+    '''
+
+
+class UnmappedPositionError(ComfyBedError, ValueError):
+    '''
+    A position isn't in any span of the genome mapping
+    '''
+
+
+class LrgNotFoundError(ComfyBedError, ValueError):
+    '''
+    An identifier doesn't resolve to exactly one LRG, or the LRG doesn't exist
+    '''
+
+
+class WebServiceError(ComfyBedError):
+    '''
+    A web service query failed, or the web is needed but not allowed
+    '''
+
+
+class OfflineCacheMissError(WebServiceError, ValueError):
+    '''
+    A web response is needed that isn't in the cache, and the cache is offline
+    '''
+
+
+class LrgStatusError(ComfyBedError):
+    '''
+    The status of an LRG couldn't be resolved as public or pending
+    '''
+
+
+class AnnotationIndexError(ComfyBedError, ValueError):
+    '''
+    An annotation index doesn't exist, or was made by a different version of comfy_BED_index.py
+    '''
@@ -0,0 +1,207 @@
+import argparse
+import textwrap
+import os
+import glob
+import datetime
+import logging
+
+from comfy_BED import setUpLogs, addLogArgs, LrgTreeTarget, loadLrgXml
+from comfy_BED_web import makeIdentifierKeys, getLrgListing
+from comfy_BED_errors import WebServiceError
+
+logger = logging.getLogger('comfy_BED')
+
+# Paths (below the root element) of the LRG elements that hold identifiers
+ID_KEEP_PATHS = frozenset([
+    ('fixed_annotation',),
+    ('fixed_annotation', 'id'),
+    ('fixed_annotation', 'sequence_source'),
+    ('updatable_annotation',),
+    ('updatable_annotation', 'annotation_set'),
+    ('updatable_annotation', 'annotation_set', 'lrg_locus'),
+    ('updatable_annotation', 'annotation_set', 'features'),
+    ('updatable_annotation', 'annotation_set', 'features', 'gene'),
+    ('updatable_annotation', 'annotation_set', 'features', 'gene', 'symbol'),
+    ('updatable_annotation', 'annotation_set', 'features', 'gene', 'transcript'),
+    ('updatable_annotation', 'annotation_set', 'features', 'gene', 'transcript', 'protein_product'),
+])
+ID_TEXT_PATHS = frozenset([
+    ('fixed_annotation', 'id'),
+    ('fixed_annotation', 'sequence_source'),
+    ('updatable_annotation', 'annotation_set', 'lrg_locus'),
+])
+
+# columns of the public LRG listing that hold identifiers
+LISTING_ID_COLUMNS = (
+    'HGNC_SYMBOL', 'REFSEQGENE', 'REFSEQ_TRANSCRIPT', 'REFSEQ_PROTEIN',
+    'ENSEMBL_GENE', 'ENSEMBL_TRANSCRIPT', 'ENSEMBL_PROTEIN',
+)
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Builds a local index of LRG identifiers (HGNC symbols, RefSeq and Ensembl
+        accessions) which comfy_BED.py can use with -i instead of searching the web.
+
+        examples:
+        python comfy_BED_ids.py -d "~/Documents/LRGs/*.xml" -o lrg_ids.tsv
+          Indexes the identifiers in a directory of LRG xml files
+
+        python comfy_BED_ids.py -w -o lrg_ids.tsv
+          Indexes the identifiers in the public LRG listing on the LRG website
+        '''
+    ))
+
+    # make option to index either local files or the web listing (not both)
+    input_method = parser.add_mutually_exclusive_group(required=True)
+
+    # directory glob
+    input_method.add_argument(
+        '-d', '--directory_glob', action='store',
+        help='A glob matching local LRG xml files, e.g. "LRGs/*.xml"'
+    )
+
+    # web listing
+    input_method.add_argument(
+        '-w', '--web_listing', action='store_true',
+        help='Index the public LRG listing from the LRG website'
+    )
+
+    # output index file
+    parser.add_argument(
+        '-o', '--id_index', action='store', required=True,
+        help='The filepath to write the identifier index to'
+    )
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+def addIdentifier(id_index, identifier, lrg_id):
+    '''
+    Add an identifier of an LRG to an index of identifier keys to sets of LRG IDs
+    '''
+    if identifier and identifier.strip() not in ('', '-'):
+        for key in makeIdentifierKeys(identifier):
+            id_index.setdefault(key, set()).add(lrg_id)
+
+
+def getLrgIdentifiers(root):
+    '''
+    Get the LRG ID and the identifiers of the LRG's own gene from an LRG
+    loaded with the ID_KEEP_PATHS. Genes in the updatable annotation that
+    aren't the LRG's gene (neighbouring genes) are not included.
+
+    Output -
+    lrg_id: String. The LRG ID.
+    identifiers: Set of strings. HGNC symbol, RefSeqGene and the RefSeq and
+      Ensembl gene, transcript and protein accessions.
+    '''
+    lrg_id = root.find('fixed_annotation/id').text.strip()
+    identifiers = set([lrg_id])
+    sequence_source = root.find('fixed_annotation/sequence_source')
+    if sequence_source is not None and sequence_source.text:
+        identifiers.add(sequence_source.text.strip())
+
+    symbol = None
+    for lrg_locus in root.iter('lrg_locus'):
+        symbol = lrg_locus.text.strip()
+        identifiers.add(symbol)
+
+    for gene in root.iter('gene'):
+        gene_symbol = gene.find('symbol')
+        if gene_symbol is None or gene_symbol.get('name') != symbol:
+            continue
+        # NCBI gene accessions are bare numbers, which aren't useful to search by
+        if not str(gene.get('accession')).isdigit():
+            identifiers.add(gene.get('accession'))
+        for transcript in gene.iter('transcript'):
+            identifiers.add(transcript.get('accession'))
+            for protein_product in transcript.iter('protein_product'):
+                identifiers.add(protein_product.get('accession'))
+
+    identifiers.discard(None)
+    return lrg_id, identifiers
+
+
+def buildIdIndexFromXmls(xml_paths):
+    '''
+    Make an identifier index from local LRG xml files
+
+    Output -
+    id_index: Dict of identifier key to a set of LRG IDs
+    '''
+    id_index = {}
+    for xml_path in xml_paths:
+        # the identifiers are spread through the whole updatable annotation, so read to the end
+        root = loadLrgXml(xml_path, LrgTreeTarget(ID_KEEP_PATHS, ID_TEXT_PATHS, stop_at_lrg_set=False))
+        lrg_id, identifiers = getLrgIdentifiers(root)
+        for identifier in identifiers:
+            addIdentifier(id_index, identifier, lrg_id)
+    logger.info('Indexed %s identifiers from %s LRG files', len(id_index), len(xml_paths))
+    return id_index
+
+
+def buildIdIndexFromListing(listing_text):
+    '''
+    Make an identifier index from the public LRG listing. The last comment
+    line before the data names the columns, the first column is the LRG ID.
+
+    Output -
+    id_index: Dict of identifier key to a set of LRG IDs
+    '''
+    id_index = {}
+    columns = None
+    for line in listing_text.splitlines():
+        if not line.strip():
+            continue
+        if line.startswith('#'):
+            columns = line.lstrip('#').strip().split('\t')
+            continue
+        if columns is None:
+            logger.error('The LRG listing has no header line')
+            raise WebServiceError('The LRG listing has no header line')
+        fields = dict(zip(columns, line.split('\t')))
+        lrg_id = line.split('\t')[0].strip()
+        addIdentifier(id_index, lrg_id, lrg_id)
+        for column in LISTING_ID_COLUMNS:
+            addIdentifier(id_index, fields.get(column), lrg_id)
+    logger.info('Indexed %s identifiers from the LRG listing', len(id_index))
+    return id_index
+
+
+def writeIdIndex(id_index, id_index_path, now):
+    '''
+    Save an identifier index as a tab separated file of identifier key and
+    LRG ID, with one line per LRG for identifiers that match more than one.
+    The file is loaded with comfy_BED_web.loadIdIndex.
+    '''
+    with open(id_index_path, 'w') as id_index_file:
+        id_index_file.write('#LRG identifier index made at: ' + now.strftime("%Y-%m-%d %H:%M") + '\n')
+        for key in sorted(id_index):
+            for lrg_id in sorted(id_index[key]):
+                id_index_file.write('{}\t{}\n'.format(key, lrg_id))
+    logger.info('Wrote identifier index to %s', id_index_path)
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    setUpLogs(args, now)
+
+    if args.directory_glob:
+        id_index = buildIdIndexFromXmls(sorted(glob.glob(os.path.expanduser(args.directory_glob))))
+    else:
+        id_index = buildIdIndexFromListing(getLrgListing())
+    writeIdIndex(id_index, args.id_index, now)
+
+if __name__ == '__main__':
+    main()
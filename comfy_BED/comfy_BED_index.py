@@ -0,0 +1,288 @@
+import argparse
+import textwrap
+import os
+import glob
+import sqlite3
+import datetime
+import logging
+import xml.etree.ElementTree as ET
+
+from comfy_BED import setUpLogs, addLogArgs, loadLrgXml
+from comfy_BED_cache import ClosingConnection
+from comfy_BED_errors import AnnotationIndexError
+from comfy_BED_model import getRootLrgId
+from comfy_BED_xml import getXmlBackend
+
+logger = logging.getLogger('comfy_BED')
+
+ANNOTATION_INDEX_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS lrgs (source_path TEXT PRIMARY KEY, lrg_id TEXT, '
+    'source_size INTEGER, source_mtime REAL)',
+    'CREATE TABLE IF NOT EXISTS transcripts (source_path TEXT, transcript_order INTEGER, name TEXT)',
+    'CREATE TABLE IF NOT EXISTS exons (source_path TEXT, transcript_order INTEGER, transcript TEXT, '
+    'exon_order INTEGER, label TEXT, start INTEGER, end INTEGER)',
+    'CREATE TABLE IF NOT EXISTS coding_regions (source_path TEXT, transcript_order INTEGER, start INTEGER, end INTEGER)',
+    'CREATE TABLE IF NOT EXISTS mappings (source_path TEXT, mapping_order INTEGER, coord_system TEXT, '
+    'other_name TEXT, other_start INTEGER, other_end INTEGER, type TEXT)',
+    'CREATE TABLE IF NOT EXISTS mapping_spans (source_path TEXT, mapping_order INTEGER, span_order INTEGER, '
+    'lrg_start INTEGER, lrg_end INTEGER, other_start INTEGER, other_end INTEGER, strand TEXT)',
+    'CREATE TABLE IF NOT EXISTS mapping_diffs (source_path TEXT, mapping_order INTEGER, span_order INTEGER, '
+    'type TEXT, lrg_start INTEGER, lrg_end INTEGER, other_start INTEGER, other_end INTEGER, '
+    'lrg_sequence TEXT, other_sequence TEXT)',
+    'CREATE INDEX IF NOT EXISTS transcripts_source ON transcripts (source_path)',
+    'CREATE INDEX IF NOT EXISTS exons_source ON exons (source_path)',
+    'CREATE INDEX IF NOT EXISTS coding_regions_source ON coding_regions (source_path)',
+    'CREATE INDEX IF NOT EXISTS mappings_source ON mappings (source_path)',
+    'CREATE INDEX IF NOT EXISTS mapping_spans_source ON mapping_spans (source_path)',
+    'CREATE INDEX IF NOT EXISTS mapping_diffs_source ON mapping_diffs (source_path)',
+)
+INDEX_TABLES = ('lrgs', 'transcripts', 'exons', 'coding_regions', 'mappings', 'mapping_spans', 'mapping_diffs')
+
+# indexes made before the current version are missing tables, so their files are indexed again
+ANNOTATION_INDEX_VERSION = 2
+DIFF_ATTRIBUTES = ('type', 'lrg_start', 'lrg_end', 'other_start', 'other_end', 'lrg_sequence', 'other_sequence')
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Compiles a directory of LRG xml files into an annotation index, which
+        comfy_BED.py can use with -x instead of parsing the xml files.
+        Files that are already indexed and haven't changed are skipped, as
+        are files that can't be read as LRGs (which are listed at the end).
+
+        examples:
+        python comfy_BED_index.py -d "~/Documents/LRGs/*.xml" -o lrg_annotation.sqlite
+          Indexes every LRG xml in the directory
+        '''
+    ))
+
+    # directory glob
+    parser.add_argument(
+        '-d', '--directory_glob', action='store', required=True,
+        help='A glob matching local LRG xml files, e.g. "LRGs/*.xml"'
+    )
+
+    # output index file
+    parser.add_argument(
+        '-o', '--annotation_index', action='store', required=True,
+        help='The filepath of the annotation index to make or update'
+    )
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+def createIndex(index_path):
+    '''
+    Open an annotation index to add files to it, making it and its tables if
+    they don't exist yet. Files indexed by an older version of the index are
+    dropped from it, so they are indexed again.
+    '''
+    connection = ClosingConnection(sqlite3.connect(index_path, timeout=30))
+    for statement in ANNOTATION_INDEX_SCHEMA:
+        connection.connection.execute(statement)
+    if connection.connection.execute('PRAGMA user_version').fetchone()[0] < ANNOTATION_INDEX_VERSION:
+        connection.connection.execute('DELETE FROM lrgs')
+        connection.connection.execute('PRAGMA user_version = {}'.format(ANNOTATION_INDEX_VERSION))
+        connection.connection.commit()
+    return connection
+
+
+def openIndex(index_path):
+    '''
+    Open an existing annotation index to read from it. Nothing is written, so
+    read-only indexes can be used. Throws an AnnotationIndexError if the index
+    doesn't exist, or was made by a different version of comfy_BED_index.py.
+    '''
+    if not os.path.isfile(index_path):
+        logger.error('The annotation index does not exist: %s', index_path)
+        raise AnnotationIndexError('The annotation index {} does not exist'.format(index_path))
+    connection = sqlite3.connect(index_path, timeout=30)
+    index_version = connection.execute('PRAGMA user_version').fetchone()[0]
+    if index_version != ANNOTATION_INDEX_VERSION:
+        connection.close()
+        logger.error('The annotation index %s is version %s, this version of comfy_BED reads version %s',
+                     index_path, index_version, ANNOTATION_INDEX_VERSION)
+        logger.error('Run comfy_BED_index.py on it again to update it')
+        raise AnnotationIndexError('The annotation index {} is version {}, not version {}'.format(
+            index_path, index_version, ANNOTATION_INDEX_VERSION))
+    return ClosingConnection(connection)
+
+
+def getSourceStat(xml_path):
+    '''
+    Size and modification time of an LRG file, used to spot files that changed after indexing
+    '''
+    stat = os.stat(xml_path)
+    return stat.st_size, stat.st_mtime
+
+
+def dropLrg(db, xml_path):
+    '''
+    Remove a file from the index
+    '''
+    for table in INDEX_TABLES:
+        db.execute('DELETE FROM {} WHERE source_path = ?'.format(table), (xml_path,))
+
+
+def indexLrg(db, root, xml_path):
+    '''
+    Add an LRG (loaded with loadLrgXml) to the index, replacing any older copy of the same file.
+    Rows are keyed by the file rather than the LRG ID, so different versions of an LRG can be indexed.
+    '''
+    xml_backend = getXmlBackend()
+    lrg_id = getRootLrgId(root)
+    dropLrg(db, xml_path)
+
+    source_size, source_mtime = getSourceStat(xml_path)
+    db.execute('INSERT INTO lrgs VALUES (?, ?, ?, ?)', (xml_path, lrg_id, source_size, source_mtime))
+
+    # only the coordinates in the LRG's own coordinate system are used
+    for transcript_order, transcript in enumerate(xml_backend.transcripts(root)):
+        db.execute('INSERT INTO transcripts VALUES (?, ?, ?)', (xml_path, transcript_order, transcript.get('name')))
+        for exon_order, exon in enumerate(xml_backend.exons(transcript)):
+            start = end = None
+            for coordinate in xml_backend.coordinates(exon, lrg_id):
+                start = int(coordinate.get('start'))
+                end = int(coordinate.get('end'))
+            db.execute('INSERT INTO exons VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                xml_path, transcript_order, transcript.get('name'), exon_order, exon.get('label'), start, end))
+        for coordinate in xml_backend.codingCoordinates(transcript, lrg_id):
+            db.execute('INSERT INTO coding_regions VALUES (?, ?, ?, ?)', (
+                xml_path, transcript_order, int(coordinate.get('start')), int(coordinate.get('end'))))
+
+    for mapping_order, mapping in enumerate(xml_backend.mappings(root)):
+        db.execute('INSERT INTO mappings VALUES (?, ?, ?, ?, ?, ?, ?)', (
+            xml_path, mapping_order, mapping.get('coord_system'), mapping.get('other_name'),
+            mapping.get('other_start'), mapping.get('other_end'), mapping.get('type')))
+        for span_order, m_span in enumerate(mapping.iter('mapping_span')):
+            db.execute('INSERT INTO mapping_spans VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                xml_path, mapping_order, span_order, int(m_span.get('lrg_start')), int(m_span.get('lrg_end')),
+                int(m_span.get('other_start')), int(m_span.get('other_end')), m_span.get('strand')))
+            for diff in m_span.iter('diff'):
+                db.execute('INSERT INTO mapping_diffs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (xml_path, mapping_order, span_order) + tuple(diff.get(name) for name in DIFF_ATTRIBUTES))
+    return lrg_id
+
+
+def compileAnnotationIndex(xml_paths, index_path):
+    '''
+    Compile LRG xml files into an annotation index, skipping files that are
+    already indexed and haven't changed since. Files that can't be read as
+    LRGs are logged, left out of the index and listed in skipped.
+
+    Output -
+    indexed: List of the LRG IDs that were (re)indexed
+    skipped: List of the paths of the files that couldn't be indexed
+    '''
+    indexed = []
+    skipped = []
+    with createIndex(index_path) as db:
+        for xml_path in xml_paths:
+            xml_path = os.path.abspath(xml_path)
+            try:
+                row = db.execute('SELECT source_size, source_mtime FROM lrgs WHERE source_path = ?', (xml_path,)).fetchone()
+                if row is not None and tuple(row) == getSourceStat(xml_path):
+                    continue
+                indexed.append(indexLrg(db, loadLrgXml(xml_path), xml_path))
+            except sqlite3.Error:
+                raise
+            except Exception as error:
+                logger.error('Not indexing %s, it could not be read as an LRG: %r', xml_path, error)
+                dropLrg(db, xml_path)
+                skipped.append(xml_path)
+    logger.info('Indexed %s of %s LRG files into %s', len(indexed), len(xml_paths), index_path)
+    if skipped:
+        logger.error('Skipped %s LRG files that could not be read: %s', len(skipped), ', '.join(skipped))
+    return indexed, skipped
+
+
+def loadLrgFromIndex(index_path, xml_path):
+    '''
+    Load an LRG from the annotation index instead of parsing its xml file
+
+    Input -
+    index_path: String. Path to an annotation index made by compileAnnotationIndex.
+    xml_path: String. Path to the LRG xml file.
+
+    Output -
+    root: Element. An LRG tree with the same ID, transcripts, exons and
+      mappings as loadLrgXml makes from the xml file, or None if the file
+      isn't indexed or has changed since it was indexed.
+      Throws an AnnotationIndexError if the index can't be read, see openIndex.
+    '''
+    xml_path = os.path.abspath(xml_path)
+    with openIndex(index_path) as db:
+        row = db.execute('SELECT lrg_id, source_size, source_mtime FROM lrgs WHERE source_path = ?', (xml_path,)).fetchone()
+        if row is None or tuple(row[1:]) != getSourceStat(xml_path):
+            return None
+        lrg_id = row[0]
+        transcript_names = db.execute('SELECT transcript_order, name FROM transcripts '
+                                      'WHERE source_path = ? ORDER BY transcript_order', (xml_path,)).fetchall()
+        exons = db.execute('SELECT transcript_order, transcript, label, start, end FROM exons '
+                           'WHERE source_path = ? ORDER BY transcript_order, exon_order', (xml_path,)).fetchall()
+        coding_regions = db.execute('SELECT transcript_order, start, end FROM coding_regions '
+                                    'WHERE source_path = ? ORDER BY rowid', (xml_path,)).fetchall()
+        mappings = db.execute('SELECT mapping_order, coord_system, other_name, other_start, other_end, type FROM mappings '
+                              'WHERE source_path = ? ORDER BY mapping_order', (xml_path,)).fetchall()
+        spans = db.execute('SELECT mapping_order, span_order, lrg_start, lrg_end, other_start, other_end, strand '
+                           'FROM mapping_spans WHERE source_path = ? ORDER BY mapping_order, span_order', (xml_path,)).fetchall()
+        diffs = db.execute('SELECT mapping_order, span_order, {} FROM mapping_diffs WHERE source_path = ?'.format(
+            ', '.join(DIFF_ATTRIBUTES)), (xml_path,)).fetchall()
+
+    # rebuild the parts of the tree that comfy_BED reads
+    root = ET.Element('lrg')
+    fixed_annotation = ET.SubElement(root, 'fixed_annotation')
+    ET.SubElement(fixed_annotation, 'id').text = lrg_id
+    transcripts = {}
+    for transcript_order, transcript_name in transcript_names:
+        transcripts[transcript_order] = ET.SubElement(fixed_annotation, 'transcript', name=transcript_name)
+    for transcript_order, transcript_name, label, start, end in exons:
+        exon = ET.SubElement(transcripts[transcript_order], 'exon', label=label)
+        if start is not None:
+            ET.SubElement(exon, 'coordinates', coord_system=lrg_id, start=str(start), end=str(end))
+    for transcript_order, start, end in coding_regions:
+        ET.SubElement(ET.SubElement(transcripts[transcript_order], 'coding_region'), 'coordinates',
+                      coord_system=lrg_id, start=str(start), end=str(end))
+
+    annotation_set = ET.SubElement(ET.SubElement(root, 'updatable_annotation'), 'annotation_set', type='lrg')
+    mapping_elements = {}
+    for mapping_order, coord_system, other_name, other_start, other_end, mapping_type in mappings:
+        mapping_elements[mapping_order] = ET.SubElement(
+            annotation_set, 'mapping', coord_system=coord_system, other_name=other_name,
+            other_start=str(other_start), other_end=str(other_end))
+        if mapping_type is not None:
+            mapping_elements[mapping_order].set('type', mapping_type)
+    span_elements = {}
+    for mapping_order, span_order, lrg_start, lrg_end, other_start, other_end, strand in spans:
+        span_elements[(mapping_order, span_order)] = ET.SubElement(
+            mapping_elements[mapping_order], 'mapping_span', lrg_start=str(lrg_start), lrg_end=str(lrg_end),
+            other_start=str(other_start), other_end=str(other_end), strand=strand)
+    for diff in diffs:
+        attributes = dict((name, str(value)) for name, value in zip(DIFF_ATTRIBUTES, diff[2:]) if value is not None)
+        ET.SubElement(span_elements[(diff[0], diff[1])], 'diff', attributes)
+
+    logger.info("Loaded %s from the annotation index", lrg_id)
+    return root
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    setUpLogs(args, now)
+    indexed, skipped = compileAnnotationIndex(sorted(glob.glob(os.path.expanduser(args.directory_glob))),
+                                              args.annotation_index)
+    for xml_path in skipped:
+        print('SKIPPED\t{}'.format(xml_path))
+    return 1 if skipped else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
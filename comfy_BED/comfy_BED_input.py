@@ -0,0 +1,146 @@
+import os
+import sys
+import bz2
+import zlib
+import logging
+import contextlib
+
+from comfy_BED_errors import InvalidInputError
+
+logger = logging.getLogger('comfy_BED')
+
+# the file names local LRG input can have, read as they are, gunzipped or bunzipped
+LRG_XML_SUFFIXES = ('.xml', '.xml.gz', '.xml.bz2')
+
+# local input read from stdin instead of a file
+STDIN_INPUT = '-'
+
+# compressed input is recognised from its first bytes, whatever the file is called
+GZIP_MAGIC = b'\x1f\x8b'
+BZ2_MAGIC = b'BZh'
+
+INPUT_READ_CHUNK_SIZE = 64 * 1024
+
+
+def isLrgXmlPath(path):
+    '''
+    True if a path is named like a (possibly compressed) LRG xml file
+    '''
+    return path.endswith(LRG_XML_SUFFIXES)
+
+
+def stripLrgXmlSuffix(path):
+    '''
+    The file name of an LRG xml file without its suffix, e.g. LRG_1 for LRGs/LRG_1.xml.gz
+    '''
+    file_name = os.path.basename(path)
+    for suffix in sorted(LRG_XML_SUFFIXES, key=len, reverse=True):
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return os.path.splitext(file_name)[0]
+
+
+def findLrgXmlFile(directory, lrg_id):
+    '''
+    The LRG xml file for an LRG ID in a directory, compressed or not, or None if there isn't one
+    '''
+    for suffix in LRG_XML_SUFFIXES:
+        xml_path = os.path.join(directory, lrg_id + suffix)
+        if os.path.isfile(xml_path):
+            return xml_path
+    return None
+
+
+def makeDecompressor(data):
+    '''
+    A zlib or bz2 decompressor for data starting with a gzip or bzip2 header, otherwise None
+    '''
+    if data.startswith(GZIP_MAGIC):
+        # 16 + MAX_WBITS reads the gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if data.startswith(BZ2_MAGIC):
+        return bz2.BZ2Decompressor()
+    return None
+
+
+class DecompressingReader(object):
+    '''
+    Reads a binary stream, decompressing it as it goes if it is gzip or
+    bzip2 compressed. Nothing is written to disk and the stream doesn't have
+    to be seekable, so it works for stdin. Files made of several compressed
+    members (e.g. BGZF, or concatenated gzip files) are read to the end.
+
+    Input -
+    raw_file: File-like object opened in binary mode.
+    '''
+    def __init__(self, raw_file):
+        self.raw_file = raw_file
+        self.pending = self.readHeader(b'')
+        self.decompressor = makeDecompressor(self.pending)
+        self.compressed = self.decompressor is not None
+
+    def readHeader(self, data):
+        '''
+        Read on from data until there are enough bytes to recognise a compressed header, or the stream ends
+        '''
+        while len(data) < len(BZ2_MAGIC):
+            chunk = self.raw_file.read(INPUT_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read(self, size=INPUT_READ_CHUNK_SIZE):
+        '''
+        Up to about size bytes of the decompressed stream, or b'' at the end
+        '''
+        while True:
+            data, self.pending = self.pending or self.raw_file.read(size), b''
+            if not data and getattr(self.decompressor, 'eof', True) is False:
+                # only Python 3 decompressors know if they have reached the end
+                logger.error('The compressed input ends part way through')
+                raise InvalidInputError('The compressed input is truncated.')
+            if not data or not self.compressed:
+                return data
+            if self.decompressor is None:
+                # the start of the next member
+                data = self.readHeader(data)
+                self.decompressor = makeDecompressor(data)
+                if self.decompressor is None:
+                    logger.error('The input has data that is not compressed after the compressed data')
+                    raise InvalidInputError('The input has trailing data that is not compressed.')
+            try:
+                decompressed = self.decompressor.decompress(data)
+            except EOFError:
+                # a bzip2 member ended exactly at the end of the last read
+                self.pending, self.decompressor = data, None
+                continue
+            except (zlib.error, IOError, OSError, ValueError) as error:
+                logger.error('The input could not be decompressed: %s', error)
+                raise InvalidInputError('The input could not be decompressed.')
+            if self.decompressor.unused_data:
+                self.pending = self.decompressor.unused_data
+                self.decompressor = None
+            if decompressed:
+                return decompressed
+
+
+@contextlib.contextmanager
+def openLrgXml(local_input):
+    '''
+    Open local LRG input for reading: a file, which can be gzip or bzip2
+    compressed (whatever the file is called), or stdin for '-'. Uncompressed
+    files are read as they are, in chunks.
+
+    Input -
+    local_input: String. A filepath, or '-' for stdin.
+
+    Output -
+    lrg_file: Binary file-like object with a read method, giving the uncompressed xml.
+    '''
+    if local_input == STDIN_INPUT:
+        yield DecompressingReader(getattr(sys.stdin, 'buffer', sys.stdin))
+        return
+
+    with open(local_input, 'rb') as raw_file:
+        yield DecompressingReader(raw_file)
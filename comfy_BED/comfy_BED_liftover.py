@@ -0,0 +1,270 @@
+import argparse
+import textwrap
+import os
+import sys
+import glob
+import datetime
+import logging
+
+from comfy_BED import setUpLogs, addLogArgs, setUpWeb, addWebArgs, loadLrgInput, GENOME_BUILDS
+from comfy_BED_model import buildLrgModel
+from comfy_BED_input import stripLrgXmlSuffix
+
+logger = logging.getLogger('comfy_BED')
+
+# Rows are read and converted this many at a time, which bounds the memory used
+LIFTOVER_BATCH_SIZE = 100000
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Converts a tab separated file of LRG positions (e.g. a VCF against LRGs,
+        with the LRG ID in the CHROM column) to genomic positions, or the reverse.
+        The file is streamed, so it can be any size. Lines starting with '#' are
+        copied to the output unchanged.
+
+        Going from LRG to genome, the LRG ID column is replaced with the chromosome
+        and the position column with the genomic position. Going from genome to
+        LRG, only the position column is replaced. Only positions are converted,
+        alleles on the 3' -> 5' strand are not reverse complemented.
+
+        examples:
+        python comfy_BED_liftover.py lrg_variants.vcf -d "~/Documents/LRGs/*.xml" -g GRCh38 -o genomic_variants.vcf
+          Converts the LRG positions in a VCF to GRCh38 positions
+
+        python comfy_BED_liftover.py genomic_positions.tsv -r -d "~/Documents/LRGs/*.xml" > lrg_positions.tsv
+          Converts GRCh37 positions to LRG positions, where the first column holds the LRG ID
+        '''
+    ))
+
+    # input file
+    parser.add_argument(
+        'input_file', action='store',
+        help="The tab separated file of positions to convert, or '-' to read from stdin"
+    )
+
+    # output file
+    parser.add_argument(
+        '-o', '--output_file', action='store', default='-',
+        help="The file to write the converted positions to. Defaults to stdout."
+    )
+
+    # unconverted rows
+    parser.add_argument(
+        '-u', '--unmapped_file', action='store',
+        help="A file to write rows that couldn't be converted to. They are dropped if not given."
+    )
+
+    # genome build options
+    parser.add_argument(
+        '-g', '--genome_build', action='store',
+        choices=GENOME_BUILDS, default='GRCh37',
+        help="Select genome build from 'GRCh37' or 'GRCh38'. Defaults to GRCh37."
+    )
+
+    # direction
+    parser.add_argument(
+        '-r', '--reverse', action='store_true',
+        help='Convert genomic positions to LRG positions, instead of LRG positions to genomic positions'
+    )
+
+    # columns
+    parser.add_argument(
+        '--id_column', action='store', type=int, default=1,
+        help='The column (counting from 1) with the LRG ID in. Defaults to 1.'
+    )
+    parser.add_argument(
+        '--position_column', action='store', type=int, default=2,
+        help='The column (counting from 1) with the position to convert in. Defaults to 2.'
+    )
+
+    # where the LRGs come from
+    parser.add_argument(
+        '-d', '--directory_glob', action='store',
+        help=textwrap.dedent(
+        '''
+        A glob matching local LRG xml files named by LRG ID, e.g. "LRGs/*.xml".
+        LRGs that aren't found locally are fetched from the web.
+        '''
+    ))
+    parser.add_argument(
+        '-x', '--annotation_index', action='store',
+        help='An annotation index made by comfy_BED_index.py, to load indexed files from.'
+    )
+    addWebArgs(parser)
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+class MappingLoader(object):
+    '''
+    Loads the genome mapping of each LRG the first time it is needed, from a
+    local file if there is one and otherwise from the web. LRGs that can't be
+    loaded are only tried once.
+
+    Input -
+    genome_build: String. 'GRCh37' or 'GRCh38'.
+    xml_paths: List of local LRG xml files, named <LRG ID>.xml (or .xml.gz/.xml.bz2).
+    annotation_index: String. Optional annotation index to load local files from.
+    '''
+    def __init__(self, genome_build, xml_paths=(), annotation_index=None):
+        self.genome_build = genome_build
+        self.annotation_index = annotation_index
+        self.xml_paths = dict((stripLrgXmlSuffix(xml_path), xml_path) for xml_path in xml_paths)
+        self.mappings = {}
+
+    def get(self, lrg_id):
+        '''
+        The GenomeMapping of an LRG, or None if it can't be loaded
+        '''
+        if lrg_id not in self.mappings:
+            try:
+                if lrg_id in self.xml_paths:
+                    root = loadLrgInput(local_input=self.xml_paths[lrg_id], annotation_index=self.annotation_index)
+                else:
+                    root = loadLrgInput(web_input=lrg_id)
+                self.mappings[lrg_id] = buildLrgModel(root).getGenomeMapping(self.genome_build)
+            except Exception as error:
+                logger.error('Could not load the %s mapping of %s: %r', self.genome_build, lrg_id, error)
+                self.mappings[lrg_id] = None
+        return self.mappings[lrg_id]
+
+
+def readBatches(lines, batch_size=LIFTOVER_BATCH_SIZE):
+    '''
+    Generator, splits an iterable of lines into lists of at most batch_size lines
+    '''
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def liftoverBatch(batch, mapping_loader, reverse=False, id_column=0, position_column=1):
+    '''
+    Convert the positions in a batch of lines, grouping the rows by LRG so that
+    each LRG's positions are converted in one go
+
+    Input -
+    batch: List of tab separated lines.
+    mapping_loader: MappingLoader for the genome build to convert to (or from).
+    reverse: Boolean. Convert genomic positions to LRG positions if True.
+    id_column, position_column: Integers. Columns (counting from 0) of the LRG ID and position.
+
+    Output -
+    converted: List of (line, success) tuples, in the same order as the batch.
+      Comment lines are passed through as successes.
+    '''
+    converted = [(line, True) for line in batch]
+    rows_by_lrg = {}
+    for index, line in enumerate(batch):
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.rstrip('\r\n').split('\t')
+        try:
+            position = int(fields[position_column])
+            lrg_id = fields[id_column]
+        except (IndexError, ValueError):
+            converted[index] = (line, False)
+            continue
+        rows_by_lrg.setdefault(lrg_id, []).append((index, fields, position))
+
+    for lrg_id, rows in rows_by_lrg.items():
+        genome_mapping = mapping_loader.get(lrg_id)
+        if genome_mapping is None:
+            for index, fields, position in rows:
+                converted[index] = (batch[index], False)
+            continue
+        positions = [position for index, fields, position in rows]
+        if reverse:
+            new_positions = genome_mapping.toLrg(positions, strict=False)
+        else:
+            new_positions = genome_mapping.toGenomic(positions, strict=False)
+        for (index, fields, position), new_position in zip(rows, new_positions):
+            if new_position is None:
+                converted[index] = (batch[index], False)
+                continue
+            fields[position_column] = str(new_position)
+            if not reverse:
+                fields[id_column] = genome_mapping.chrom
+            converted[index] = ('\t'.join(fields) + '\n', True)
+    return converted
+
+
+def liftoverLines(lines, mapping_loader, reverse=False, id_column=0, position_column=1,
+                  batch_size=LIFTOVER_BATCH_SIZE):
+    '''
+    Generator, converts an iterable of lines a batch at a time, yielding
+    (line, success) tuples in the input order
+    '''
+    for batch in readBatches(lines, batch_size):
+        for line, success in liftoverBatch(batch, mapping_loader, reverse, id_column, position_column):
+            yield line, success
+
+
+def writeLiftover(results, output_file, unmapped_file=None):
+    '''
+    Write converted lines as they are made, and unconverted lines to the unmapped file if there is one
+
+    Output -
+    Tuple of the number of rows converted and not converted (comment lines aren't counted).
+    '''
+    converted_count = unmapped_count = 0
+    for line, success in results:
+        if success:
+            output_file.write(line)
+            if not line.startswith('#'):
+                converted_count += 1
+        else:
+            unmapped_count += 1
+            if unmapped_file is not None:
+                unmapped_file.write(line)
+    logger.info('Converted %s rows, %s rows could not be converted', converted_count, unmapped_count)
+    return converted_count, unmapped_count
+
+
+def openText(path, mode):
+    '''
+    Open a text file, or stdin/stdout for '-'
+    '''
+    if path == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    return open(path, mode)
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    setUpLogs(args, now)
+    logger.info("comfy_BED liftover started running at: %s", now)
+    setUpWeb(args)
+
+    xml_paths = sorted(glob.glob(os.path.expanduser(args.directory_glob))) if args.directory_glob else []
+    mapping_loader = MappingLoader(args.genome_build, xml_paths, args.annotation_index)
+    input_file = openText(args.input_file, 'r')
+    output_file = openText(args.output_file, 'w')
+    unmapped_file = openText(args.unmapped_file, 'w') if args.unmapped_file else None
+    try:
+        results = liftoverLines(input_file, mapping_loader, args.reverse, args.id_column - 1, args.position_column - 1)
+        writeLiftover(results, output_file, unmapped_file)
+    finally:
+        for open_file in (input_file, output_file, unmapped_file):
+            if open_file not in (None, sys.stdin, sys.stdout):
+                open_file.close()
+    logger.info("comfy_BED liftover complete")
+
+if __name__ == '__main__':
+    main()
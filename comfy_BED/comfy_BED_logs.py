@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import uuid
+import atexit
+import logging
+import threading
+import contextlib
+
+from six.moves import queue
+
+logger = logging.getLogger('comfy_BED')
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+LOG_FORMATS = ('text', 'json')
+TEXT_LOG_FORMAT = '%(asctime)s %(levelname)s [%(run_id)s %(correlation_id)s] %(processName)s %(name)s: %(message)s'
+
+# the ID of this run, added to every log record. Forked worker processes keep their parent's.
+RUN_ID = None
+
+# the correlation ID of the item or request being worked on by each thread, see logCorrelation
+CORRELATION = threading.local()
+
+# the writer of this run's logs, set by startLogging
+LOG_WRITER = None
+
+
+def makeLogId():
+    '''
+    A short random ID for a run, or for a request to the server
+    '''
+    return uuid.uuid4().hex[:12]
+
+
+@contextlib.contextmanager
+def logCorrelation(correlation_id):
+    '''
+    Context manager that tags every record logged by this thread with
+    correlation_id (e.g. the LRG of a batch item) until it exits
+    '''
+    previous = getattr(CORRELATION, 'id', None)
+    CORRELATION.id = correlation_id
+    try:
+        yield
+    finally:
+        CORRELATION.id = previous
+
+
+class CorrelationFilter(logging.Filter):
+    '''
+    Adds the run ID and the current correlation ID to each record. It runs
+    where the record is logged, so worker processes and threads add their own.
+    '''
+    def filter(self, record):
+        record.run_id = RUN_ID or '-'
+        record.correlation_id = getattr(CORRELATION, 'id', None) or '-'
+        return True
+
+
+class JsonLogFormatter(logging.Formatter):
+    '''
+    Formats each record as one line of JSON
+    '''
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'run_id': getattr(record, 'run_id', None),
+            'correlation_id': getattr(record, 'correlation_id', None),
+            'process': record.processName,
+            'pid': record.process,
+            'module': record.module,
+            'line': record.lineno,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, sort_keys=True)
+
+
+class LogQueueHandler(logging.Handler):
+    '''
+    Puts records on a queue for a LogWriter to write, so logging never waits
+    for the log file or for another process. The message is formatted here,
+    where its arguments are, so only records that pass the log level are
+    ever formatted, and what is queued can be pickled to another process.
+
+    Input -
+    log_queue: A Queue, or a multiprocessing Queue if worker processes log too.
+    target: The handler the LogWriter writes to. A process forked from this
+      one with a thread Queue, which nothing reads from, writes to it directly.
+    '''
+    def __init__(self, log_queue, target, shared=False):
+        logging.Handler.__init__(self)
+        self.queue = log_queue
+        self.target = target
+        self.shared = shared
+        self.pid = os.getpid()
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            if not self.shared and os.getpid() != self.pid:
+                self.target.handle(record)
+            else:
+                self.queue.put_nowait(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+class LogWriter(object):
+    '''
+    Background thread that writes the records on a queue to a handler, until stopped
+    '''
+    def __init__(self, log_queue, target):
+        self.queue = log_queue
+        self.target = target
+        self.thread = threading.Thread(target=self.run, name='comfy_BED_log_writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.target.handle(record)
+
+    def stop(self):
+        '''
+        Write everything logged so far, then stop the thread and close the handler
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        self.target.close()
+
+
+def startLogging(log_file, level='DEBUG', log_format='text', multiprocess=False):
+    '''
+    Send the logs of this run (from comfy_BED and the libraries it uses)
+    through a queue to a background writer, replacing any earlier set up
+
+    Input -
+    log_file: String. The file to append the logs to, or '-' for stderr.
+    level: String. The lowest level logged, from LOG_LEVELS.
+    log_format: String. 'text' lines, or 'json' lines.
+    multiprocess: Boolean. Use a multiprocessing queue, so that records
+      logged by worker processes forked from this one are written by this
+      process's writer instead of interleaving with it.
+
+    Output -
+    run_id: String. The run ID added to every record.
+    '''
+    global RUN_ID, LOG_WRITER
+    stopLogging()
+    RUN_ID = makeLogId()
+    target = logging.StreamHandler(sys.stderr) if log_file == '-' else logging.FileHandler(log_file)
+    target.setFormatter(JsonLogFormatter() if log_format == 'json' else logging.Formatter(TEXT_LOG_FORMAT))
+    if multiprocess:
+        # only imported when worker processes log, as it is slow to import
+        import multiprocessing
+        log_queue = multiprocessing.Queue()
+    else:
+        log_queue = queue.Queue()
+
+    handler = LogQueueHandler(log_queue, target, shared=multiprocess)
+    handler.addFilter(CorrelationFilter())
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+    LOG_WRITER = LogWriter(log_queue, target)
+    LOG_WRITER.handler = handler
+    # registered after multiprocessing is imported, so the writer is stopped before the queue is closed at exit
+    atexit.register(stopLogging)
+    return RUN_ID
+
+
+def stopLogging():
+    '''
+    Write any queued records and stop the log writer, if logging was started
+    '''
+    global LOG_WRITER
+    if LOG_WRITER is None:
+        return
+    logging.getLogger().removeHandler(LOG_WRITER.handler)
+    LOG_WRITER.stop()
+    LOG_WRITER = None
@@ -0,0 +1,279 @@
+import array
+import logging
+import collections
+
+import six
+
+from comfy_BED_convert import readMapping, makeGenomeMapping, isAssemblyMapping
+from comfy_BED_errors import InvalidInputError, InvalidTranscriptError
+from comfy_BED_xml import getXmlBackend
+
+logger = logging.getLogger('comfy_BED')
+
+
+class LrgTranscript(object):
+    '''
+    The exons of one fixed annotation transcript, in the order they are in
+    the LRG, held as a list of labels (e.g. 'exon_1') and arrays of their LRG
+    start and end positions, and the LRG start and end of its coding region
+    (None for non-coding transcripts)
+
+    Input -
+    name: String. The transcript name, e.g. 't1'.
+    '''
+    __slots__ = ('name', 'exon_labels', 'exon_starts', 'exon_ends', 'coding_start', 'coding_end')
+
+    def __init__(self, name):
+        self.name = name
+        self.exon_labels = []
+        self.exon_starts = array.array('l')
+        self.exon_ends = array.array('l')
+        self.coding_start = None
+        self.coding_end = None
+
+    def __len__(self):
+        return len(self.exon_labels)
+
+    def __repr__(self):
+        return 'LrgTranscript({!r}, {} exons)'.format(self.name, len(self))
+
+
+class LrgModel(object):
+    '''
+    Everything comfy_BED uses from an LRG, read in a single pass over the
+    xml by buildLrgModel: the LRG ID, the fixed annotation transcripts (in
+    the order they are in the LRG) and the genome mappings. The GenomeMapping
+    for each build is made the first time it is asked for, then kept.
+
+    Input -
+    lrg_id: String. The LRG ID.
+    transcripts: OrderedDict of transcript name to LrgTranscript.
+    mappings: List of MappingRecords, one per genome mapping.
+    '''
+    __slots__ = ('lrg_id', 'transcripts', 'mappings', 'genome_mappings')
+
+    def __init__(self, lrg_id, transcripts, mappings):
+        self.lrg_id = lrg_id
+        self.transcripts = transcripts
+        self.mappings = mappings
+        self.genome_mappings = {}
+
+    def __repr__(self):
+        return 'LrgModel({!r}, transcripts={}, {} mappings)'.format(
+            self.lrg_id, list(self.transcripts), len(self.mappings))
+
+    def getGenomeMapping(self, genome_build):
+        '''
+        The GenomeMapping of the LRG onto a genome build, see makeGenomeMapping
+        '''
+        if genome_build not in self.genome_mappings:
+            self.genome_mappings[genome_build] = makeGenomeMapping(self.mappings, genome_build)
+        return self.genome_mappings[genome_build]
+
+    def getGenomeBuilds(self):
+        '''
+        The coord systems of the genome assemblies the LRG is mapped onto, e.g.
+        'GRCh37.p13', in the order they are in the LRG (each once)
+        '''
+        genome_builds = []
+        for mapping in self.mappings:
+            if isAssemblyMapping(mapping) and mapping.coord_system not in genome_builds:
+                genome_builds.append(mapping.coord_system)
+        return genome_builds
+
+    def selectTranscripts(self, transcript_names):
+        '''
+        Get the LrgTranscripts with exactly the names given, in the order given
+        (each once). 'all' selects every transcript in the LRG. Throws an
+        InvalidTranscriptError if any aren't in the LRG.
+        '''
+        selected = []
+        for transcript_name in transcript_names:
+            if transcript_name == 'all':
+                selected.extend(transcript for transcript in self.transcripts.values() if transcript not in selected)
+                continue
+            if transcript_name not in self.transcripts:
+                logger.error("This transcript name is not valid: %s", transcript_name)
+                logger.error("Valid transcript names are: %s", ', '.join(self.transcripts))
+                raise InvalidTranscriptError("Invalid transcript name: " + str(transcript_name))
+            if self.transcripts[transcript_name] not in selected:
+                selected.append(self.transcripts[transcript_name])
+        return selected
+
+
+def getRootLrgId(root):
+    '''
+    Check that a loaded xml file is an LRG, and get its LRG ID
+    '''
+    # test that file is an lrg (root.tag should be LRG)
+    if root.tag.upper() != "LRG":
+        logger.error("The input file is not an LRG file")
+        raise InvalidInputError('The input file is not an LRG file')
+
+    # get lrg id
+    lrg_id = root.findtext('fixed_annotation/id')
+    if lrg_id is None:
+        logger.error("The input file has no LRG ID")
+        raise InvalidInputError('The input file has no LRG ID')
+    return lrg_id.strip()
+
+
+def readTranscript(transcript, lrg_id):
+    '''
+    Read the exons and coding region of a fixed annotation <transcript>
+    element into an LrgTranscript, using the coordinates in the LRG's own
+    coordinate system. Transcripts with more than one coding region are
+    given the span of them all.
+    '''
+    xml_backend = getXmlBackend()
+    lrg_transcript = LrgTranscript(transcript.get('name'))
+    for coordinate in xml_backend.codingCoordinates(transcript, lrg_id):
+        start, end = int(coordinate.get('start')), int(coordinate.get('end'))
+        if lrg_transcript.coding_start is None:
+            lrg_transcript.coding_start, lrg_transcript.coding_end = start, end
+        else:
+            lrg_transcript.coding_start = min(lrg_transcript.coding_start, start)
+            lrg_transcript.coding_end = max(lrg_transcript.coding_end, end)
+    for exon in xml_backend.exons(transcript):
+        for coordinate in xml_backend.coordinates(exon, lrg_id):
+            lrg_transcript.exon_labels.append('exon_{}'.format(exon.get('label')))
+            lrg_transcript.exon_starts.append(int(coordinate.get('start')))
+            lrg_transcript.exon_ends.append(int(coordinate.get('end')))
+            break
+        else:
+            logger.error('Exon %s of %s %s has no %s coordinates',
+                         exon.get('label'), lrg_id, lrg_transcript.name, lrg_id)
+            raise InvalidInputError('Exon {} of transcript {} has no LRG coordinates'.format(
+                exon.get('label'), lrg_transcript.name))
+    return lrg_transcript
+
+
+def buildLrgModel(root):
+    '''
+    Read an LRG into an LrgModel. Only the children of fixed_annotation and
+    of each annotation set are looked at, which is where the transcripts and
+    genome mappings are. Mappings of transcripts (rather than of the LRG onto
+    an assembly) aren't used, so aren't read.
+
+    Input -
+    root: Element. The root of the LRG, from loadLrgXml, loadLrgInput or the annotation index.
+    '''
+    lrg_id = getRootLrgId(root)
+    transcripts = collections.OrderedDict()
+    mappings = []
+    xml_backend = getXmlBackend()
+    for transcript in xml_backend.transcripts(root):
+        transcripts[transcript.get('name')] = readTranscript(transcript, lrg_id)
+    for mapping in xml_backend.mappings(root):
+        if mapping.get('type') != 'transcript':
+            mappings.append(readMapping(mapping))
+    logger.info("Read %s: %s transcripts and %s genome mappings", lrg_id, len(transcripts), len(mappings))
+    return LrgModel(lrg_id, transcripts, mappings)
+
+
+def asLrgModel(lrg):
+    '''
+    Turn the root of an LRG into an LrgModel, LrgModels are returned as they are
+    '''
+    if isinstance(lrg, LrgModel):
+        return lrg
+    return buildLrgModel(lrg)
+
+
+def splitTranscripts(transcripts):
+    '''
+    Transcript names from a comma separated string (e.g. 't1,t2') or a list
+    '''
+    if isinstance(transcripts, six.string_types):
+        transcripts = transcripts.split(',')
+    return [transcript_name.strip() for transcript_name in transcripts if transcript_name.strip()]
+
+
+def splitGenomeBuilds(genome_builds, model=None):
+    '''
+    Genome builds from a comma separated string (e.g. 'GRCh37,GRCh38') or a
+    list, each once. 'all' is every assembly the LRG model is mapped onto.
+    '''
+    if isinstance(genome_builds, six.string_types):
+        genome_builds = genome_builds.split(',')
+    selected = []
+    for genome_build in genome_builds:
+        genome_build = genome_build.strip()
+        expanded = model.getGenomeBuilds() if genome_build == 'all' and model is not None else [genome_build]
+        selected.extend(build for build in expanded if build and build not in selected)
+    return selected
+
+
+def codingTranscript(transcript):
+    '''
+    The coding part of an LrgTranscript: its exons cut down to the coding
+    region, leaving out the exons that are all UTR. Throws an
+    InvalidTranscriptError if the transcript is non-coding.
+    '''
+    if transcript.coding_start is None:
+        logger.error("Transcript %s has no coding region", transcript.name)
+        raise InvalidTranscriptError('Transcript {} is non-coding'.format(transcript.name))
+    coding = LrgTranscript(transcript.name)
+    coding.coding_start, coding.coding_end = transcript.coding_start, transcript.coding_end
+    for exon_label, start, end in zip(transcript.exon_labels, transcript.exon_starts, transcript.exon_ends):
+        if end < transcript.coding_start or start > transcript.coding_end:
+            continue
+        coding.exon_labels.append(exon_label)
+        coding.exon_starts.append(max(start, transcript.coding_start))
+        coding.exon_ends.append(min(end, transcript.coding_end))
+    return coding
+
+
+def convertTranscript(transcript, genome_mapping):
+    '''
+    Convert the exons of an LrgTranscript to genomic positions, converting all
+    the exon starts and ends in one batch.
+
+    Output -
+    list_of_exons: List of (chromosome, genome start, genome end, exon label)
+      tuples in exon order, with the smallest coordinate first.
+    '''
+    exon_count = len(transcript)
+    genomic_positions = genome_mapping.toGenomic(transcript.exon_starts.tolist() + transcript.exon_ends.tolist())
+    chrom = genome_mapping.chrom
+    list_of_exons = []
+    for i, exon_label in enumerate(transcript.exon_labels):
+        start, end = genomic_positions[i], genomic_positions[exon_count + i]
+        # start and end are switched round on the 3' -> 5' strand, because bed files should have the smallest value first
+        list_of_exons.append((chrom, min(start, end), max(start, end), exon_label))
+    return list_of_exons
+
+
+def flankExons(list_of_exons, flank):
+    '''
+    Widen converted exons by flank bases of intron (or intergenic sequence)
+    on each side, stopping at the first base of the chromosome
+    '''
+    return [(chrom, max(start - flank, 1), end + flank, exon_label) for chrom, start, end, exon_label in list_of_exons]
+
+
+def mergeExons(transcript_records):
+    '''
+    The union of the converted exons of several transcripts. The exons are
+    sorted by position, then swept along in order, collapsing each exon that
+    overlaps or touches (starts on the base after) the region before it into that region.
+
+    Input -
+    transcript_records: List of (transcript name, list of exon tuples from convertTranscript).
+
+    Output -
+    list_of_regions: List of (chromosome, start, end, exon labels) tuples in
+      position order. The label lists the transcript exons in the region,
+      e.g. 't1_exon_1,t2_exon_1'.
+    '''
+    exons = sorted((chrom, start, end, '{}_{}'.format(transcript_name, exon_label))
+                   for transcript_name, list_of_exons in transcript_records
+                   for chrom, start, end, exon_label in list_of_exons)
+    regions = []
+    for chrom, start, end, exon_label in exons:
+        if regions and regions[-1][0] == chrom and start <= regions[-1][2] + 1:
+            regions[-1][2] = max(regions[-1][2], end)
+            regions[-1][3].append(exon_label)
+        else:
+            regions.append([chrom, start, end, [exon_label]])
+    return [(chrom, start, end, ','.join(exon_labels)) for chrom, start, end, exon_labels in regions]
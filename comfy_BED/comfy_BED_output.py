@@ -0,0 +1,327 @@
+import os
+import sys
+import zlib
+import heapq
+import struct
+import logging
+import tempfile
+
+from comfy_BED_timing import addBytes
+
+logger = logging.getLogger('comfy_BED')
+
+# rows held in memory while sorting, before a sorted run is written to a temporary file
+BED_SORT_CHUNK_SIZE = 500000
+
+# BGZF files are a series of gzip blocks of at most 64 KB, with the size of
+# each block in a gzip extra field so that readers can seek to any block.
+# The empty block marks the end of the file.
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00'
+            b'\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+# tabix index settings for BED files: 0-based starts (the UCSC flag), with the
+# chromosome, start and end in columns 1, 2 and 3, and '#' lines as comments
+TABIX_FORMAT_UCSC = 0x10000
+TABIX_LINEAR_SHIFT = 14
+
+# chromosomes that aren't numbered are sorted after the numbered ones, in this order
+CHROM_ORDER = {'X': 0, 'Y': 1, 'M': 2, 'MT': 2}
+
+
+def chromSortKey(chrom):
+    '''
+    Sort key that puts chromosomes in their natural order, chr1, chr2, ..., chr10, ..., chrX, chrY, chrM
+    '''
+    name = chrom[3:] if chrom.lower().startswith('chr') else chrom
+    if name.isdigit():
+        return (0, int(name), name)
+    return (1, CHROM_ORDER.get(name.upper(), len(CHROM_ORDER)), name)
+
+
+def bedSortKey(row):
+    '''
+    Sort key for a BED row: chromosome, then start, then end, then the rest of the row
+    '''
+    return (chromSortKey(row[0]), row[1], row[2]) + tuple(row[3:])
+
+
+def toBytes(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+
+def formatBedRow(row):
+    return toBytes('\t'.join(str(field) for field in row) + '\n')
+
+
+def parseBedRow(line):
+    fields = line.decode('utf-8').rstrip('\n').split('\t')
+    return (fields[0], int(fields[1]), int(fields[2])) + tuple(fields[3:])
+
+
+class BedSorter(object):
+    '''
+    External merge sort of BED rows. Rows are sorted in memory chunk_size at
+    a time, and each sorted chunk is written to a temporary file. The sorted
+    rows are then read back by merging the chunks, so the memory used doesn't
+    grow with the number of rows.
+
+    Input -
+    chunk_size: Integer. The number of rows to sort in memory at once.
+    temp_dir: String. Optional directory for the temporary files.
+    '''
+    def __init__(self, chunk_size=BED_SORT_CHUNK_SIZE, temp_dir=None):
+        self.chunk_size = chunk_size
+        self.temp_dir = temp_dir
+        self.rows = []
+        self.runs = []
+
+    def add(self, row):
+        self.rows.append(tuple(row))
+        if len(self.rows) >= self.chunk_size:
+            self.spill()
+
+    def spill(self):
+        self.rows.sort(key=bedSortKey)
+        run = tempfile.TemporaryFile(dir=self.temp_dir)
+        run.writelines(formatBedRow(row) for row in self.rows)
+        run.seek(0)
+        self.runs.append(run)
+        self.rows = []
+
+    def readRun(self, run):
+        for line in run:
+            row = parseBedRow(line)
+            yield bedSortKey(row), row
+
+    def sortedRows(self):
+        '''
+        Generator, every row added so far, in sorted order
+        '''
+        if not self.runs:
+            self.rows.sort(key=bedSortKey)
+            for row in self.rows:
+                yield row
+            return
+        if self.rows:
+            self.spill()
+        logger.info('Merging %s sorted runs of BED rows', len(self.runs))
+        for key, row in heapq.merge(*[self.readRun(run) for run in self.runs]):
+            yield row
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.rows = []
+
+
+def makeBgzfBlock(data):
+    '''
+    Compress data into one BGZF block: a gzip member with a 'BC' extra field holding the block size
+    '''
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    compressed = compressor.compress(bytes(data)) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+    return header + compressed + struct.pack('<II', zlib.crc32(bytes(data)) & 0xffffffff, len(data))
+
+
+class BgzfWriter(object):
+    '''
+    Writes BGZF compressed data (which gzip can read) to a binary file,
+    keeping track of the virtual offset of the data for tabix indexing
+
+    Input -
+    raw_file: File-like object opened in binary mode.
+    '''
+    def __init__(self, raw_file):
+        self.raw_file = raw_file
+        self.buffer = bytearray()
+        self.block_offset = 0
+
+    def tell(self):
+        '''
+        The virtual offset of the next byte: the offset of its block in the
+        compressed file, shifted 16 bits left, plus its offset in the block
+        '''
+        return (self.block_offset << 16) | len(self.buffer)
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self.writeBlock(self.buffer[:BGZF_BLOCK_SIZE])
+            del self.buffer[:BGZF_BLOCK_SIZE]
+
+    def writeBlock(self, data):
+        block = makeBgzfBlock(data)
+        self.raw_file.write(block)
+        self.block_offset += len(block)
+
+    def close(self):
+        if self.buffer:
+            self.writeBlock(self.buffer)
+            self.buffer = bytearray()
+        self.raw_file.write(BGZF_EOF)
+
+
+def regionToBin(start, end):
+    '''
+    The smallest tabix/BAM bin that holds a 0-based, half open region
+    '''
+    end -= 1
+    for shift, first_bin in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if start >> shift == end >> shift:
+            return first_bin + (start >> shift)
+    return 0
+
+
+class TabixIndexer(object):
+    '''
+    Builds a tabix (.tbi) index of a sorted BGZF BED file, from the position
+    and virtual offsets of each row as it is written
+    '''
+    def __init__(self):
+        self.chroms = []
+        self.bins = {}
+        self.linear = {}
+
+    def add(self, chrom, start, end, start_offset, end_offset):
+        if chrom not in self.bins:
+            self.chroms.append(chrom)
+            self.bins[chrom] = {}
+            self.linear[chrom] = {}
+        end = max(end, start + 1)
+
+        # chunks of consecutive rows in the same bin are merged
+        chunks = self.bins[chrom].setdefault(regionToBin(start, end), [])
+        if chunks and chunks[-1][1] == start_offset:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
+
+        # the linear index holds the offset of the first row overlapping each 16 kb window
+        windows = self.linear[chrom]
+        for window in range(start >> TABIX_LINEAR_SHIFT, ((end - 1) >> TABIX_LINEAR_SHIFT) + 1):
+            windows.setdefault(window, start_offset)
+
+    def toBytes(self):
+        names = b''.join(toBytes(chrom) + b'\0' for chrom in self.chroms)
+        parts = [b'TBI\x01', struct.pack('<8i', len(self.chroms), TABIX_FORMAT_UCSC, 1, 2, 3, ord('#'), 0, len(names)),
+                 names]
+        for chrom in self.chroms:
+            bins = self.bins[chrom]
+            parts.append(struct.pack('<i', len(bins)))
+            for bin_number in sorted(bins):
+                parts.append(struct.pack('<Ii', bin_number, len(bins[bin_number])))
+                for start_offset, end_offset in bins[bin_number]:
+                    parts.append(struct.pack('<QQ', start_offset, end_offset))
+
+            # windows without rows use the offset before them, which is always safe to start reading from
+            windows = self.linear[chrom]
+            offsets = []
+            offset = min(windows.values())
+            for window in range(max(windows) + 1):
+                offset = windows.get(window, offset)
+                offsets.append(offset)
+            parts.append(struct.pack('<i', len(offsets)))
+            parts.append(struct.pack('<{}Q'.format(len(offsets)), *offsets))
+        return b''.join(parts)
+
+    def write(self, index_path):
+        with open(index_path, 'wb') as index_file:
+            bgzf_writer = BgzfWriter(index_file)
+            bgzf_writer.write(self.toBytes())
+            bgzf_writer.close()
+        logger.info('Wrote tabix index to %s', index_path)
+
+
+class BedOutput(object):
+    '''
+    Writes BED rows to a file or stdout, as plain text or BGZF compressed.
+    Rows are written as they come unless they are being sorted, in which case
+    they are written in coordinate order when the output is closed. Sorted,
+    compressed output can also be given a tabix index (<path>.tbi).
+
+    Input -
+    path: String. The file to write to, or '-' for stdout.
+    sort: Boolean. Sort the rows by chromosome, start and end.
+    compress: Boolean. Write BGZF compressed output.
+    index: Boolean. Write a tabix index, which needs the output to be sorted,
+      compressed and in a file, so it turns on sort and compress.
+    chunk_size, temp_dir: Passed to BedSorter.
+    '''
+    def __init__(self, path='-', sort=False, compress=False, index=False,
+                 chunk_size=BED_SORT_CHUNK_SIZE, temp_dir=None):
+        if index and path == '-':
+            logger.error('A tabix index can only be made for a BED file, not stdout')
+            raise ValueError('Cannot index BED output written to stdout')
+        self.path = path
+        self.index = index
+        self.sorter = BedSorter(chunk_size, temp_dir) if sort or index else None
+        self.comments = []
+        self.rows_written = 0
+        self.indexer = TabixIndexer() if index else None
+
+        if path == '-':
+            self.raw_file = getattr(sys.stdout, 'buffer', sys.stdout)
+        else:
+            self.raw_file = open(path, 'wb')
+        self.output_file = BgzfWriter(self.raw_file) if compress or index else self.raw_file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.close()
+
+    def writeComment(self, comment):
+        '''
+        Write a '#' comment line. When sorting, comments are all written at the top of the output.
+        '''
+        line = toBytes('#' + comment + '\n')
+        if self.sorter is None:
+            self.output_file.write(line)
+        else:
+            self.comments.append(line)
+
+    def writeRows(self, rows):
+        for row in rows:
+            if self.sorter is None:
+                self.writeRow(row)
+            else:
+                self.sorter.add(row)
+
+    def writeRow(self, row):
+        if self.indexer is None:
+            self.output_file.write(formatBedRow(row))
+        else:
+            start_offset = self.output_file.tell()
+            self.output_file.write(formatBedRow(row))
+            self.indexer.add(row[0], int(row[1]), int(row[2]), start_offset, self.output_file.tell())
+        self.rows_written += 1
+
+    def close(self):
+        if self.raw_file is None:
+            return
+        try:
+            if self.sorter is not None:
+                for comment in self.comments:
+                    self.output_file.write(comment)
+                for row in self.sorter.sortedRows():
+                    self.writeRow(row)
+                self.sorter.close()
+            if self.output_file is not self.raw_file:
+                self.output_file.close()
+        finally:
+            if self.path == '-':
+                self.raw_file.flush()
+            else:
+                self.raw_file.close()
+                addBytes(os.path.getsize(self.path))
+            self.raw_file = None
+        if self.indexer is not None:
+            self.indexer.write(self.path + '.tbi')
+            addBytes(os.path.getsize(self.path + '.tbi'))
+        logger.info('Wrote %s BED rows to %s', self.rows_written, 'stdout' if self.path == '-' else self.path)
@@ -0,0 +1,294 @@
+from __future__ import print_function
+
+import argparse
+import textwrap
+import os
+import re
+import glob
+import bisect
+import datetime
+import logging
+
+from comfy_BED import setUpLogs, addLogArgs, loadLrgInput, GENOME_BUILDS
+from comfy_BED_model import asLrgModel, convertTranscript
+
+logger = logging.getLogger('comfy_BED')
+
+REGION_PATTERN = re.compile(r'^(?:chr)?(\w+):([\d,]+)-([\d,]+)$', re.IGNORECASE)
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Finds the LRG transcripts and exons that overlap genomic regions. A region
+        index is made once from a directory of LRG xml files, then queried with
+        single regions or a BED file of regions.
+
+        examples:
+        python comfy_BED_regions.py -d "~/Documents/LRGs/*.xml" -r lrg_regions.tsv
+          Makes a region index of every exon in the LRGs, on GRCh37 and GRCh38
+
+        python comfy_BED_regions.py -r lrg_regions.tsv -q chr1:43232200-43232300 -g GRCh37
+          Prints the LRG exons that overlap the region on GRCh37
+
+        python comfy_BED_regions.py -r lrg_regions.tsv -b variants.bed -g GRCh38
+          Prints the LRG exons that overlap each region in the BED file on GRCh38
+        '''
+    ))
+
+    # make option to either build the index or query it
+    input_method = parser.add_mutually_exclusive_group(required=True)
+
+    # directory glob
+    input_method.add_argument(
+        '-d', '--directory_glob', action='store',
+        help='Make the region index from local LRG xml files matching a glob, e.g. "LRGs/*.xml"'
+    )
+
+    # single region
+    input_method.add_argument(
+        '-q', '--query', action='store',
+        help='A region to query, as chr:start-end (1-based, inclusive)'
+    )
+
+    # bed file of regions
+    input_method.add_argument(
+        '-b', '--bed_file', action='store',
+        help='A BED file of regions to query'
+    )
+
+    # region index file
+    parser.add_argument(
+        '-r', '--region_index', action='store', required=True,
+        help='The region index file to write (with -d) or to query (with -q or -b)'
+    )
+
+    # genome build options
+    parser.add_argument(
+        '-g', '--genome_build', action='store',
+        choices=GENOME_BUILDS, default='GRCh37',
+        help='Genome build of the query regions. Defaults to GRCh37.'
+    )
+
+    # annotation index
+    parser.add_argument(
+        '-x', '--annotation_index', action='store',
+        help='An annotation index made by comfy_BED_index.py, to load indexed files from.'
+    )
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+def normaliseChrom(chrom):
+    '''
+    Chromosome names are compared as 'chr' + name, so '1', 'chr1' and 'CHR1' all match
+    '''
+    chrom = str(chrom).strip()
+    if chrom.lower().startswith('chr'):
+        chrom = chrom[3:]
+    return 'chr' + chrom
+
+
+def parseRegion(region):
+    '''
+    Parse a chr:start-end region (1-based, inclusive) into a (chrom, start, end) tuple
+    '''
+    match = REGION_PATTERN.match(region.strip())
+    if not match:
+        logger.error('Region should be written as chr:start-end: %s', region)
+        raise ValueError('Invalid region: {}'.format(region))
+    chrom, start, end = match.groups()
+    start = int(start.replace(',', ''))
+    end = int(end.replace(',', ''))
+    if start > end:
+        logger.error('Region starts after it ends: %s', region)
+        raise ValueError('Invalid region: {}'.format(region))
+    return normaliseChrom(chrom), start, end
+
+
+def readBedRegions(bed_path):
+    '''
+    Read the regions in a BED file, converting the 0-based BED starts to 1-based
+
+    Output -
+    regions: List of (chrom, start, end, name) tuples, name is None if the BED
+      file has no 4th column.
+    '''
+    regions = []
+    with open(bed_path) as bed_file:
+        for line in bed_file:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            name = fields[3] if len(fields) > 3 else None
+            regions.append((normaliseChrom(fields[0]), int(fields[1]) + 1, int(fields[2]), name))
+    logger.info('Read %s regions from %s', len(regions), bed_path)
+    return regions
+
+
+def getLrgRegions(lrg):
+    '''
+    Get the genomic positions of every exon of every transcript in an LRG, on each genome build it maps to
+
+    Input -
+    lrg: LrgModel, or the root Element of the LRG from loadLrgInput.
+
+    Output -
+    regions: List of (genome_build, chrom, start, end, lrg_id, transcript, exon) tuples
+    '''
+    model = asLrgModel(lrg)
+    regions = []
+    for genome_build in GENOME_BUILDS:
+        try:
+            genome_mapping = model.getGenomeMapping(genome_build)
+        except ValueError:
+            logger.info('%s has no mapping to %s', model.lrg_id, genome_build)
+            continue
+        for transcript in model.transcripts.values():
+            for chrom, start, end, exon in convertTranscript(transcript, genome_mapping):
+                regions.append((genome_build, normaliseChrom(chrom), start, end, model.lrg_id, transcript.name, exon))
+    return regions
+
+
+def buildRegionIndex(xml_paths, annotation_index=None):
+    '''
+    Get the exon regions of a corpus of LRG xml files, LRGs that can't be read are logged and skipped
+
+    Output -
+    regions: List of (genome_build, chrom, start, end, lrg_id, transcript, exon) tuples,
+      sorted by position
+    '''
+    regions = []
+    for xml_path in xml_paths:
+        try:
+            regions.extend(getLrgRegions(loadLrgInput(local_input=xml_path, annotation_index=annotation_index)))
+        except Exception as error:
+            logger.error('Could not index the regions of %s: %r', xml_path, error)
+    regions.sort()
+    logger.info('Indexed %s exon regions from %s LRG files', len(regions), len(xml_paths))
+    return regions
+
+
+def writeRegionIndex(regions, region_index_path, now):
+    '''
+    Save the exon regions from buildRegionIndex as a tab separated file, loaded with loadRegionIndex
+    '''
+    with open(region_index_path, 'w') as region_index_file:
+        region_index_file.write('#LRG region index made at: ' + now.strftime("%Y-%m-%d %H:%M") + '\n')
+        region_index_file.write('#build\tchrom\tstart\tend\tlrg_id\ttranscript\texon\n')
+        for region in regions:
+            region_index_file.write('\t'.join(str(field) for field in region) + '\n')
+    logger.info('Wrote region index to %s', region_index_path)
+
+
+def loadRegionIndex(region_index_path):
+    '''
+    Load a region index file made by writeRegionIndex into a RegionIndex
+    '''
+    regions = []
+    with open(region_index_path) as region_index_file:
+        for line in region_index_file:
+            if not line.strip() or line.startswith('#'):
+                continue
+            build, chrom, start, end, lrg_id, transcript, exon = line.rstrip('\r\n').split('\t')
+            regions.append((build, chrom, int(start), int(end), lrg_id, transcript, exon))
+    logger.info('Loaded %s exon regions from %s', len(regions), region_index_path)
+    return RegionIndex(regions)
+
+
+class RegionIndex(object):
+    '''
+    Exon regions held as arrays sorted by start position, one set per genome
+    build and chromosome. An overlap query binary searches the starts, and
+    only has to check regions that start within the longest region length
+    before the query, rather than every region in the corpus.
+
+    Input -
+    regions: List of (genome_build, chrom, start, end, lrg_id, transcript, exon)
+      tuples, with 1-based inclusive start and end.
+    '''
+    def __init__(self, regions):
+        grouped = {}
+        for region in sorted(regions):
+            grouped.setdefault((region[0], normaliseChrom(region[1])), []).append(region)
+        self.starts = {}
+        self.regions = {}
+        self.max_lengths = {}
+        for key, key_regions in grouped.items():
+            self.starts[key] = [region[2] for region in key_regions]
+            self.regions[key] = key_regions
+            self.max_lengths[key] = max(region[3] - region[2] for region in key_regions)
+
+    def __len__(self):
+        return sum(len(key_regions) for key_regions in self.regions.values())
+
+    def overlaps(self, genome_build, chrom, start, end):
+        '''
+        Find the exon regions that overlap a 1-based, inclusive region
+
+        Output -
+        overlaps: List of (genome_build, chrom, start, end, lrg_id, transcript, exon)
+          tuples, sorted by position
+        '''
+        key = (genome_build, normaliseChrom(chrom))
+        if key not in self.regions:
+            return []
+        starts = self.starts[key]
+        first = bisect.bisect_left(starts, start - self.max_lengths[key])
+        last = bisect.bisect_right(starts, end)
+        return [region for region in self.regions[key][first:last] if region[3] >= start]
+
+
+def queryRegions(region_index, genome_build, regions):
+    '''
+    Query a list of (chrom, start, end, name) regions against a RegionIndex
+
+    Output -
+    results: List of (region, overlaps) tuples, in the same order as regions
+    '''
+    results = [(region, region_index.overlaps(genome_build, region[0], region[1], region[2])) for region in regions]
+    logger.info('Queried %s regions, %s overlap an LRG exon',
+                len(results), sum(1 for region, overlaps in results if overlaps))
+    return results
+
+
+def printOverlaps(results):
+    '''
+    Print one tab separated line per overlapping exon: query region, then the
+    exon position, LRG ID, transcript and exon label
+    '''
+    for region, overlaps in results:
+        query = '{}:{}-{}'.format(*region[:3])
+        if region[3] is not None:
+            query = '{}({})'.format(query, region[3])
+        for build, chrom, start, end, lrg_id, transcript, exon in overlaps:
+            print('\t'.join([query, chrom, str(start), str(end), lrg_id, transcript, exon]))
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    setUpLogs(args, now)
+
+    if args.directory_glob:
+        xml_paths = sorted(glob.glob(os.path.expanduser(args.directory_glob)))
+        writeRegionIndex(buildRegionIndex(xml_paths, args.annotation_index), args.region_index, now)
+        return
+
+    region_index = loadRegionIndex(args.region_index)
+    if args.query:
+        regions = [parseRegion(args.query) + (None,)]
+    else:
+        regions = readBedRegions(args.bed_file)
+    printOverlaps(queryRegions(region_index, args.genome_build, regions))
+
+if __name__ == '__main__':
+    main()
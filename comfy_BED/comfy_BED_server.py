@@ -0,0 +1,338 @@
+import argparse
+import textwrap
+import os
+import time
+import datetime
+import logging
+import threading
+import collections
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qs
+
+from comfy_BED import setUpLogs, addLogArgs, setUpWeb, addWebArgs, loadLrgInput, makeBedRecords, GENOME_BUILDS
+from comfy_BED_web import LRG_STATUSES, loadStatusSnapshot
+from comfy_BED_model import buildLrgModel
+from comfy_BED_input import findLrgXmlFile
+from comfy_BED_logs import logCorrelation, makeLogId
+from comfy_BED_errors import (InvalidInputError, InvalidTranscriptError, NoGenomeMappingError, LrgNotFoundError,
+                              WebServiceError, OfflineCacheMissError, LrgStatusError)
+
+logger = logging.getLogger('comfy_BED')
+
+# the server's own request lines, with their own logger name in place of a message prefix
+server_logger = logging.getLogger('comfy_BED.server')
+
+SERVER_CACHE_SIZE = 256
+SERVER_MAX_AGE = 24 * 60 * 60
+
+# the HTTP status of each kind of failure, the first that matches is used and anything else is a 500:
+# bad requests, LRGs that can't be found, and failures of the LRG web services (or a miss in an offline cache)
+ERROR_STATUSES = (
+    ((InvalidInputError, InvalidTranscriptError, NoGenomeMappingError), 400),
+    (LrgNotFoundError, 404),
+    (OfflineCacheMissError, 503),
+    ((WebServiceError, LrgStatusError), 502),
+)
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Runs comfy_BED as a local HTTP service, keeping parsed LRGs in memory
+        between requests. BED text is returned for requests like:
+          GET /bed?lrg=LRG_1&transcripts=t1,t2&build=GRCh37
+
+        examples:
+        python comfy_BED_server.py -p 8080 -d ~/Documents/LRGs
+          Serves on http://127.0.0.1:8080, loading LRGs from the directory if they're in it
+
+        python comfy_BED_server.py -u /tmp/comfy_BED.sock
+          Serves on a Unix socket
+        '''
+    ))
+
+    # make option to serve on either a port or a unix socket (not both)
+    address = parser.add_mutually_exclusive_group()
+
+    # port
+    address.add_argument(
+        '-p', '--port', action='store', type=int, default=8080,
+        help='The port to serve on, on 127.0.0.1. Defaults to 8080.'
+    )
+
+    # unix socket
+    address.add_argument(
+        '-u', '--unix_socket', action='store',
+        help='The path of a Unix socket to serve on, instead of a port'
+    )
+
+    # local LRG directory
+    parser.add_argument(
+        '-d', '--lrg_dir', action='store',
+        help='A directory of LRG xml files named <LRG ID>.xml (or .xml.gz/.xml.bz2). LRGs not in it are fetched from the web.'
+    )
+
+    # annotation index
+    parser.add_argument(
+        '-x', '--annotation_index', action='store',
+        help='An annotation index made by comfy_BED_index.py, to load indexed files from.'
+    )
+
+    # cache options
+    parser.add_argument(
+        '--cache_size', action='store', type=int, default=SERVER_CACHE_SIZE,
+        help='The number of parsed LRGs to keep in memory. Defaults to {}.'.format(SERVER_CACHE_SIZE)
+    )
+    parser.add_argument(
+        '--max_age', action='store', type=int, default=SERVER_MAX_AGE,
+        help=textwrap.dedent(
+        '''
+        Seconds before an LRG is loaded again and its status re-checked.
+        Defaults to a day. A --status_file is read again as soon as it changes.
+        '''
+    ))
+    addWebArgs(parser)
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+class LrgCache(object):
+    '''
+    Least recently used cache of parsed LRGs (as LrgModels), safe to share between threads.
+    LRGs are kept by their LRG ID, and the identifiers they were asked for by
+    (e.g. 'COL1A1') are kept as aliases of it, so each LRG is only loaded and
+    stored once however it is asked for. Local files are reloaded if they change, and every LRG is reloaded (and
+    its status looked up again) once it is older than max_age. The status
+    snapshot is loaded again whenever it changes, so a pending LRG that is
+    made public is served as public straight away.
+
+    Input -
+    lrg_dir: String. Optional directory of LRG xml files named <LRG ID>.xml (or .xml.gz/.xml.bz2).
+    annotation_index: String. Optional annotation index to load local files from.
+    max_size: Integer. The number of LRGs to keep.
+    max_age: Number. Seconds before an LRG is reloaded.
+    status_file: String. Optional status snapshot to take LRG statuses from, see loadStatusSnapshot.
+    '''
+    def __init__(self, lrg_dir=None, annotation_index=None, max_size=SERVER_CACHE_SIZE, max_age=SERVER_MAX_AGE,
+                 status_file=None):
+        self.lrg_dir = lrg_dir
+        self.annotation_index = annotation_index
+        self.max_size = max_size
+        self.max_age = max_age
+        self.status_file = status_file
+        self.status_version = None
+        self.snapshot_statuses = {}
+        self.entries = collections.OrderedDict()
+        self.aliases = {}
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    def localPath(self, lrg):
+        if self.lrg_dir is None or os.path.basename(lrg) != lrg:
+            return None
+        return findLrgXmlFile(self.lrg_dir, lrg)
+
+    def checkStatusFile(self):
+        '''
+        Load the status snapshot again if it has changed since it was last loaded
+        '''
+        if self.status_file is None:
+            return
+        version = os.path.getmtime(self.status_file)
+        with self.lock:
+            if version != self.status_version:
+                self.snapshot_statuses = loadStatusSnapshot(self.status_file)
+                self.status_version = version
+
+    def dropAliases(self, lrg_id):
+        '''
+        Forget the aliases of an LRG that is no longer cached (call with the lock held)
+        '''
+        for alias in [alias for alias, alias_lrg_id in self.aliases.items() if alias_lrg_id == lrg_id]:
+            del self.aliases[alias]
+
+    def get(self, lrg):
+        '''
+        The LrgModel of an LRG, from the cache if it is there and up to date.
+        If another request is already loading the LRG, wait for it instead of loading it twice.
+
+        Input -
+        lrg: String. An LRG ID, or any identifier the web API can resolve.
+        '''
+        self.checkStatusFile()
+        while True:
+            with self.lock:
+                lrg_id = self.aliases.get(lrg, lrg)
+            # once an alias is known, it is loaded from the LRG's file if it is in the directory
+            xml_path = self.localPath(lrg) or self.localPath(lrg_id)
+            version = os.path.getmtime(xml_path) if xml_path else None
+            with self.lock:
+                entry = self.entries.pop(lrg_id, None)
+                if entry is not None:
+                    model, loaded_at, loaded_version = entry
+                    if loaded_version == version and time.time() - loaded_at < self.max_age:
+                        self.entries[lrg_id] = entry
+                        self.hits += 1
+                        return model
+                    # look the status up again, unless it is in the status snapshot
+                    LRG_STATUSES.pop(model.lrg_id, None)
+                    if model.lrg_id in self.snapshot_statuses:
+                        LRG_STATUSES[model.lrg_id] = self.snapshot_statuses[model.lrg_id]
+                loading = self.loading.get(lrg_id)
+                if loading is None:
+                    loading = self.loading[lrg_id] = threading.Event()
+                    self.misses += 1
+                    break
+            loading.wait()
+
+        # parse outside the lock, so slow downloads don't hold up other requests
+        try:
+            if xml_path:
+                model = buildLrgModel(loadLrgInput(local_input=xml_path, annotation_index=self.annotation_index))
+            else:
+                model = buildLrgModel(loadLrgInput(web_input=lrg))
+            with self.lock:
+                self.aliases[lrg] = model.lrg_id
+                self.entries.pop(model.lrg_id, None)
+                self.entries[model.lrg_id] = (model, time.time(), version)
+                while len(self.entries) > self.max_size:
+                    self.dropAliases(self.entries.popitem(last=False)[0])
+        finally:
+            with self.lock:
+                del self.loading[lrg_id]
+            loading.set()
+        return model
+
+
+def formatBedText(lrg_status, lrg_status_message, transcript_records, now):
+    '''
+    Make the BED text for a request: the BED file header, then the exons of
+    each transcript after a '#transcript: ' comment line
+    '''
+    lines = ['#BED file generated at: ' + now.strftime("%Y-%m-%d %H:%M"),
+             '#' + str(lrg_status) + ": " + str(lrg_status_message)]
+    for transcript_name, exon_genomic_positions in transcript_records:
+        lines.append('#transcript: ' + transcript_name)
+        for row in exon_genomic_positions:
+            lines.append('\t'.join(str(field) for field in row))
+    return '\n'.join(lines) + '\n'
+
+
+class BedRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Answers GET /bed?lrg=...&transcripts=...&build=... with BED text, and GET /health with the cache stats
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        # everything logged while answering a request has the same correlation ID
+        with logCorrelation(makeLogId()):
+            self.answerGet()
+
+    def answerGet(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            cache = self.server.lrg_cache
+            self.sendText(200, 'OK\ncached: {}\nhits: {}\nmisses: {}\n'.format(
+                len(cache.entries), cache.hits, cache.misses))
+            return
+        if url.path != '/bed':
+            self.sendText(404, 'Not found\n')
+            return
+
+        query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        lrg = query.get('lrg')
+        transcripts = query.get('transcripts')
+        genome_build = query.get('build', 'GRCh37')
+        if not lrg or not transcripts or genome_build not in GENOME_BUILDS:
+            self.sendText(400, 'Requests need lrg, transcripts and optionally build (GRCh37 or GRCh38)\n')
+            return
+
+        try:
+            model = self.server.lrg_cache.get(lrg)
+            lrg_id, lrg_status, lrg_status_message, transcript_records = makeBedRecords(model, transcripts, genome_build)
+        except tuple(error_types for error_types, code in ERROR_STATUSES) as error:
+            code = [code for error_types, code in ERROR_STATUSES if isinstance(error, error_types)][0]
+            logger.error('Request for %s %s %s failed: %r', lrg, transcripts, genome_build, error)
+            self.sendText(code, 'Could not make a BED for {}: {}\n'.format(lrg, error))
+            return
+        except Exception as error:
+            logger.exception('Request for %s %s %s failed', lrg, transcripts, genome_build)
+            self.sendText(500, 'Could not make a BED for {}: {}\n'.format(lrg, repr(error)))
+            return
+        self.sendText(200, formatBedText(lrg_status, lrg_status_message, transcript_records, datetime.datetime.now()))
+
+    def sendText(self, code, text):
+        body = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, log_format, *args):
+        # unix socket clients have no address, so don't use address_string
+        server_logger.info(log_format, *args)
+
+
+class BedServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Threaded HTTP server on a local port, sharing one LrgCache between requests
+    '''
+    daemon_threads = True
+
+    def __init__(self, port, lrg_cache, host='127.0.0.1'):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), BedRequestHandler)
+        self.lrg_cache = lrg_cache
+
+
+class UnixBedServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+    Threaded HTTP server on a Unix socket, sharing one LrgCache between requests
+    '''
+    daemon_threads = True
+
+    def __init__(self, socket_path, lrg_cache):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, BedRequestHandler)
+        self.lrg_cache = lrg_cache
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    setUpLogs(args, now)
+    logger.info("comfy_BED server started running at: %s", now)
+    setUpWeb(args)
+
+    lrg_cache = LrgCache(args.lrg_dir, args.annotation_index, args.cache_size, args.max_age, args.status_file)
+    if args.unix_socket:
+        server = UnixBedServer(args.unix_socket, lrg_cache)
+        logger.info("Serving on Unix socket %s", args.unix_socket)
+    else:
+        server = BedServer(args.port, lrg_cache)
+        logger.info("Serving on http://127.0.0.1:%s", args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+    logger.info("comfy_BED server stopped")
+
+if __name__ == '__main__':
+    main()
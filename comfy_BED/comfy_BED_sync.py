@@ -0,0 +1,393 @@
+from __future__ import print_function
+
+import argparse
+import textwrap
+import os
+import re
+import json
+import datetime
+import logging
+
+from comfy_BED import setUpLogs, addLogArgs
+from comfy_BED_cache import makeDirs
+from comfy_BED_corpus import hashFile, writeManifest
+from comfy_BED_errors import WebServiceError
+from comfy_BED_logs import logCorrelation
+from comfy_BED_timing import addBytes, addHttpCall
+import comfy_BED_web
+
+logger = logging.getLogger('comfy_BED')
+
+# the LRG directories that are mirrored, by status, relative to comfy_BED_web.LRG_XML_URL
+SYNC_FOLDERS = (('public', ''), ('pending', 'pending'))
+
+# the manifest of the mirror and the status snapshot (for comfy_BED.py -s) are kept in the store
+SYNC_MANIFEST = 'sync_manifest.json'
+SYNC_STATUS_FILE = 'lrg_statuses.tsv'
+
+# files are downloaded to <file>.part, with the url and validator of the download in <file>.part.json,
+# so an interrupted download can be resumed from where it stopped
+PARTIAL_SUFFIX = '.part'
+PARTIAL_INFO_SUFFIX = '.part.json'
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# links to LRG xml files in a directory listing, with the date they were last modified if it is listed
+LISTING_LINK = re.compile(r'href="(LRG_\d+\.xml)"(?:(?:(?!href=)[^\n])*?(\d{4}-\d{2}-\d{2} \d{2}:\d{2}))?')
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Mirrors the public and pending LRG xml directories to a local store, so
+        comfy_BED can be run without the network. Files are downloaded several at
+        a time, interrupted downloads are resumed, and files that haven't changed
+        since the last sync aren't downloaded again. The store holds a status
+        snapshot of every LRG in it, for comfy_BED.py -s.
+
+        examples:
+        python comfy_BED_sync.py -o ~/Documents/LRG_mirror
+          Mirrors every public and pending LRG
+
+        python comfy_BED.py -l ~/Documents/LRG_mirror/public/LRG_1.xml -t t1 -s ~/Documents/LRG_mirror/lrg_statuses.tsv
+          Makes a BED file from the mirror, without going to the network
+        '''
+    ))
+
+    # local store
+    parser.add_argument(
+        '-o', '--store', action='store', required=True,
+        help='Directory to mirror the LRGs to, with a public and a pending directory'
+    )
+
+    # statuses to mirror
+    parser.add_argument(
+        '-s', '--statuses', action='store', nargs='+', choices=[status for status, folder in SYNC_FOLDERS],
+        default=[status for status, folder in SYNC_FOLDERS],
+        help='The LRG directories to mirror. Defaults to both public and pending.'
+    )
+
+    # number of downloads at once
+    parser.add_argument(
+        '-j', '--max_in_flight', action='store', type=int, default=DEFAULT_MAX_IN_FLIGHT,
+        help='Maximum number of files downloaded at once. Defaults to {}.'.format(DEFAULT_MAX_IN_FLIGHT)
+    )
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+def folderUrl(folder):
+    return '/'.join(part for part in (comfy_BED_web.LRG_XML_URL, folder) if part) + '/'
+
+
+def listLrgFolder(folder):
+    '''
+    List the LRG xml files in a directory of the LRG ftp site
+
+    Output -
+    listing: Dictionary of file name to the date it was last modified as
+      shown in the listing, or None if the listing doesn't show it.
+    '''
+    listing_url = folderUrl(folder)
+    logger.info('Listing LRG files at %s', listing_url)
+    response = comfy_BED_web.getSession().get(listing_url, timeout=comfy_BED_web.WEB_TIMEOUT)
+    addHttpCall()
+    addBytes(len(response.content))
+    if response.status_code != 200:
+        logger.error('Could not list %s: status %s', listing_url, response.status_code)
+        raise WebServiceError('Could not list the LRG files at ' + listing_url)
+    listing = dict(LISTING_LINK.findall(response.text))
+    logger.info('Found %s LRG files at %s', len(listing), listing_url)
+    return dict((file_name, listed or None) for file_name, listed in listing.items())
+
+
+def loadSyncManifest(manifest_path):
+    '''
+    Load a sync manifest, or make an empty one if there isn't one yet
+
+    Output -
+    manifest: Dictionary with 'files': a dictionary of the path of each file
+      in the store (e.g. public/LRG_1.xml) to a dictionary of its url, status,
+      lrg_id, size, sha256, ETag, Last-Modified, the date it was listed with,
+      and when it was synced.
+    '''
+    if not os.path.isfile(manifest_path):
+        return {'files': {}}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def planSync(listings, manifest, store):
+    '''
+    Work out which files need downloading. Files listed with the same date
+    as at the last sync, whose copy in the store is still the same size, are
+    taken to be unchanged without going to the network. Every other file is
+    fetched with a conditional request, so unchanged files aren't downloaded.
+
+    Input -
+    listings: List of (status, folder, listing) tuples, where listing is made by listLrgFolder.
+
+    Output -
+    sync_jobs: List of (store_path, url, local_path, status, entry, listed) tuples
+      of the files to fetch, where entry is the file's manifest entry or None.
+    unchanged: Dictionary of store path to manifest entry, for the files that are up to date.
+    '''
+    sync_jobs = []
+    unchanged = {}
+    for status, folder, listing in listings:
+        for file_name in sorted(listing):
+            store_path = status + '/' + file_name
+            local_path = os.path.join(store, status, file_name)
+            entry = manifest['files'].get(store_path)
+            listed = listing[file_name]
+            if entry is not None and os.path.isfile(local_path) and os.path.getsize(local_path) == entry['size']:
+                if listed is not None and entry.get('listed') == listed:
+                    unchanged[store_path] = entry
+                    continue
+            else:
+                entry = None
+            sync_jobs.append((store_path, folderUrl(folder) + file_name, local_path, status, entry, listed))
+    logger.info('%s files to fetch, %s unchanged', len(sync_jobs), len(unchanged))
+    return sync_jobs, unchanged
+
+
+def loadPartialInfo(local_path, url):
+    '''
+    The validator (ETag or Last-Modified) of a partly downloaded file, or None
+    if there isn't one, or it was a download of a different url
+    '''
+    info_path = local_path + PARTIAL_INFO_SUFFIX
+    if not os.path.isfile(local_path + PARTIAL_SUFFIX) or not os.path.isfile(info_path):
+        return None
+    with open(info_path) as info_file:
+        info = json.load(info_file)
+    return info['validator'] if info.get('url') == url else None
+
+
+def makeValidator(response):
+    '''
+    The validator to resume a download of a response with, for an If-Range header.
+    Weak ETags can't be used with If-Range, so Last-Modified is used instead.
+    '''
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def downloadLrgFile(url, local_path, entry):
+    '''
+    Download an LRG file into the store. A partly downloaded file is resumed
+    with a Range request if the server still has the same version of it, and
+    if the copy in the store is complete, it is only downloaded again if the
+    server's copy has changed.
+
+    Output -
+    outcome: String. 'downloaded', 'resumed' or 'not modified'.
+    response: The response, for its headers.
+    '''
+    partial_path = local_path + PARTIAL_SUFFIX
+    info_path = local_path + PARTIAL_INFO_SUFFIX
+    # the file is asked for as it is, so that ranges and sizes are of the file itself
+    headers = {'Accept-Encoding': 'identity'}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    validator = loadPartialInfo(local_path, url)
+    offset = os.path.getsize(partial_path) if validator else 0
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        headers['If-Range'] = validator
+
+    response = comfy_BED_web.getSession().get(url, timeout=comfy_BED_web.WEB_TIMEOUT, headers=headers, stream=True)
+    addHttpCall()
+    try:
+        if response.status_code == 304 and entry is not None:
+            return 'not modified', response
+        if response.status_code == 206 and offset:
+            mode, outcome = 'ab', 'resumed'
+            logger.info('Resuming %s from byte %s', url, offset)
+        elif response.status_code == 200:
+            mode, outcome = 'wb', 'downloaded'
+            with open(info_path, 'w') as info_file:
+                json.dump({'url': url, 'validator': makeValidator(response)}, info_file)
+        else:
+            logger.error('Could not download %s: status %s', url, response.status_code)
+            raise WebServiceError('Could not download {}: status {}'.format(url, response.status_code))
+
+        with open(partial_path, mode) as partial_file:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                partial_file.write(chunk)
+                addBytes(len(chunk))
+    finally:
+        response.close()
+
+    # the total size is the end of the Content-Range of a resumed download
+    expected_size = response.headers.get('Content-Length')
+    if outcome == 'resumed':
+        expected_size = response.headers.get('Content-Range', '').rpartition('/')[2]
+    if expected_size and expected_size.isdigit() and os.path.getsize(partial_path) != int(expected_size):
+        logger.error('The download of %s is %s bytes, not %s', url, os.path.getsize(partial_path), expected_size)
+        raise WebServiceError('The download of {} is incomplete'.format(url))
+    os.rename(partial_path, local_path)
+    os.remove(info_path)
+    return outcome, response
+
+
+def syncLrgFile(sync_job):
+    '''
+    Worker function, brings one file in the store up to date. Any error is
+    caught and returned, so that one failed download doesn't stop the sync,
+    and a partly downloaded file is kept to be resumed by the next sync.
+
+    Input -
+    sync_job: Tuple of (store_path, url, local_path, status, entry, listed), made by planSync.
+
+    Output -
+    Tuple of the store_path, the outcome ('downloaded', 'resumed', 'unchanged'
+    or 'failed') and the new manifest entry, or the error message.
+    '''
+    store_path, url, local_path, status, entry, listed = sync_job
+    with logCorrelation(os.path.basename(local_path)):
+        try:
+            outcome, response = downloadLrgFile(url, local_path, entry)
+            if outcome == 'not modified':
+                return store_path, 'unchanged', dict(entry, listed=listed)
+            digest = hashFile(local_path)
+            new_entry = {
+                'url': url,
+                'status': status,
+                'lrg_id': os.path.basename(local_path)[:-len('.xml')],
+                'size': os.path.getsize(local_path),
+                'sha256': digest,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'listed': listed,
+                'synced_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            if entry is not None and entry['sha256'] == digest:
+                # only the date changed
+                return store_path, 'unchanged', new_entry
+            logger.info('Synced %s (%s bytes, %s)', store_path, new_entry['size'], outcome)
+            return store_path, outcome, new_entry
+        except Exception as error:
+            logger.error('Could not sync %s: %r', url, error)
+            return store_path, 'failed', repr(error)
+
+
+def writeStoreStatuses(entries, status_path, now):
+    '''
+    Save the status of every LRG in the store as a snapshot for
+    comfy_BED_web.loadStatusSnapshot. An LRG in both directories is public.
+    '''
+    statuses = {}
+    for entry in entries.values():
+        if statuses.get(entry['lrg_id']) != 'public':
+            statuses[entry['lrg_id']] = entry['status']
+    with open(status_path, 'w') as snapshot:
+        snapshot.write('#LRG statuses synced at: ' + now.strftime("%Y-%m-%d %H:%M") + '\n')
+        for lrg_id in sorted(statuses, key=lambda lrg_id: int(lrg_id.split('_')[1])):
+            snapshot.write('{}\t{}\n'.format(lrg_id, statuses[lrg_id]))
+    logger.info('Wrote the status of %s LRGs to %s', len(statuses), status_path)
+
+
+def runSync(store, statuses=('public', 'pending'), max_in_flight=DEFAULT_MAX_IN_FLIGHT, now=None):
+    '''
+    Mirror LRG directories to a local store, using a pool of threads that
+    share the web session's connection pool. Files that are no longer listed
+    (e.g. pending LRGs that have been made public) are removed from the store.
+
+    Input -
+    store: String. Directory to mirror to.
+    statuses: List of the directories to mirror, 'public' and/or 'pending'.
+    max_in_flight: Int. Maximum number of files downloaded at once.
+
+    Output -
+    summary: Dictionary of the lists of store paths that were 'downloaded',
+      'resumed', 'unchanged', 'failed' and 'removed'.
+    '''
+    if now is None:
+        now = datetime.datetime.now()
+    manifest_path = os.path.join(store, SYNC_MANIFEST)
+    manifest = loadSyncManifest(manifest_path)
+    listings = []
+    for status, folder in SYNC_FOLDERS:
+        if status in statuses:
+            makeDirs(os.path.join(store, status))
+            listings.append((status, folder, listLrgFolder(folder)))
+
+    sync_jobs, entries = planSync(listings, manifest, store)
+    if sync_jobs:
+        from multiprocessing.pool import ThreadPool
+        comfy_BED_web.getSession()
+        pool = ThreadPool(max(1, min(max_in_flight, len(sync_jobs))))
+        try:
+            results = pool.map(syncLrgFile, sync_jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = []
+
+    listed_paths = set(sync_job[0] for sync_job in sync_jobs) | set(entries)
+    summary = {'downloaded': [], 'resumed': [], 'unchanged': sorted(entries), 'failed': [], 'removed': []}
+    for store_path, outcome, entry in results:
+        summary[outcome].append(store_path)
+        if outcome != 'failed':
+            entries[store_path] = entry
+
+    listed_statuses = [status for status, folder, listing in listings]
+    for store_path in sorted(set(manifest['files']) - set(entries)):
+        local_path = os.path.join(store, store_path)
+        if store_path.split('/')[0] in listed_statuses and store_path not in listed_paths:
+            if os.path.isfile(local_path):
+                os.remove(local_path)
+            summary['removed'].append(store_path)
+        elif os.path.isfile(local_path):
+            # the copy from the last sync is kept if the download failed, or its directory wasn't synced
+            entries[store_path] = manifest['files'][store_path]
+    for outcome in summary:
+        summary[outcome].sort()
+
+    writeManifest({'files': entries}, manifest_path)
+    writeStoreStatuses(entries, os.path.join(store, SYNC_STATUS_FILE), now)
+    return summary
+
+
+def summariseSync(summary):
+    '''
+    Print and log a summary of a sync, returns the number of files that failed
+    '''
+    for store_path in summary['failed']:
+        print('FAILED\t{}'.format(store_path))
+    line = '{} downloaded, {} resumed, {} unchanged, {} failed, {} removed'.format(
+        len(summary['downloaded']), len(summary['resumed']), len(summary['unchanged']),
+        len(summary['failed']), len(summary['removed']))
+    logger.info('Sync: %s', line)
+    print(line)
+    return len(summary['failed'])
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    setUpLogs(args, now)
+    logger.info("comfy_BED sync started running at: %s", now)
+    summary = runSync(args.store, args.statuses, args.max_in_flight, now)
+    failures = summariseSync(summary)
+    logger.info("comfy_BED sync complete")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
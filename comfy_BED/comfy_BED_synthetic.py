@@ -0,0 +1,218 @@
+from __future__ import print_function
+
+import argparse
+import textwrap
+import os
+import random
+
+from comfy_BED_cache import makeDirs
+
+# synthetic LRGs are numbered from here, well past the real ones
+SYNTHETIC_LRG_START = 90000
+
+# default shape of a synthetic LRG: about 1.5 Mb of sequence with 20 transcripts of up to 250 exons
+SYNTHETIC_TRANSCRIPTS = 20
+SYNTHETIC_EXONS = 250
+SYNTHETIC_EXON_LENGTH = 150
+SYNTHETIC_INTRON_LENGTH = 5000
+SYNTHETIC_SPANS = 4
+SYNTHETIC_FLANK = 5000
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Writes synthetic LRG xml files, much larger than most real LRGs, for
+        benchmarking: long genomic sequences, many transcripts of hundreds of
+        exons, and genome mappings split into several spans, onto the forward
+        strand of GRCh37 and the reverse strand of GRCh38.
+
+        examples:
+        python comfy_BED_synthetic.py -o synthetic_lrgs -n 10
+          Writes synthetic_lrgs/LRG_90000.xml to synthetic_lrgs/LRG_90009.xml
+        '''
+    ))
+    parser.add_argument(
+        '-o', '--output_dir', action='store', required=True,
+        help='Directory to write the synthetic LRG xml files to'
+    )
+    parser.add_argument(
+        '-n', '--count', action='store', type=int, default=1,
+        help='Number of LRG files to write. Defaults to 1.'
+    )
+    parser.add_argument(
+        '--transcripts', action='store', type=int, default=SYNTHETIC_TRANSCRIPTS,
+        help='Transcripts per LRG. Defaults to {}.'.format(SYNTHETIC_TRANSCRIPTS)
+    )
+    parser.add_argument(
+        '--exons', action='store', type=int, default=SYNTHETIC_EXONS,
+        help='Exons in the gene, each transcript has most of them. Defaults to {}.'.format(SYNTHETIC_EXONS)
+    )
+    parser.add_argument(
+        '--spans', action='store', type=int, default=SYNTHETIC_SPANS,
+        help='Mapping spans in each genome mapping. Defaults to {}.'.format(SYNTHETIC_SPANS)
+    )
+    parser.add_argument(
+        '--seed', action='store', type=int, default=0,
+        help='Random seed, the same seed always gives the same files. Defaults to 0.'
+    )
+    return parser.parse_args()
+
+
+def makeSequence(rng, length):
+    '''
+    A random DNA sequence, made by repeating a random 1 kb block so that long sequences are quick to make
+    '''
+    block = ''.join(rng.choice('ACGT') for i in range(1000))
+    return (block * (length // 1000 + 1))[:length]
+
+
+def makeSpans(gene_length, exon_bounds, span_count, other_start, strand, rng):
+    '''
+    Split the LRG into mapping spans, with the breaks in introns and a gap of
+    genome between each span, so every exon maps without changing length
+
+    Output -
+    spans: List of (lrg_start, lrg_end, other_start, other_end, mismatch position) tuples.
+    '''
+    # break in the middle of evenly spread introns
+    breaks = []
+    for i in range(1, span_count):
+        intron = len(exon_bounds) * i // span_count
+        breaks.append((exon_bounds[intron - 1][1] + exon_bounds[intron][0]) // 2)
+    lrg_starts = [1] + [position + 1 for position in breaks]
+    lrg_ends = breaks + [gene_length]
+
+    lengths = [lrg_end - lrg_start + 1 for lrg_start, lrg_end in zip(lrg_starts, lrg_ends)]
+    gaps = [rng.randint(10, 100) for i in range(span_count - 1)] + [0]
+    total_length = sum(lengths) + sum(gaps)
+    spans = []
+    position = other_start if strand == 1 else other_start + total_length - 1
+    for lrg_start, lrg_end, length, gap in zip(lrg_starts, lrg_ends, lengths, gaps):
+        if strand == 1:
+            span_start, span_end = position, position + length - 1
+            position = span_end + gap + 1
+        else:
+            span_start, span_end = position - length + 1, position
+            position = span_start - gap - 1
+        spans.append((lrg_start, lrg_end, span_start, span_end, rng.randint(lrg_start, lrg_end)))
+    return spans
+
+
+def writeMapping(lines, coord_system, chrom, spans, strand):
+    '''
+    Add the lines of a genome <mapping> with a mismatch diff in each span
+    '''
+    lines.append('      <mapping coord_system="{}" other_name="{}" other_start="{}" other_end="{}" type="main_assembly">'.format(
+        coord_system, chrom, min(span[2] for span in spans), max(span[3] for span in spans)))
+    for lrg_start, lrg_end, other_start, other_end, mismatch in spans:
+        other_mismatch = other_start + mismatch - lrg_start if strand == 1 else other_end - (mismatch - lrg_start)
+        lines.append('        <mapping_span lrg_start="{}" lrg_end="{}" other_start="{}" other_end="{}" strand="{}">'.format(
+            lrg_start, lrg_end, other_start, other_end, strand))
+        lines.append('          <diff type="mismatch" lrg_start="{0}" lrg_end="{0}" other_start="{1}" other_end="{1}" '
+                     'lrg_sequence="A" other_sequence="G" />'.format(mismatch, other_mismatch))
+        lines.append('        </mapping_span>')
+    lines.append('      </mapping>')
+
+
+def makeSyntheticLrg(lrg_number=SYNTHETIC_LRG_START, transcripts=SYNTHETIC_TRANSCRIPTS, exons=SYNTHETIC_EXONS,
+                     spans=SYNTHETIC_SPANS, seed=0):
+    '''
+    Make the xml of a synthetic LRG, laid out like a real one
+
+    Input -
+    lrg_number: Integer. The LRG is LRG_<lrg_number>.
+    transcripts: Integer. Number of transcripts. t1 has every exon, the others skip some.
+    exons: Integer. Number of exons in the gene.
+    spans: Integer. Number of mapping spans in each genome mapping.
+    seed: Integer. Random seed.
+
+    Output -
+    xml: Bytes. The LRG xml.
+    '''
+    rng = random.Random('{}_{}'.format(seed, lrg_number))
+    lrg_id = 'LRG_{}'.format(lrg_number)
+    exon_bounds = []
+    position = SYNTHETIC_FLANK + 1
+    for i in range(exons):
+        exon_length = rng.randint(SYNTHETIC_EXON_LENGTH // 2, SYNTHETIC_EXON_LENGTH * 2)
+        exon_bounds.append((position, position + exon_length - 1))
+        position += exon_length + rng.randint(SYNTHETIC_INTRON_LENGTH // 5, SYNTHETIC_INTRON_LENGTH * 2)
+    gene_length = exon_bounds[-1][1] + SYNTHETIC_FLANK
+    sequence = makeSequence(rng, gene_length)
+
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<lrg schema_version="1.9">', '  <fixed_annotation>',
+             '    <id>{}</id>'.format(lrg_id), '    <sequence>{}</sequence>'.format(sequence)]
+    for transcript_number in range(1, transcripts + 1):
+        # every transcript has the first and last exons, the others skip some of the rest
+        kept = [i for i in range(exons) if transcript_number == 1 or i in (0, exons - 1) or rng.random() > 0.1]
+        cdna = ''.join(sequence[exon_bounds[i][0] - 1:exon_bounds[i][1]] for i in kept)
+        coding_start = exon_bounds[kept[0]][0] + rng.randint(0, 50)
+        coding_end = exon_bounds[kept[-1]][1] - rng.randint(0, 50)
+        lines.append('    <transcript name="t{}">'.format(transcript_number))
+        lines.append('      <coordinates coord_system="{}" start="{}" end="{}" strand="1" />'.format(
+            lrg_id, exon_bounds[kept[0]][0], exon_bounds[kept[-1]][1]))
+        lines.append('      <cdna>\n        <sequence>{}</sequence>\n      </cdna>'.format(cdna))
+        lines.append('      <coding_region>')
+        lines.append('        <coordinates coord_system="{}" start="{}" end="{}" strand="1" />'.format(
+            lrg_id, coding_start, coding_end))
+        lines.append('        <translation name="p{}">\n          <sequence>{}</sequence>\n        </translation>'.format(
+            transcript_number, 'M' * (len(cdna) // 3)))
+        lines.append('      </coding_region>')
+        cdna_position = 1
+        for label, i in enumerate(kept, 1):
+            start, end = exon_bounds[i]
+            lines.append('      <exon label="{}">'.format(label))
+            lines.append('        <coordinates coord_system="{}" start="{}" end="{}" strand="1" />'.format(lrg_id, start, end))
+            lines.append('        <coordinates coord_system="{}t{}" start="{}" end="{}" />'.format(
+                lrg_id, transcript_number, cdna_position, cdna_position + end - start))
+            lines.append('      </exon>')
+            cdna_position += end - start + 1
+            if label < len(kept):
+                lines.append('      <intron phase="0" />')
+        lines.append('    </transcript>')
+    lines.append('  </fixed_annotation>')
+
+    # forward strand on GRCh37, reverse strand on GRCh38
+    chrom = str(lrg_number % 22 + 1)
+    other_start = 1000000 + (lrg_number % 1000) * 2000000
+    lines += ['  <updatable_annotation>', '    <annotation_set type="lrg">']
+    writeMapping(lines, 'GRCh37.p13', chrom, makeSpans(gene_length, exon_bounds, spans, other_start, 1, rng), 1)
+    writeMapping(lines, 'GRCh38.p12', chrom, makeSpans(gene_length, exon_bounds, spans, other_start + 500000, -1, rng), -1)
+    lines += ['    </annotation_set>', '  </updatable_annotation>', '</lrg>', '']
+    return '\n'.join(lines).encode('utf-8')
+
+
+def writeSyntheticLrgs(output_dir, count=1, transcripts=SYNTHETIC_TRANSCRIPTS, exons=SYNTHETIC_EXONS,
+                       spans=SYNTHETIC_SPANS, seed=0):
+    '''
+    Write count synthetic LRGs (see makeSyntheticLrg) to output_dir as LRG_<number>.xml
+
+    Output -
+    xml_paths: List of the files written.
+    '''
+    makeDirs(output_dir)
+    xml_paths = []
+    for lrg_number in range(SYNTHETIC_LRG_START, SYNTHETIC_LRG_START + count):
+        xml_path = os.path.join(output_dir, 'LRG_{}.xml'.format(lrg_number))
+        with open(xml_path, 'wb') as xml_file:
+            xml_file.write(makeSyntheticLrg(lrg_number, transcripts, exons, spans, seed))
+        xml_paths.append(xml_path)
+    return xml_paths
+
+
+def main():
+    args = getArgs()
+    for xml_path in writeSyntheticLrgs(args.output_dir, args.count, args.transcripts, args.exons, args.spans, args.seed):
+        print(xml_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import logging
+import collections
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where peak memory isn't recorded
+    resource = None
+
+logger = logging.getLogger('comfy_BED')
+
+# the stages of a comfy_BED run, in the order they happen
+STAGES = ('fetch', 'parse', 'status', 'mapping', 'convert', 'write')
+
+# the timings being recorded, set by startTimings. Stages aren't timed while this is None.
+TIMINGS = None
+
+TIMING_FIELDS = ('stage', 'calls', 'seconds', 'bytes', 'http_calls', 'peak_rss_kb', 'traced_peak_kb')
+
+
+def getPeakRss():
+    '''
+    The peak resident memory of this process so far in KB, or None if it can't be found
+    '''
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives KB, macOS gives bytes
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def getTracemalloc():
+    '''
+    The tracemalloc module if memory is being traced (Python 3 only), otherwise None
+    '''
+    tracemalloc = sys.modules.get('tracemalloc')
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return None
+    return tracemalloc
+
+
+class RunTimings(object):
+    '''
+    Records, for each stage of a run, the number of times it ran, the wall
+    time spent in it, the bytes it read or wrote, the HTTP requests it made
+    and the peak memory of the process by the end of it. Time spent in a
+    stage that is run inside another one (e.g. the HTTP requests of a status
+    check while fetching) only counts towards the inner stage.
+    '''
+    def __init__(self):
+        self.stats = collections.OrderedDict()
+        self.stack = []
+
+    def getStats(self, name):
+        if name not in self.stats:
+            self.stats[name] = dict((field, 0) for field in TIMING_FIELDS[1:5])
+            self.stats[name].update(stage=name, peak_rss_kb=None, traced_peak_kb=None)
+        return self.stats[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        frame = [name, time.time(), 0.0]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            elapsed = time.time() - frame[1]
+            stats = self.getStats(name)
+            stats['calls'] += 1
+            stats['seconds'] += elapsed - frame[2]
+            stats['peak_rss_kb'] = getPeakRss()
+            tracemalloc = getTracemalloc()
+            if tracemalloc is not None:
+                stats['traced_peak_kb'] = max(stats['traced_peak_kb'] or 0, tracemalloc.get_traced_memory()[1] // 1024)
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+            if self.stack:
+                self.stack[-1][2] += elapsed
+
+    def addBytes(self, byte_count):
+        '''
+        Count bytes read or written by the current stage
+        '''
+        self.getStats(self.stack[-1][0] if self.stack else 'other')['bytes'] += byte_count
+
+    def addHttpCall(self):
+        '''
+        Count an HTTP request made by the current stage
+        '''
+        self.getStats(self.stack[-1][0] if self.stack else 'other')['http_calls'] += 1
+
+    def toRecords(self):
+        '''
+        The stats of each stage that ran as dictionaries, in stage order
+        '''
+        names = [name for name in STAGES if name in self.stats] + [name for name in self.stats if name not in STAGES]
+        return [dict(self.stats[name]) for name in names]
+
+    def addRecords(self, records):
+        '''
+        Add the stats of another run (e.g. a batch worker) to these ones
+        '''
+        for record in records:
+            stats = self.getStats(record['stage'])
+            for field in TIMING_FIELDS[1:5]:
+                stats[field] += record[field]
+            for field in TIMING_FIELDS[5:]:
+                if record[field] is not None:
+                    stats[field] = max(stats[field] or 0, record[field])
+
+
+def startTimings():
+    '''
+    Start recording the timings of each stage, returns the RunTimings they are recorded in
+    '''
+    global TIMINGS
+    TIMINGS = RunTimings()
+    return TIMINGS
+
+
+def stopTimings():
+    '''
+    Stop recording timings, returns the RunTimings they were recorded in
+    '''
+    global TIMINGS
+    timings, TIMINGS = TIMINGS, None
+    return timings
+
+
+def timeStage(name):
+    '''
+    Context manager that times a stage of the run, if timings are being recorded
+    '''
+    if TIMINGS is None:
+        return NOT_TIMED
+    return TIMINGS.stage(name)
+
+
+def addBytes(byte_count):
+    if TIMINGS is not None:
+        TIMINGS.addBytes(byte_count)
+
+
+def addHttpCall():
+    if TIMINGS is not None:
+        TIMINGS.addHttpCall()
+
+
+class NotTimed(object):
+    '''
+    Context manager that does nothing, used for stages when timings aren't being recorded
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        return False
+
+NOT_TIMED = NotTimed()
+
+
+def writeTimings(records, output_file, **extra):
+    '''
+    Append timing records to a file as JSON lines, one per stage, or write them to stderr for '-'
+
+    Input -
+    records: List of dictionaries from RunTimings.toRecords.
+    output_file: String. The file to append to, or '-' for stderr.
+    extra: Fields added to every line, e.g. the LRG.
+    '''
+    lines = []
+    for record in records:
+        record = dict(record, **extra)
+        record['seconds'] = round(record['seconds'], 6)
+        lines.append(json.dumps(record, sort_keys=True) + '\n')
+    if output_file == '-':
+        sys.stderr.writelines(lines)
+    else:
+        with open(output_file, 'a') as timings_file:
+            timings_file.writelines(lines)
+
+
+def formatTimingTable(records):
+    '''
+    A summary table of timing records, with a total line
+    '''
+    rows = [(record['stage'], record['calls'], '{:.3f}'.format(record['seconds']), record['bytes'],
+             record['http_calls'], record['peak_rss_kb'] if record['peak_rss_kb'] is not None else '-')
+            for record in records]
+    peaks = [record['peak_rss_kb'] for record in records if record['peak_rss_kb'] is not None]
+    rows.append(('total', sum(record['calls'] for record in records),
+                 '{:.3f}'.format(sum(record['seconds'] for record in records)),
+                 sum(record['bytes'] for record in records), sum(record['http_calls'] for record in records),
+                 max(peaks) if peaks else '-'))
+    header = ('stage', 'calls', 'seconds', 'bytes', 'http_calls', 'peak_rss_kb')
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    return '\n'.join('  '.join(str(value).ljust(width) if i == 0 else str(value).rjust(width)
+                               for i, (value, width) in enumerate(zip(row, widths)))
+                     for row in [header] + rows)
+
+
+def startMemoryTrace():
+    '''
+    Trace memory allocations with tracemalloc, so each stage records the
+    peak memory allocated during it. Returns False if tracemalloc isn't
+    available (it needs Python 3).
+    '''
+    try:
+        import tracemalloc
+    except ImportError:
+        logger.warning('Memory tracing needs tracemalloc, which needs Python 3')
+        return False
+    tracemalloc.start()
+    return True
+
+
+def runProfiled(function, profile_file, *args):
+    '''
+    Run a function under cProfile, saving the profile to profile_file
+    (which can be read with pstats or snakeviz), and return its result
+    '''
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(profile_file)
+        logger.info('Saved the profile of the run to %s', os.path.abspath(profile_file))
@@ -0,0 +1,422 @@
+from __future__ import print_function
+
+import argparse
+import textwrap
+import os
+import json
+import time
+import datetime
+import logging
+import multiprocessing
+
+from comfy_BED import setUpLogs, addLogArgs, setUpWeb, addWebArgs, GENOME_BUILDS
+from comfy_BED_batch import convertBatchItem
+from comfy_BED_corpus import hashFile, writeManifest
+from comfy_BED_cache import makeDirs
+from comfy_BED_input import isLrgXmlPath
+from comfy_BED_errors import InvalidInputError
+
+logger = logging.getLogger('comfy_BED')
+
+# what each converted file was when it was converted, kept in the output directory
+# so that files aren't converted again after a restart unless they have changed
+WATCH_STATE = 'watch_state.json'
+
+WATCHERS = ('auto', 'inotify', 'poll')
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Watches a directory, and makes the BED files of each LRG xml file that is
+        added to it or changed, as soon as it has finished being written. Files
+        are converted by a pool of processes, and only files that are new or have
+        changed since they were last converted are converted.
+
+        examples:
+        python comfy_BED_watch.py -d /shared/LRG_ingest -t t1 -o /shared/LRG_beds -p 4
+          Converts transcript 1 of every LRG that lands in /shared/LRG_ingest
+
+        python comfy_BED_watch.py -d /shared/LRG_ingest -t t1 -o /shared/LRG_beds --once
+          Converts the new and changed files in the directory, then exits
+        '''
+    ))
+
+    # directory to watch
+    parser.add_argument(
+        '-d', '--directory', action='store', required=True,
+        help='The directory to watch for LRG xml files (.xml, .xml.gz or .xml.bz2)'
+    )
+
+    # transcript options
+    parser.add_argument(
+        '-t', '--transcripts', action='store', default='t1',
+        help='List of transcripts to make BED files for, from every file. Defaults to t1.'
+    )
+
+    # genome build options
+    parser.add_argument(
+        '-g', '--genome_build', action='store',
+        choices=GENOME_BUILDS, default='GRCh37',
+        help='Genome build of the BED files. Defaults to GRCh37.'
+    )
+
+    # output directory
+    parser.add_argument(
+        '-o', '--output_dir', action='store', required=True,
+        help='Directory to write the BED files to, and the record of the files converted'
+    )
+
+    # number of processes
+    parser.add_argument(
+        '-p', '--processes', action='store', type=int, default=multiprocessing.cpu_count(),
+        help='Number of worker processes. Defaults to the number of CPUs.'
+    )
+
+    # watching options
+    parser.add_argument(
+        '--watcher', action='store', choices=WATCHERS, default='auto',
+        help=textwrap.dedent(
+        '''
+        How to notice changes: inotify (Linux, needs the inotify_simple package), or
+        polling the directory. Defaults to auto, inotify if it can be used.
+        '''
+    ))
+    parser.add_argument(
+        '--debounce', action='store', type=float, default=DEFAULT_DEBOUNCE,
+        help=textwrap.dedent(
+        '''
+        Seconds a file must go unchanged before it is converted, so that files still
+        being written aren't read, and quick changes are converted once. Defaults to {}.
+        '''.format(DEFAULT_DEBOUNCE)
+    ))
+    parser.add_argument(
+        '--poll_interval', action='store', type=float, default=DEFAULT_POLL_INTERVAL,
+        help='Seconds between scans of the directory when polling. Defaults to {}.'.format(DEFAULT_POLL_INTERVAL)
+    )
+    parser.add_argument(
+        '--once', action='store_true',
+        help='Convert the new and changed files in the directory, then exit instead of watching'
+    )
+
+    # annotation index
+    parser.add_argument(
+        '-x', '--annotation_index', action='store',
+        help='An annotation index made by comfy_BED_index.py, to load indexed files from.'
+    )
+    addWebArgs(parser)
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+def isWatchedFile(file_name):
+    '''
+    LRG xml files, except hidden files (e.g. an upload in progress)
+    '''
+    return isLrgXmlPath(file_name) and not file_name.startswith('.')
+
+
+def scanDirectory(directory):
+    '''
+    The size and mtime of every watched file in a directory
+
+    Output -
+    scan: Dictionary of file path to (size, mtime).
+    '''
+    scan = {}
+    for file_name in os.listdir(directory):
+        path = os.path.join(directory, file_name)
+        if not isWatchedFile(file_name):
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # removed since it was listed
+            continue
+        if os.path.isfile(path):
+            scan[path] = (stat.st_size, stat.st_mtime)
+    return scan
+
+
+class PollingWatcher(object):
+    '''
+    Notices changes by scanning the directory every poll_interval seconds,
+    comparing the size and mtime of each file with the last scan
+    '''
+    name = 'poll'
+
+    def __init__(self, directory, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.last_scan = scanDirectory(directory)
+
+    def changes(self, timeout):
+        '''
+        Wait up to timeout seconds (or a poll interval, if that is shorter) and return the files that changed
+        '''
+        time.sleep(max(0, min(timeout, self.poll_interval)))
+        scan = scanDirectory(self.directory)
+        changed = [path for path, stat in scan.items() if self.last_scan.get(path) != stat]
+        self.last_scan = scan
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    '''
+    Notices changes with inotify, which reports files as they are finished
+    being written or moved into the directory, so the directory is only
+    scanned once, when the watcher starts
+    '''
+    name = 'inotify'
+
+    def __init__(self, directory, inotify_simple):
+        self.directory = directory
+        self.inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        self.inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    def changes(self, timeout):
+        events = self.inotify.read(timeout=int(timeout * 1000))
+        return [os.path.join(self.directory, event.name) for event in events if isWatchedFile(event.name)]
+
+    def close(self):
+        self.inotify.close()
+
+
+def makeWatcher(directory, watcher='auto', poll_interval=DEFAULT_POLL_INTERVAL):
+    '''
+    Make a watcher of a directory. 'auto' is inotify if the inotify_simple
+    package is installed and inotify works here (it is Linux only), otherwise polling.
+    '''
+    if watcher not in WATCHERS:
+        logger.error('The watcher must be one of: %s', ', '.join(WATCHERS))
+        raise InvalidInputError('Unknown watcher: ' + str(watcher))
+    if not os.path.isdir(directory):
+        logger.error('The watched directory is not a directory: %s', directory)
+        raise InvalidInputError('The watched directory is not a directory.')
+    if watcher in ('auto', 'inotify'):
+        try:
+            import inotify_simple
+            return InotifyWatcher(directory, inotify_simple)
+        except (ImportError, OSError) as error:
+            if watcher == 'inotify':
+                logger.error('Could not watch %s with inotify: %r', directory, error)
+                raise InvalidInputError('inotify can not be used: ' + repr(error))
+            logger.info('Polling %s, as inotify can not be used: %r', directory, error)
+    return PollingWatcher(directory, poll_interval)
+
+
+class Debouncer(object):
+    '''
+    Holds changed files until they have gone debounce seconds without
+    changing again, so a file is converted once it has been written,
+    however many times it changed while it was being written
+    '''
+    def __init__(self, debounce=DEFAULT_DEBOUNCE):
+        self.debounce = debounce
+        self.pending = {}
+
+    def add(self, paths, now):
+        for path in paths:
+            self.pending[path] = now
+
+    def nextDue(self, now, busy=()):
+        '''
+        Seconds until the next file not in busy is ready, or None if none are waiting
+        '''
+        waiting = [changed_at for path, changed_at in self.pending.items() if path not in busy]
+        if not waiting:
+            return None
+        return max(0, min(waiting) + self.debounce - now)
+
+    def ready(self, now, busy=()):
+        '''
+        Take the files that are ready to convert, leaving any in busy (being converted) until they are done
+        '''
+        ready = sorted(path for path, changed_at in self.pending.items()
+                       if now - changed_at >= self.debounce and path not in busy)
+        for path in ready:
+            del self.pending[path]
+        return ready
+
+
+def loadWatchState(state_path):
+    '''
+    Load the record of the files converted by earlier runs, or an empty one
+
+    Output -
+    state: Dictionary with 'settings' of the conversion, and 'files': a dictionary
+      of file path to its size, mtime, sha256, and the BED files written or the error.
+    '''
+    if not os.path.isfile(state_path):
+        return {'settings': None, 'files': {}}
+    with open(state_path) as state_file:
+        return json.load(state_file)
+
+
+def checkChanged(path, entry):
+    '''
+    Whether a file has changed since its state entry was recorded. Files with
+    the same size and mtime aren't read, others are hashed.
+
+    Output -
+    Tuple of True/False, and (size, mtime, sha256) or None if the file has gone.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False, None
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+        return False, (stat.st_size, stat.st_mtime, entry['sha256'])
+    digest = hashFile(path)
+    changed = entry is None or entry['sha256'] != digest
+    return changed, (stat.st_size, stat.st_mtime, digest)
+
+
+class WatchRun(object):
+    '''
+    Converts the files reported by a watcher, through the batch worker
+    (convertBatchItem) on a pool of processes, recording each file that
+    is converted in the watch state of the output directory.
+
+    Input -
+    transcripts, genome_build: What to make BED files of from every file.
+    output_dir: String. Directory to write the BED files and the watch state to.
+    processes: Int. Number of worker processes, files are converted in this process if 1.
+    '''
+    def __init__(self, transcripts, genome_build, output_dir, processes=1, annotation_index=None):
+        self.transcripts = transcripts
+        self.genome_build = genome_build
+        self.output_dir = output_dir
+        self.annotation_index = annotation_index
+        makeDirs(output_dir)
+        self.state_path = os.path.join(output_dir, WATCH_STATE)
+        self.state = loadWatchState(self.state_path)
+        settings = {'transcripts': transcripts, 'genome_build': genome_build}
+        if self.state['settings'] != settings:
+            self.state = {'settings': settings, 'files': {}}
+        self.pool = multiprocessing.Pool(processes) if processes > 1 else None
+        # file path -> (AsyncResult, (size, mtime, sha256))
+        self.in_flight = {}
+        self.results = []
+
+    def submit(self, path):
+        '''
+        Start converting a file if it is new or has changed, returns True if it was started
+        '''
+        changed, file_stat = checkChanged(path, self.state['files'].get(path))
+        if not changed:
+            if file_stat is not None and path in self.state['files']:
+                self.state['files'][path].update(size=file_stat[0], mtime=file_stat[1])
+            logger.debug('%s is unchanged since it was converted', path)
+            return False
+        batch_job = ((path, self.transcripts, self.genome_build), self.output_dir,
+                     datetime.datetime.now(), self.annotation_index)
+        if self.pool is None:
+            self.finish(path, convertBatchItem(batch_job), file_stat)
+        else:
+            self.in_flight[path] = (self.pool.apply_async(convertBatchItem, (batch_job,)), file_stat)
+        return True
+
+    def collect(self):
+        '''
+        Record the conversions that have finished
+        '''
+        for path, (async_result, file_stat) in list(self.in_flight.items()):
+            if async_result.ready():
+                del self.in_flight[path]
+                self.finish(path, async_result.get(), file_stat)
+
+    def finish(self, path, result, file_stat):
+        batch_item, success, outcome = result
+        size, mtime, digest = file_stat
+        entry = {'size': size, 'mtime': mtime, 'sha256': digest}
+        if success:
+            entry['bed_files'] = outcome
+            logger.info('Converted %s to %s', path, ', '.join(outcome))
+        else:
+            entry['error'] = outcome
+        self.state['files'][path] = entry
+        writeManifest(self.state, self.state_path)
+        self.results.append(result)
+
+    def close(self):
+        '''
+        Wait for the conversions in flight, then stop the pool
+        '''
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.collect()
+
+
+def watchDirectory(directory, transcripts, genome_build, output_dir, processes=1, watcher='auto',
+                   debounce=DEFAULT_DEBOUNCE, poll_interval=DEFAULT_POLL_INTERVAL, annotation_index=None,
+                   once=False, stop=None):
+    '''
+    Convert the LRG files in a directory that are new or have changed since
+    they were last converted, then (unless once is True) keep converting
+    files as they are added or changed, until stop (a threading.Event) is set
+    or the process is interrupted.
+
+    Changes are collected by the watcher, and each file is converted once it
+    has gone debounce seconds without changing. A file that changes while it
+    is being converted is converted again afterwards.
+
+    Output -
+    results: List of (batch_item, success, files or error) tuples, one per
+      conversion, in the order they finished.
+    '''
+    watch = makeWatcher(directory, watcher, poll_interval)
+    run = WatchRun(transcripts, genome_build, output_dir, processes, annotation_index)
+    debouncer = Debouncer(debounce)
+    logger.info('Watching %s with %s', directory, watch.name)
+    try:
+        # files already there are converted once they have gone debounce seconds since they were last changed
+        for path, (size, mtime) in sorted(scanDirectory(directory).items()):
+            if once:
+                run.submit(os.path.abspath(path))
+            else:
+                debouncer.add([os.path.abspath(path)], mtime)
+        while not once and not (stop is not None and stop.is_set()):
+            timeout = debouncer.nextDue(time.time(), run.in_flight)
+            changed = watch.changes(poll_interval if timeout is None else min(timeout, poll_interval))
+            debouncer.add([os.path.abspath(path) for path in changed], time.time())
+            run.collect()
+            for path in debouncer.ready(time.time(), run.in_flight):
+                run.submit(path)
+    except KeyboardInterrupt:
+        logger.info('Stopped watching %s', directory)
+    finally:
+        watch.close()
+        run.close()
+    return run.results
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    setUpLogs(args, now, multiprocess=args.processes > 1)
+    logger.info("comfy_BED watch started running at: %s", now)
+    setUpWeb(args)
+    results = watchDirectory(args.directory, args.transcripts, args.genome_build, args.output_dir, args.processes,
+                             args.watcher, args.debounce, args.poll_interval, args.annotation_index, args.once)
+    failures = len([result for result in results if not result[1]])
+    logger.info("comfy_BED watch complete, %s conversions, %s failed", len(results), failures)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
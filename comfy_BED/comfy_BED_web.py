@@ -1,6 +1,188 @@
-import requests
+import argparse
+import textwrap
+import datetime
 import logging
-import xml.etree.ElementTree as ET
+
+from comfy_BED_errors import WebServiceError, OfflineCacheMissError, LrgNotFoundError, LrgStatusError
+from comfy_BED_timing import addBytes, addHttpCall
+from comfy_BED_xml import getXmlBackend
+
+logger = logging.getLogger('comfy_BED')
+
+# web service addresses
+EBI_SEARCH_URL = 'https://www.ebi.ac.uk/ebisearch/ws/rest/lrg'
+LRG_XML_URL = 'http://ftp.ebi.ac.uk/pub/databases/lrgex'
+
+# connection settings: (connect, read) timeout in seconds, number of retries
+# with exponential backoff, and the number of pooled connections per host
+WEB_TIMEOUT = (10, 60)
+WEB_RETRIES = 3
+WEB_BACKOFF_FACTOR = 0.5
+WEB_POOL_SIZE = 16
+
+# one session is shared by every web query so that connections are reused
+SESSION = None
+
+# optional LrgWebCache of web responses, set with setCache
+CACHE = None
+
+# statuses of the LRGs seen in this run, so each status is only looked up once
+# LRG ID -> (status, status message)
+LRG_STATUSES = {}
+
+# maximum number of LRG IDs in one bulk status query
+STATUS_QUERY_SIZE = 100
+
+# optional local index of identifiers (HGNC symbols, RefSeq/Ensembl accessions
+# and LRG IDs) to LRG IDs, loaded with loadIdIndex. Identifiers that match more
+# than one LRG map to None.
+LRG_ID_INDEX = {}
+
+# public listing of LRGs and their gene/transcript identifiers
+LRG_LISTING_FILE = 'list_LRGs_transcripts_xrefs.txt'
+
+
+def makeSession():
+    '''
+    Make a requests session with a connection pool, that retries failed
+    connections and server errors with exponential backoff
+    '''
+    # requests is only imported once the web is used, as it takes longer to
+    # import than the rest of comfy_BED put together
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
+
+    retries = Retry(
+        total=WEB_RETRIES, backoff_factor=WEB_BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504), raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=WEB_POOL_SIZE, pool_maxsize=WEB_POOL_SIZE, max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def getSession():
+    '''
+    Get the shared session, making it on first use
+    '''
+    global SESSION
+    if SESSION is None:
+        SESSION = makeSession()
+    return SESSION
+
+
+def setCache(cache):
+    '''
+    Use an LrgWebCache for all web queries, or stop caching if cache is None
+    '''
+    global CACHE
+    CACHE = cache
+
+
+def makeIdentifierKeys(identifier):
+    '''
+    Make the identifier index keys for an identifier: the upper case
+    identifier and, for versioned accessions such as NM_000088.3, the
+    accession without its version
+    '''
+    key = identifier.strip().upper()
+    keys = [key]
+    accession, dot, version = key.rpartition('.')
+    if dot and accession and version.isdigit():
+        keys.append(accession)
+    return keys
+
+
+def lookupLrgId(input_text):
+    '''
+    Look an identifier up in the local identifier index, returns the LRG ID
+    or None if it isn't in the index (or matches more than one LRG)
+    '''
+    for key in makeIdentifierKeys(input_text):
+        if LRG_ID_INDEX.get(key):
+            return LRG_ID_INDEX[key]
+    return None
+
+
+def webGet(url, kind='search'):
+    '''
+    GET a url using the shared session and the default timeout.
+
+    If a cache is set, fresh cached responses are returned without going to
+    the network, and stale ones are revalidated with their ETag/Last-Modified
+    headers. kind is the type of response, which sets how long it is cached
+    for: 'search', 'status' or 'xml'.
+    '''
+    if CACHE is None:
+        response = getSession().get(url, timeout=WEB_TIMEOUT)
+        addHttpCall()
+        addBytes(len(response.content))
+        return response
+    from comfy_BED_cache import CachedResponse
+
+    entry = CACHE.get(url)
+    if entry is not None and (CACHE.offline or CACHE.isFresh(entry)):
+        logger.info('Using cached response for %s', url)
+        return CachedResponse(CACHE.readBody(entry))
+    if CACHE.offline:
+        logger.error('%s is not in the cache, and the cache is offline', url)
+        raise OfflineCacheMissError('{} is not in the cache, and the cache is offline'.format(url))
+
+    # ask the server to only send the body if it has changed
+    headers = {}
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+    if entry is not None and entry.last_modified:
+        headers['If-Modified-Since'] = entry.last_modified
+    response = getSession().get(url, timeout=WEB_TIMEOUT, headers=headers)
+    addHttpCall()
+    addBytes(len(response.content))
+
+    if response.status_code == 304 and entry is not None:
+        logger.info('Cached response for %s has not changed', url)
+        CACHE.touch(url)
+        return CachedResponse(CACHE.readBody(entry))
+    if response.status_code == 200:
+        CACHE.put(url, kind, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return response
+
+
+def searchLrgId(query, input_text):
+    '''
+    Search the LRG web service for an identifier
+
+    Input -
+    query: String. The EBI search query, e.g. 'name:COL1A1'.
+    input_text: String. The identifier being looked up, for the log.
+
+    Output -
+    lrg_id: String. The LRG ID of the only hit, or None if there were no
+      hits or more than one. Throws a WebServiceError if the query fails.
+    '''
+    query_response = webGet('{}?query={}'.format(EBI_SEARCH_URL, query))
+    if query_response.status_code != 200:
+        logger.error('Could not query the API, check your connection and try again.')
+        raise WebServiceError('Could not query the API, check your connection and try again.')
+
+    # check that there is exactly 1 entry returned
+    root = getXmlBackend().fromstring(query_response.text)
+    for child in root.iter('hitCount'):
+        if child.text == '0':
+            logger.info('There were no hits for %s searching %s', input_text, query)
+            return None
+        if child.text != '1':
+            logger.info('Expected one hit for %s searching %s, there were %s', input_text, query, child.text)
+            return None
+
+    # if so, extract the lrg id
+    lrg_id = None
+    for child in root.iter('entry'):
+        lrg_id = child.get('id')
+        logger.info('Found LRG ID for %s: %s', input_text, lrg_id)
+    return lrg_id
 
 
 def getLrgId(input_text):
@@ -12,74 +194,35 @@ def getLrgId(input_text):
       number, a HGNC gene symbol or a transcript name
 
     Output -
-    lrg_id: String. The LRG ID in the format LRG_<number>. If the 
-      LRG ID can't be calculated from the input, an error will be thrown.
+    lrg_id: String. The LRG ID in the format LRG_<number>. If the
+      LRG ID can't be calculated from the input, an LrgNotFoundError is
+      thrown, and a WebServiceError if the web service can't be queried.
     '''
-    logging.info('Web query input: {}'.format(input_text))
+    logger.info('Web query input: %s', input_text)
+    indexed_lrg_id = lookupLrgId(input_text)
 
     # if input is an lrg number, save the variable
     if input_text.startswith('LRG_'):
         lrg_id = input_text
 
+    # if input is in the local identifier index, no query is needed
+    elif indexed_lrg_id is not None:
+        lrg_id = indexed_lrg_id
+        logger.info('Found LRG ID for %s in the identifier index: %s', input_text, lrg_id)
+
     # if input isn't an lrg number, try to query by name to find lrg number
     else:
-        logging.info('Querying webservices to get LRG ID and check that it is valid')
-
-        # try to query by HGNC name
-        try:
-            name_query_url = 'https://www.ebi.ac.uk/ebisearch/ws/rest/lrg?query=name:{}'.format(input_text)
-            name_query_response = requests.get(name_query_url)
-
-            if name_query_response.status_code != 200:
-                logging.error('Could not query the API, check your connection and try again.')
-            assert name_query_response.status_code == 200, 'Could not query the API, check your connection and try again.'
-
-            # loop through the response xml
-            root = ET.fromstring(name_query_response.text)
-            for child in root.iter('hitCount'):
-                # check that there is exactly 1 entry returned
-                if child.text == '1':
-                    pass
-                elif child.text == '0':
-                    logging.error('There were no hits for {}, check the input'.format(input_text))
-                else:
-                    logging.error('Expected one hit but there were multiple, check the input')
-                assert child.text == '1'
-            # if so, extract the lrg id and save as a variable
-            for child in root.iter('entry'):
-                lrg_id = child.get('id')
-                logging.info('Found LRG ID for {}: {}'.format(input_text, lrg_id))
-
-
-        # try to query by other references
-        except AssertionError:
-            name_query_url = 'https://www.ebi.ac.uk/ebisearch/ws/rest/lrg?query={}'.format(input_text)
-            name_query_response = requests.get(name_query_url)
-                
-            if name_query_response.status_code != 200:
-                logging.error('Could not query the API, check your connection and try again.')
-            assert name_query_response.status_code == 200, 'Could not query the API, check your connection and try again.'
-
-            # loop through the response xml
-            root = ET.fromstring(name_query_response.text)
-            for child in root.iter('hitCount'):
-                # check that there is exactly 1 entry returned
-                if child.text == '1':
-                    pass
-                elif child.text == '0':
-                    logging.error('There were no hits for {}, check the input'.format(input_text))
-                else:
-                    logging.error('Expected one hit but there were multiple, check the input')
-                assert child.text == '1'
-            # if so, extract the lrg id and save as a variable
-            for child in root.iter('entry'):
-                lrg_id = child.get('id')
-                logging.info('Found LRG ID for {}: {}'.format(input_text, lrg_id))
+        logger.info('Querying webservices to get LRG ID and check that it is valid')
+
+        # try to query by HGNC name, then by other references if that doesn't give exactly one hit
+        lrg_id = searchLrgId('name:' + input_text, input_text)
+        if lrg_id is None:
+            lrg_id = searchLrgId(input_text, input_text)
 
         # throw error if both queries fail
-        except:
-            logging.error('Cannot find the LRG file from the given input.')
-            raise ValueError('Cannot find the LRG file from the given input.')
+        if lrg_id is None:
+            logger.error('Cannot find the LRG file from the given input.')
+            raise LrgNotFoundError('Cannot find the LRG file from the given input.')
 
     return(lrg_id)
 
@@ -93,29 +236,34 @@ def checkLrgExists(lrg_id):
       Must be in the format LRG_<number>
 
     Output -
-    Boolean. If the function runs without hitting an assertion error, 
+    Boolean. If the function runs without throwing an LrgNotFoundError, 
     the function will return as true, since the LRG ID can be found 
     through the API and therefore it exists.
     '''
-    logging.info('Checking that LRG ID is valid...')
+    logger.info('Checking that LRG ID is valid...')
+
+    # LRGs in the local identifier index are known to exist
+    if LRG_ID_INDEX.get(lrg_id.upper()) == lrg_id:
+        logger.info('LRG ID is valid, found in the identifier index')
+        return True
 
     # query api, returns xml that says whether lrg exists or not
-    lrg_query_url = 'https://www.ebi.ac.uk/ebisearch/ws/rest/lrg?query={}'.format(lrg_id)
-    lrg_query_response = requests.get(lrg_query_url)
+    lrg_query_url = '{}?query={}'.format(EBI_SEARCH_URL, lrg_id)
+    lrg_query_response = webGet(lrg_query_url)
 
     if lrg_query_response.status_code != 200:
-        logging.error('Could not query the API, check your connection and try again.')
-    assert lrg_query_response.status_code == 200, 'Could not query the API, check your connection and try again.'
+        logger.error('Could not query the API, check your connection and try again.')
+        raise WebServiceError('Could not query the API, check your connection and try again.')
 
-    # parse the section that says if lrg exists or not, throw assertion error if it doesn't
-    root = ET.fromstring(lrg_query_response.text)
+    # parse the section that says if lrg exists or not, throw an error if it doesn't
+    root = getXmlBackend().fromstring(lrg_query_response.text)
     for child in root.iter('hitCount'):
         if child.text != '1':
-            logging.error('LRG does not exist')
-        assert child.text == '1', 'LRG does not exist'
-    
-    # if no assertion error is thrown, return true
-    logging.info('LRG ID is valid')
+            logger.error('LRG does not exist')
+            raise LrgNotFoundError('LRG does not exist')
+
+    # if no error is thrown, return true
+    logger.info('LRG ID is valid')
     return True
 
 
@@ -128,28 +276,139 @@ def checkCurrentLrgStatus(lrg_id):
     The end user should always download their XMLs very shortly before use
     '''
     #get data from webservice
-    url_p1 = "https://www.ebi.ac.uk/ebisearch/ws/rest/lrg/entry/"
+    url_p1 = EBI_SEARCH_URL + "/entry/"
     url_p3 = "?fields=status&format=json"
     url_full = url_p1 + str(lrg_id) + url_p3
-    logging.info("Checking status with webservice: " + str(url_full))
-    data_return = requests.get(url_full)
+    logger.info("Checking status with webservice: %s", url_full)
+    data_return = webGet(url_full, 'status')
     parsed_data_return = data_return.json()
 
     # parse the returned data, return status and log message
     lrg_status_return = parsed_data_return['entries'][0]['fields']['status'][0]
+    lrg_status_message = getLrgStatusMessage(lrg_status_return)
+
+    logger.info("LRG status is: %s", lrg_status_return)
+    logger.info('%s', lrg_status_message)
+    return lrg_status_return, lrg_status_message
+
+
+def getLrgStatusMessage(lrg_status_return):
+    '''
+    Make the BED header/log message for an LRG status, the status must be public or pending
+    '''
     if lrg_status_return == "public":
         lrg_status_message = "The LRG is currently marked 'public' on the LRG website: note that the user-provided file could have been downloaded before the LRG going public"
     else:
         if lrg_status_return == "pending":
             lrg_status_message = "The LRG is currently marked 'pending' on the LRG website: the fixed annotation is not yet finalised, so it should be interpreted with caution"
-    assert (lrg_status_return == "public") or (lrg_status_return == "pending"), "The LRG status could not be resolved as public or private"
     if (lrg_status_return != "public") and (lrg_status_return != "pending"):
-        logging.error("The LRG status could not be resolved as public or pending")
-        lrg_status_message = "ERROR: The LRG status could not be resolved with the webservice as public or pending"
+        logger.error("The LRG status could not be resolved as public or pending")
+        raise LrgStatusError("The LRG status could not be resolved as public or pending")
+    return lrg_status_message
 
-    logging.info("LRG status is: " + lrg_status_return)
-    logging.info(lrg_status_message)
-    return lrg_status_return, lrg_status_message
+
+def getLrgStatus(lrg_id):
+    '''
+    Get the status and status message of an LRG, only querying the
+    webservice if it hasn't already been looked up (or loaded from a
+    status snapshot) in this run
+    '''
+    if lrg_id in LRG_STATUSES:
+        logger.info("Using status already found for %s: %s", lrg_id, LRG_STATUSES[lrg_id][0])
+    else:
+        LRG_STATUSES[lrg_id] = checkCurrentLrgStatus(lrg_id)
+    return LRG_STATUSES[lrg_id]
+
+
+def checkLrgStatuses(lrg_ids):
+    '''
+    Check the CURRENT status of many LRGs at once, querying the webservice
+    for up to STATUS_QUERY_SIZE LRGs in each request.
+
+    Input -
+    lrg_ids: List of LRG IDs, in the format LRG_<number>
+
+    Output -
+    statuses: Dict of LRG ID to (status, status message), for each LRG that was found.
+      The statuses are also kept for the rest of the run, see getLrgStatus.
+    '''
+    statuses = {}
+    lrg_ids = sorted(set(lrg_ids))
+    for first in range(0, len(lrg_ids), STATUS_QUERY_SIZE):
+        url_full = EBI_SEARCH_URL + "/entry/" + ",".join(lrg_ids[first:first + STATUS_QUERY_SIZE]) + "?fields=status&format=json"
+        logger.info("Checking statuses with webservice: %s", url_full)
+        data_return = webGet(url_full, 'status')
+        if data_return.status_code != 200:
+            logger.error('Could not query the API, check your connection and try again.')
+            raise WebServiceError('Could not query the API, check your connection and try again.')
+
+        for entry in data_return.json()['entries']:
+            lrg_status_return = entry['fields']['status'][0]
+            statuses[entry['id']] = (lrg_status_return, getLrgStatusMessage(lrg_status_return))
+
+    for lrg_id in lrg_ids:
+        if lrg_id not in statuses:
+            logger.error("Could not find the status of %s", lrg_id)
+    logger.info("Found the status of %s out of %s LRGs", len(statuses), len(lrg_ids))
+    LRG_STATUSES.update(statuses)
+    return statuses
+
+
+def loadStatusSnapshot(snapshot_path):
+    '''
+    Load LRG statuses from a snapshot file made by writeStatusSnapshot, so
+    that they don't need to be looked up on the web in this run.
+    The snapshot is a tab separated file of LRG ID and status, lines starting
+    with '#' are ignored.
+    '''
+    statuses = {}
+    with open(snapshot_path) as snapshot:
+        for line in snapshot:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            lrg_id, lrg_status_return = line.split('\t')
+            statuses[lrg_id] = (lrg_status_return, getLrgStatusMessage(lrg_status_return))
+    logger.info("Loaded the status of %s LRGs from %s", len(statuses), snapshot_path)
+    LRG_STATUSES.update(statuses)
+    return statuses
+
+
+def loadIdIndex(id_index_path):
+    '''
+    Load an identifier index made by comfy_BED_ids.py, so that identifiers in
+    it are resolved to LRG IDs without searching the web in this run.
+    The index is a tab separated file of identifier and LRG ID, identifiers
+    that match more than one LRG have a line for each.
+    '''
+    id_index = {}
+    with open(id_index_path) as id_index_file:
+        for line in id_index_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, lrg_id = line.split('\t')
+            if key in id_index and id_index[key] != lrg_id:
+                id_index[key] = None
+            else:
+                id_index[key] = lrg_id
+    logger.info("Loaded %s identifiers from %s", len(id_index), id_index_path)
+    LRG_ID_INDEX.update(id_index)
+    return id_index
+
+
+def writeStatusSnapshot(snapshot_path, lrg_ids, now):
+    '''
+    Look up the statuses of many LRGs with checkLrgStatuses and save them to
+    a snapshot file, for loadStatusSnapshot
+    '''
+    statuses = checkLrgStatuses(lrg_ids)
+    with open(snapshot_path, 'w') as snapshot:
+        snapshot.write('#LRG statuses fetched at: ' + now.strftime("%Y-%m-%d %H:%M") + '\n')
+        for lrg_id in sorted(statuses):
+            snapshot.write('{}\t{}\n'.format(lrg_id, statuses[lrg_id][0]))
+    logger.info("Wrote the status of %s LRGs to %s", len(statuses), snapshot_path)
+    return statuses
 
 
 def getLrgXml(lrg_id, lrg_status):
@@ -166,23 +425,37 @@ def getLrgXml(lrg_id, lrg_status):
     '''
     # get api, address is different depending on whether lrg is public or pending
     if lrg_status == 'public':
-        xml_url = 'http://ftp.ebi.ac.uk/pub/databases/lrgex/{}.xml'.format(lrg_id)
+        xml_url = '{}/{}.xml'.format(LRG_XML_URL, lrg_id)
     if lrg_status == 'pending':
-        xml_url = 'http://ftp.ebi.ac.uk/pub/databases/lrgex/pending/{}.xml'.format(lrg_id)
-    logging.info('Pulling {} xml file from webservices {}'.format(lrg_id, xml_url))
+        xml_url = '{}/pending/{}.xml'.format(LRG_XML_URL, lrg_id)
+    logger.info('Pulling %s xml file from webservices %s', lrg_id, xml_url)
 
-    xml_response = requests.get(xml_url)
+    xml_response = webGet(xml_url, 'xml')
     if xml_response.status_code != 200:
-        logging.error('Could not query the API, check your connection and try again.')
-    assert xml_response.status_code == 200, 'Could not query the API, check your connection and try again.'
+        logger.error('Could not query the API, check your connection and try again.')
+        raise WebServiceError('Could not query the API, check your connection and try again.')
 
     # return response as string
     lrg_xml = xml_response.text
-    logging.info('Retrieved {} xml successfully'.format(lrg_id))
+    logger.info('Retrieved %s xml successfully', lrg_id)
     
     return(lrg_xml)
 
 
+def getLrgListing():
+    '''
+    Get the public listing of LRGs and their gene and transcript identifiers,
+    as a string of the tab separated file
+    '''
+    listing_url = '{}/{}'.format(LRG_XML_URL, LRG_LISTING_FILE)
+    logger.info('Pulling LRG listing from webservices %s', listing_url)
+    listing_response = webGet(listing_url, 'xml')
+    if listing_response.status_code != 200:
+        logger.error('Could not query the API, check your connection and try again.')
+        raise WebServiceError('Could not query the API, check your connection and try again.')
+    return listing_response.text
+
+
 def getLrgFromWeb(input_text):
     '''
     Main web API script, calls the functions above to:
@@ -192,8 +465,92 @@ def getLrgFromWeb(input_text):
     - get xml file from the api
     '''
     lrg_id = getLrgId(input_text)
-    assert checkLrgExists(lrg_id)
-    lrg_status = checkCurrentLrgStatus(lrg_id)[0]
+    checkLrgExists(lrg_id)
+    lrg_status = getLrgStatus(lrg_id)[0]
     lrg_xml = getLrgXml(lrg_id, lrg_status)
 
     return(lrg_xml)
+
+
+def getLrgFromWebSafely(input_text):
+    '''
+    Run getLrgFromWeb, catching any error so that one bad identifier
+    doesn't stop the others. Returns a tuple of the input, True/False
+    for success, and either the xml string or the error message.
+    '''
+    try:
+        return (input_text, True, getLrgFromWeb(input_text))
+    except Exception as error:
+        logger.error('Could not get %s from the web: %r', input_text, error)
+        return (input_text, False, repr(error))
+
+
+def getLrgsFromWeb(input_texts, max_in_flight=8):
+    '''
+    Get the XML for many LRGs at the same time, using a pool of threads
+    that share the session's connection pool
+
+    Input -
+    input_texts: List of strings. LRG IDs, HGNC symbols or transcript names.
+    max_in_flight: Int. Maximum number of LRGs being fetched at once.
+
+    Output -
+    results: List of (input_text, success, xml string or error) tuples, in
+      the same order as input_texts.
+    '''
+    from multiprocessing.pool import ThreadPool
+    getSession()
+    pool = ThreadPool(max(1, min(max_in_flight, len(input_texts))))
+    try:
+        results = pool.map(getLrgFromWebSafely, input_texts, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+# load arguments
+def getArgs():
+    """
+    Use argparse package to take arguments from the command line.
+    See descriptions for full detail of each argument.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=textwrap.dedent(
+        '''
+        summary:
+        Looks up the current status of many LRGs and saves them to a status snapshot
+        file, which can be given to comfy_BED.py with -s to run without status checks.
+
+        examples:
+        python comfy_BED_web.py -o lrg_statuses.tsv LRG_1 LRG_5 LRG_9
+          Saves the statuses of LRG_1, LRG_5 and LRG_9 to lrg_statuses.tsv
+        '''
+    ))
+
+    # output snapshot file
+    parser.add_argument(
+        '-o', '--status_file', action='store', required=True,
+        help='The filepath to write the status snapshot to'
+    )
+
+    # lrg ids
+    parser.add_argument(
+        'lrg_ids', nargs='+',
+        help='LRG IDs to look up, in the format LRG_<number>'
+    )
+    from comfy_BED import addLogArgs
+    addLogArgs(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    now = datetime.datetime.now()
+    from comfy_BED import setUpLogs
+    setUpLogs(args, now)
+    writeStatusSnapshot(args.status_file, args.lrg_ids, now)
+
+if __name__ == '__main__':
+    main()
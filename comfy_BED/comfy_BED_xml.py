@@ -0,0 +1,273 @@
+import os
+import logging
+import contextlib
+import xml.etree.ElementTree as ET
+
+import six
+
+from comfy_BED_errors import InvalidInputError, InvalidXmlError
+
+logger = logging.getLogger('comfy_BED')
+
+# lxml is optional, the standard library ElementTree is used without it.
+# It is only imported (by getXmlBackend) the first time xml is parsed.
+XML_BACKENDS = ('auto', 'lxml', 'etree')
+XML_BACKEND_VARIABLE = 'COMFY_BED_XML_BACKEND'
+
+# the backend in use, set on first use or by setXmlBackend
+XML_BACKEND = None
+
+# where the parts of an LRG that comfy_BED reads are, relative to the root
+TRANSCRIPT_PATH = 'fixed_annotation/transcript'
+MAPPING_PATH = 'updatable_annotation/annotation_set/mapping'
+
+
+@contextlib.contextmanager
+def xmlParseErrors():
+    '''
+    Raise the parse errors of either backend (ElementTree's ParseError and
+    lxml's XMLSyntaxError, which are both SyntaxErrors) as an InvalidXmlError
+    '''
+    try:
+        yield
+    except SyntaxError as error:
+        logger.error('The input is not well formed xml: %s', error)
+        raise InvalidXmlError('The input is not well formed xml: {}'.format(error))
+
+
+class EtreeBackend(object):
+    '''
+    Parses and searches LRG xml with the standard library ElementTree
+    '''
+    name = 'etree'
+
+    # backends that build the LRG tree themselves have a makeLrgParser method,
+    # otherwise LRGs are parsed with an LrgTreeTarget through makeTargetParser
+    builds_lrg_tree = False
+
+    def makeTargetParser(self, target):
+        '''
+        A parser that passes the xml fed to it to a parser target, e.g. an LrgTreeTarget
+        '''
+        return TargetParser(ET.XMLParser(target=target), target)
+
+    def fromstring(self, text):
+        '''
+        Parse an xml document held in a string, e.g. a web service response
+        '''
+        if isinstance(text, six.text_type):
+            text = text.encode('utf-8')
+        with xmlParseErrors():
+            return ET.fromstring(text)
+
+    def transcripts(self, root):
+        '''
+        The named fixed annotation <transcript> elements of an LRG, in order
+        '''
+        return [transcript for transcript in root.findall(TRANSCRIPT_PATH) if transcript.get('name') is not None]
+
+    def exons(self, transcript):
+        return transcript.findall('exon')
+
+    def coordinates(self, element, coord_system):
+        '''
+        The <coordinates> children of an element in a coordinate system, e.g. the LRG's own
+        '''
+        return [coordinate for coordinate in element.findall('coordinates')
+                if coordinate.get('coord_system') == coord_system]
+
+    def codingCoordinates(self, transcript, coord_system):
+        '''
+        The <coordinates> of the coding regions of a transcript in a coordinate system
+        '''
+        return [coordinate for coordinate in transcript.findall('coding_region/coordinates')
+                if coordinate.get('coord_system') == coord_system]
+
+    def mappings(self, root, coord_system_prefix=''):
+        '''
+        The <mapping> elements of every annotation set of an LRG whose coord
+        system starts with coord_system_prefix (e.g. 'GRCh37'), in order
+        '''
+        return [mapping for mapping in root.findall(MAPPING_PATH)
+                if str(mapping.get('coord_system')).startswith(coord_system_prefix)]
+
+
+class LxmlBackend(EtreeBackend):
+    '''
+    Parses LRG xml with lxml, building the tree in C, and searches it with
+    precompiled XPath expressions. Parsing with a target (which calls back
+    into Python for every element either way) is left to ElementTree, and
+    trees built by ElementTree (e.g. by the annotation index, or an
+    LrgTreeTarget) are searched as EtreeBackend does.
+    '''
+    name = 'lxml'
+    builds_lrg_tree = True
+
+    def __init__(self, etree):
+        self.etree = etree
+        self.transcript_xpath = etree.XPath(TRANSCRIPT_PATH + '[@name]')
+        self.exon_xpath = etree.XPath('exon')
+        self.coordinates_xpath = etree.XPath('coordinates[@coord_system = $coord_system]')
+        self.coding_coordinates_xpath = etree.XPath('coding_region/coordinates[@coord_system = $coord_system]')
+        self.mapping_xpath = etree.XPath(MAPPING_PATH + '[starts-with(@coord_system, $prefix)]')
+        self.all_mappings_xpath = etree.XPath(MAPPING_PATH)
+
+    def makeLrgParser(self, keep_paths):
+        return LxmlLrgParser(self.etree, self.parserOptions(), keep_paths)
+
+    def parserOptions(self):
+        # sequences can be longer than lxml's default limit on text, and entities are never needed
+        return {'huge_tree': True, 'resolve_entities': False, 'remove_comments': True, 'remove_pis': True}
+
+    def fromstring(self, text):
+        if isinstance(text, six.text_type):
+            text = text.encode('utf-8')
+        with xmlParseErrors():
+            return self.etree.fromstring(text, self.etree.XMLParser(**self.parserOptions()))
+
+    def transcripts(self, root):
+        if not self.etree.iselement(root):
+            return EtreeBackend.transcripts(self, root)
+        return self.transcript_xpath(root)
+
+    def exons(self, transcript):
+        if not self.etree.iselement(transcript):
+            return EtreeBackend.exons(self, transcript)
+        return self.exon_xpath(transcript)
+
+    def coordinates(self, element, coord_system):
+        if not self.etree.iselement(element):
+            return EtreeBackend.coordinates(self, element, coord_system)
+        return self.coordinates_xpath(element, coord_system=coord_system)
+
+    def codingCoordinates(self, transcript, coord_system):
+        if not self.etree.iselement(transcript):
+            return EtreeBackend.codingCoordinates(self, transcript, coord_system)
+        return self.coding_coordinates_xpath(transcript, coord_system=coord_system)
+
+    def mappings(self, root, coord_system_prefix=''):
+        if not self.etree.iselement(root):
+            return EtreeBackend.mappings(self, root, coord_system_prefix)
+        if not coord_system_prefix:
+            return self.all_mappings_xpath(root)
+        return self.mapping_xpath(root, prefix=coord_system_prefix)
+
+
+class TargetParser(object):
+    '''
+    Feeds xml to a parser with a target, stopping when the target is done
+    '''
+    def __init__(self, parser, target):
+        self.parser = parser
+        self.target = target
+
+    @property
+    def done(self):
+        return self.target.done
+
+    def feed(self, data):
+        with xmlParseErrors():
+            self.parser.feed(data)
+
+    def close(self):
+        if self.target.done:
+            return self.target.close()
+        with xmlParseErrors():
+            return self.parser.close()
+
+
+class LxmlLrgParser(object):
+    '''
+    Builds the tree of an LRG with lxml as xml is fed to it, until the 'lrg'
+    annotation set (which holds the genome mappings) has been read. Each
+    element that isn't in keep_paths (as used by LrgTreeTarget) is removed
+    from the tree as soon as it ends, so the tree never holds more than the
+    one sequence being parsed. Anything parsed after the 'lrg' annotation set
+    is removed too, so the tree is the same as one built by LrgTreeTarget
+    apart from whitespace text.
+    '''
+    def __init__(self, etree, parser_options, keep_paths):
+        self.parser = etree.XMLPullParser(events=('start', 'end'), **parser_options)
+        self.keep_paths = keep_paths
+        # tags of the open elements below the root, and how many of them are in an unwanted subtree
+        self.path = []
+        self.skip_depth = 0
+        self.root = None
+        self.done = False
+
+    def feed(self, data):
+        with xmlParseErrors():
+            self.parser.feed(data)
+            self.readEvents()
+
+    def readEvents(self):
+        for event, element in self.parser.read_events():
+            if self.root is None:
+                self.root = element
+                continue
+            if event == 'start':
+                if self.skip_depth or tuple(self.path) + (element.tag,) not in self.keep_paths:
+                    self.skip_depth += 1
+                self.path.append(element.tag)
+                continue
+
+            if element is self.root:
+                continue
+            self.path.pop()
+            if self.skip_depth:
+                self.skip_depth -= 1
+                if not self.skip_depth:
+                    # the top of an unwanted subtree, whose parent is kept
+                    element.getparent().remove(element)
+            elif element.tag == 'annotation_set' and element.get('type') == 'lrg':
+                for sibling in list(element.itersiblings()):
+                    element.getparent().remove(sibling)
+                self.done = True
+                break
+
+    def close(self):
+        if not self.done:
+            with xmlParseErrors():
+                self.parser.close()
+                self.readEvents()
+        return self.root
+
+
+def makeXmlBackend(name):
+    '''
+    Make the named backend. 'auto' is lxml if it is installed, otherwise etree.
+    '''
+    if name not in XML_BACKENDS:
+        logger.error('The xml backend must be one of: %s', ', '.join(XML_BACKENDS))
+        raise InvalidInputError('Unknown xml backend: ' + str(name))
+    if name in ('auto', 'lxml'):
+        try:
+            from lxml import etree
+        except ImportError:
+            if name == 'lxml':
+                logger.error('The lxml xml backend needs lxml to be installed')
+                raise InvalidInputError('lxml is not installed')
+        else:
+            return LxmlBackend(etree)
+    return EtreeBackend()
+
+
+def setXmlBackend(name):
+    '''
+    Choose the backend used to parse and search xml, see makeXmlBackend. Returns the backend.
+    '''
+    global XML_BACKEND
+    XML_BACKEND = makeXmlBackend(name)
+    logger.debug('Using the %s xml backend', XML_BACKEND.name)
+    return XML_BACKEND
+
+
+def getXmlBackend():
+    '''
+    The backend used to parse and search xml. Unless setXmlBackend has been
+    called, this is chosen by the COMFY_BED_XML_BACKEND environment variable,
+    or 'auto' if it isn't set.
+    '''
+    if XML_BACKEND is None:
+        return setXmlBackend(os.environ.get(XML_BACKEND_VARIABLE, 'auto'))
+    return XML_BACKEND
@@ -0,0 +1,144 @@
+import pytest
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+
+
+class LrgWebHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Answers GET requests from the canned responses of the server,
+    keeping connections alive so that connection reuse can be checked.
+    Conditional requests with a matching ETag or Last-Modified get a 304,
+    and Range requests (bytes=<start>-) get a 206 if their If-Range matches.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.client_address[1]))
+            if self.headers.get('Range'):
+                server.range_requests.append((self.path, self.headers.get('Range')))
+            failures = server.failures.get(self.path, 0)
+            if failures:
+                server.failures[self.path] = failures - 1
+        if failures:
+            code, body, headers = 503, 'Service unavailable', {}
+        else:
+            code, body, headers = server.responses.get(self.path, (404, 'Not found', {}))
+        if callable(body):
+            body = body(self)
+        if 'ETag' in headers and self.headers.get('If-None-Match') == headers['ETag']:
+            code, body = 304, ''
+        if 'Last-Modified' in headers and self.headers.get('If-Modified-Since') == headers['Last-Modified']:
+            code, body = 304, ''
+        body = body.encode('utf-8') if not isinstance(body, bytes) else body
+        byte_range = self.headers.get('Range', '')
+        if code == 200 and byte_range.startswith('bytes=') and byte_range.endswith('-') and (
+                self.headers.get('If-Range') in (None, headers.get('ETag'), headers.get('Last-Modified'))):
+            start = int(byte_range[len('bytes='):-1])
+            headers = dict(headers, **{'Content-Range': 'bytes {}-{}/{}'.format(start, len(body) - 1, len(body))})
+            code, body = 206, body[start:]
+        self.send_response(code)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LrgWebServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Local stand-in for the EBI search and LRG ftp web services
+    responses: dict of request path to (status code, body, headers)
+    failures: dict of request path to the number of times to return a 503 first
+    requests: list of (request path, client port) for every request received
+    range_requests: list of (request path, Range header) for every Range request received
+    '''
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), LrgWebHandler)
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.failures = {}
+        self.requests = []
+        self.range_requests = []
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def searchResponse(self, query, lrg_ids):
+        '''
+        Add an EBI search response for a query, hitting the given LRG IDs
+        '''
+        entries = ''.join('<entry id="{}" source="lrg"/>'.format(lrg_id) for lrg_id in lrg_ids)
+        body = '<?xml version="1.0" encoding="UTF-8"?><result><hitCount>{}</hitCount><entries>{}</entries></result>'.format(
+            len(lrg_ids), entries)
+        self.responses['/ebisearch/ws/rest/lrg?query={}'.format(query)] = (200, body, {})
+
+    def statusResponse(self, lrg_id, status):
+        '''
+        Add an EBI search response for the status of an LRG
+        '''
+        body = '{{"entries": [{{"id": "{}", "source": "lrg", "fields": {{"status": ["{}"]}}}}]}}'.format(lrg_id, status)
+        self.responses['/ebisearch/ws/rest/lrg/entry/{}?fields=status&format=json'.format(lrg_id)] = (
+            200, body, {'Content-Type': 'application/json'})
+
+    def bulkStatusResponse(self, lrg_statuses):
+        '''
+        Add an EBI search response for the statuses of a list of (LRG ID, status)
+        '''
+        entries = ', '.join('{{"id": "{}", "source": "lrg", "fields": {{"status": ["{}"]}}}}'.format(lrg_id, status)
+                            for lrg_id, status in lrg_statuses)
+        lrg_ids = ','.join(lrg_id for lrg_id, status in lrg_statuses)
+        self.responses['/ebisearch/ws/rest/lrg/entry/{}?fields=status&format=json'.format(lrg_ids)] = (
+            200, '{{"entries": [{}]}}'.format(entries), {'Content-Type': 'application/json'})
+
+    def xmlResponse(self, lrg_id, xml_path, status='public', headers=None):
+        '''
+        Add an LRG ftp response, serving a local xml file
+        '''
+        with open(xml_path, 'rb') as xml_file:
+            body = xml_file.read()
+        folder = '/pending' if status == 'pending' else ''
+        self.responses['/pub/databases/lrgex{}/{}.xml'.format(folder, lrg_id)] = (200, body, headers or {})
+
+    def folderListing(self, lrg_dates, status='public'):
+        '''
+        Add an LRG ftp directory listing, like the server's html index, of a list of (LRG ID, modified date)
+        '''
+        rows = ''.join('<tr><td><a href="{0}.xml">{0}.xml</a></td><td align="right">{1}  </td></tr>\n'.format(
+            lrg_id, modified) for lrg_id, modified in lrg_dates)
+        body = '<html><body><table><tr><td><a href="pending/">pending/</a></td></tr>\n{}</table></body></html>'.format(rows)
+        folder = '/pending' if status == 'pending' else ''
+        self.responses['/pub/databases/lrgex{}/'.format(folder)] = (200, body, {})
+
+
+@pytest.fixture
+def lrg_web_server(monkeypatch):
+    '''
+    Start a local stand-in for the LRG web services, and point comfy_BED_web at it
+    '''
+    from comfy_BED import comfy_BED_web
+
+    server = LrgWebServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+
+    monkeypatch.setattr(comfy_BED_web, 'EBI_SEARCH_URL', server.url + '/ebisearch/ws/rest/lrg')
+    monkeypatch.setattr(comfy_BED_web, 'LRG_XML_URL', server.url + '/pub/databases/lrgex')
+    monkeypatch.setattr(comfy_BED_web, 'WEB_BACKOFF_FACTOR', 0.01)
+    monkeypatch.setattr(comfy_BED_web, 'SESSION', None)
+    monkeypatch.setattr(comfy_BED_web, 'CACHE', None)
+    comfy_BED_web.LRG_STATUSES.clear()
+    comfy_BED_web.LRG_ID_INDEX.clear()
+    yield server
+
+    comfy_BED_web.LRG_STATUSES.clear()
+    comfy_BED_web.LRG_ID_INDEX.clear()
+
+    server.shutdown()
+    server.server_close()
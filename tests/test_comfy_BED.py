@@ -2,7 +2,7 @@ import pytest
 import os
 import xml.etree.ElementTree as ET
 
-from comfy_BED.comfy_BED.comfy_BED  import calculateGenomicPositions, checkValidTranscripts, getLrgExons, getGenomeMapping
+from comfy_BED.comfy_BED.comfy_BED  import calculateGenomicPositions, checkValidTranscripts, getLrgExons, getGenomeMapping, loadLrgXml
 
 '''
 def test_get_args(self):
@@ -207,3 +207,38 @@ def test_calculateGenomicPositions():
     with pytest.raises(ValueError):
         calculateGenomicPositions(dict_LRG_293_t1, 'chr13', 32884617, 32975809, '2')
 
+
+def test_loadLrgXml():
+    '''
+    Test that the streamed, pruned LRG gives the same results as a full ElementTree
+    parse, and that the sequences are not kept.
+    '''
+    for lrg_name in ['LRG_1', 'LRG_5', 'LRG_9', 'LRG_293']:
+        # Setup - parse each test file both ways
+        lrg_path = os.path.abspath("tests/test_data/{}.xml".format(lrg_name))
+        full_root = ET.parse(lrg_path).getroot()
+        root = loadLrgXml(lrg_path)
+
+        # LRG ID and transcripts are unchanged
+        assert root.tag == 'lrg'
+        assert root.find('fixed_annotation/id').text == lrg_name
+        full_transcripts = [str(t.get('name')) for t in full_root.iter('transcript') if t.get('name')]
+        assert [str(t.get('name')) for t in root.iter('transcript')] == full_transcripts
+        assert checkValidTranscripts(["t1"], root) == (None)
+        with pytest.raises(ValueError):
+            checkValidTranscripts(["errortime"], root)
+
+        # exons and mappings are unchanged
+        full_exons = [getLrgExons(t, lrg_name) for t in full_root.iter('transcript') if t.get('name')]
+        assert [getLrgExons(t, lrg_name) for t in root.iter('transcript')] == full_exons
+        for genome_build in ['GRCh37', 'GRCh38']:
+            assert getGenomeMapping(root, genome_build) == getGenomeMapping(full_root, genome_build)
+
+        # sequences are never built
+        assert len(list(root.iter('sequence'))) == 0
+
+    # the parser also takes file objects, and a missing mapping still throws an error
+    with open("tests/test_data/LRG_293_mapping_removed.xml", 'rb') as lrg_file:
+        root_mapping_removed = loadLrgXml(lrg_file)
+    with pytest.raises(UnboundLocalError):
+        getGenomeMapping(root_mapping_removed, 'GRCh37')
@@ -0,0 +1,67 @@
+import pytest
+import os
+import io
+import logging
+import xml.etree.ElementTree as ET
+
+from comfy_BED import comfy_BED_web
+from comfy_BED.comfy_BED import convert, ExonRecord
+from comfy_BED.comfy_BED_errors import (ComfyBedError, InvalidInputError, InvalidTranscriptError,
+                                        NoGenomeMappingError)
+
+
+@pytest.fixture
+def no_web(monkeypatch):
+    # fail any test that goes to the web
+    def webGet(url, kind='search'):
+        raise AssertionError('Tried to query the web: ' + url)
+    monkeypatch.setattr(comfy_BED_web, 'webGet', webGet)
+
+
+def test_convert(no_web, tmpdir, monkeypatch):
+    xml_path = os.path.abspath('tests/test_data/LRG_5.xml')
+    monkeypatch.chdir(tmpdir)
+    root_handlers = list(logging.getLogger().handlers)
+
+    # a filepath, xml bytes, a file object and a parsed root all give the same records
+    records = convert(xml_path, 't1', 'GRCh37')
+    with open(xml_path, 'rb') as lrg_file:
+        xml_bytes = lrg_file.read()
+    assert convert(xml_bytes, ['t1'], 'GRCh37') == records
+    assert convert(io.BytesIO(xml_bytes), 't1', 'GRCh37') == records
+    assert convert(ET.parse(xml_path).getroot(), 't1', 'GRCh37') == records
+
+    assert all(isinstance(record, ExonRecord) for record in records)
+    assert records[0].lrg_id == 'LRG_5' and records[0].transcript == 't1'
+    assert records[0].chrom == 'chr1' and records[0].start <= records[0].end
+    assert sorted(record.exon for record in records) == sorted(
+        'exon_{}'.format(exon.get('label')) for exon in ET.parse(xml_path).getroot().find(
+            'fixed_annotation/transcript').iter('exon'))
+
+    # nothing is written and logging isn't set up
+    assert tmpdir.listdir() == []
+    assert logging.getLogger().handlers == root_handlers
+
+
+def test_convertErrors(no_web):
+    # each kind of failure has its own exception type
+    with pytest.raises(InvalidInputError):
+        convert('tests/test_data/LRG_0.xml', 't1')
+    with pytest.raises(InvalidInputError):
+        convert('LRG_5', 't1')
+    with pytest.raises(InvalidInputError):
+        convert(b'<not_an_lrg/>', 't1')
+    with pytest.raises(InvalidInputError):
+        convert(5, 't1')
+    with pytest.raises(InvalidTranscriptError):
+        convert('tests/test_data/LRG_5.xml', 't1,t9')
+    with pytest.raises(NoGenomeMappingError):
+        convert('tests/test_data/LRG_293_mapping_removed.xml', 't1', 'GRCh38')
+
+    # and they can all be caught together, or as the ValueError they used to be
+    with pytest.raises(ComfyBedError):
+        convert('tests/test_data/LRG_5.xml', ['t9'])
+    with pytest.raises(ValueError):
+        convert(b'<not_an_lrg/>', 't1')
+    with pytest.raises(ValueError):
+        convert('tests/test_data/LRG_5.xml', ['t9'])
@@ -0,0 +1,90 @@
+import pytest
+import os
+import shutil
+import datetime
+
+from comfy_BED import comfy_BED_web
+from comfy_BED.comfy_BED_web import loadStatusSnapshot
+from comfy_BED.comfy_BED_batch import readManifest, globBatchItems, runBatch, summariseBatch, prefetchLrgStatuses
+
+
+def test_readManifest(tmpdir):
+    # Setup - manifest with a comment, a local file, a web ID without a build and a blank line
+    manifest = tmpdir.join('manifest.tsv')
+    manifest.write('#lrg\ttranscripts\tbuild\ntests/test_data/LRG_5.xml\tt1,t2\tGRCh38\nLRG_1\tt1\n\n')
+
+    assert readManifest(str(manifest)) == [
+        ('tests/test_data/LRG_5.xml', 't1,t2', 'GRCh38'), ('LRG_1', 't1', 'GRCh37')]
+    assert readManifest(str(manifest), 'GRCh38')[1] == ('LRG_1', 't1', 'GRCh38')
+
+    # Invalid lines should throw a value error
+    bad_manifest = tmpdir.join('bad_manifest.tsv')
+    bad_manifest.write('LRG_1\n')
+    with pytest.raises(ValueError):
+        readManifest(str(bad_manifest))
+    bad_manifest.write('LRG_1\tt1\tGRCh36\n')
+    with pytest.raises(ValueError):
+        readManifest(str(bad_manifest))
+    bad_manifest.write('LRG_1\tt1\tGRCh37,hg38\n')
+    with pytest.raises(ValueError):
+        readManifest(str(bad_manifest))
+
+    # builds are checked the same way as comfy_BED.py -g checks them
+    builds_manifest = tmpdir.join('builds_manifest.tsv')
+    builds_manifest.write('LRG_1\tt1\tGRCh38.p12\nLRG_1\tt1\tGRCh37,GRCh38\nLRG_1\tt1\tall\n')
+    assert [genome_build for lrg, transcripts, genome_build in readManifest(str(builds_manifest))] == [
+        'GRCh38.p12', 'GRCh37,GRCh38', 'all']
+
+
+def test_globBatchItems():
+    batch_items = globBatchItems('tests/test_data/LRG_[59].xml', 't1', 'GRCh37')
+    assert batch_items == [
+        ('tests/test_data/LRG_5.xml', 't1', 'GRCh37'), ('tests/test_data/LRG_9.xml', 't1', 'GRCh37')]
+
+
+def test_prefetchLrgStatuses(lrg_web_server, tmpdir):
+    # Setup - local files named by their LRG ID or not, and an LRG ID
+    shutil.copy('tests/test_data/LRG_9.xml', str(tmpdir.join('panel.xml')))
+    lrg_web_server.bulkStatusResponse([('LRG_1', 'public'), ('LRG_5', 'public'), ('LRG_9', 'pending')])
+    batch_items = [('tests/test_data/LRG_5.xml', 't1', 'GRCh37'), (str(tmpdir.join('panel.xml')), 't1', 'GRCh37'),
+                   ('LRG_1', 't1', 'GRCh37'), ('COL1A1', 't1', 'GRCh37')]
+
+    # every status is found with one query
+    prefetchLrgStatuses(batch_items)
+    assert len(lrg_web_server.requests) == 1
+    assert dict((lrg_id, status) for lrg_id, (status, message) in comfy_BED_web.LRG_STATUSES.items()) == {
+        'LRG_1': 'public', 'LRG_5': 'public', 'LRG_9': 'pending'}
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_runBatch(tmpdir, processes):
+    # Setup - load the statuses from a snapshot, so they aren't checked with the web API
+    status_file = tmpdir.join('statuses.tsv')
+    status_file.write('#LRG statuses\nLRG_5\tpublic\nLRG_9\tpending\nLRG_293\tpublic\n')
+    loadStatusSnapshot(str(status_file))
+    output_dir = tmpdir.mkdir('output')
+    now = datetime.datetime(2018, 12, 12, 9, 30)
+    batch_items = [
+        ('tests/test_data/LRG_5.xml', 't1,t2', 'GRCh37'),
+        ('tests/test_data/LRG_9.xml', 'errortime', 'GRCh37'),
+        ('tests/test_data/LRG_293.xml', 't1', 'GRCh38'),
+    ]
+
+    results = runBatch(batch_items, processes, str(output_dir), now)
+    comfy_BED_web.LRG_STATUSES.clear()
+
+    # results are in the same order as the batch, with failures caught
+    assert [result[0] for result in results] == batch_items
+    assert [result[1] for result in results] == [True, False, True]
+    assert results[0][2] == [os.path.join(str(output_dir), 'LRG_5_t1.bed'), os.path.join(str(output_dir), 'LRG_5_t2.bed')]
+    assert 'Invalid transcript name' in results[1][2]
+    assert sorted(os.listdir(str(output_dir))) == ['LRG_293_t1.bed', 'LRG_5_t1.bed', 'LRG_5_t2.bed']
+
+    # BED files match a single run of comfy_BED
+    with open(os.path.join(str(output_dir), 'LRG_5_t1.bed')) as bed_file:
+        bed_lines = bed_file.read().splitlines()
+    assert bed_lines[0] == '#BED file generated at: 2018-12-12 09:30'
+    assert bed_lines[1].startswith('#public: ')
+    assert 'chr1\t43232178\t43232755\texon_1' in bed_lines
+
+    assert summariseBatch(results) == 1
@@ -0,0 +1,35 @@
+import pytest
+
+from comfy_BED.comfy_BED_benchmark import getImportedModules, measureStartup, measureThroughput, findRegressions
+from comfy_BED.comfy_BED_synthetic import writeSyntheticLrgs
+
+
+def test_lazyImports():
+    # local runs don't load the web stack, csv, sqlite or NumPy until something uses them
+    assert getImportedModules('comfy_BED') == []
+    assert getImportedModules('comfy_BED_web') == []
+
+
+def test_measureStartup(tmpdir):
+    results = measureStartup('tests/test_data/LRG_5.xml', 't1', 'GRCh37', repeats=1)
+    assert sorted(results) == ['first_bed', 'first_bed_net', 'import', 'import_net', 'interpreter']
+    assert results['first_bed'] > results['interpreter'] > 0
+
+    # only net times that are slower than the baseline by more than the tolerance are regressions
+    baseline = dict(results, import_net=results['import_net'] / 2.0, first_bed_net=results['first_bed_net'] * 2.0)
+    assert [regression[0] for regression in findRegressions(results, baseline, 0.5)] == ['import_net']
+    assert findRegressions(results, results) == []
+
+
+def test_measureThroughput(tmpdir):
+    # Setup - two small synthetic LRGs
+    xml_paths = writeSyntheticLrgs(str(tmpdir), 2, transcripts=3, exons=20, spans=2)
+
+    results = measureThroughput(xml_paths, repeats=1)
+    assert sorted(results) == ['batch', 'convert_per_file', 'exons', 'files', 'parse_per_file', 'write_per_file']
+    assert results['files'] == 2 and results['exons'] > 2 * 2 * 3
+    assert all(results[name] > 0 for name in ('batch', 'convert_per_file', 'parse_per_file', 'write_per_file'))
+
+    # per-file stages are checked against a baseline, counts aren't
+    baseline = dict(results, parse_per_file=results['parse_per_file'] / 2.0, exons=results['exons'] / 2)
+    assert [regression[0] for regression in findRegressions(results, baseline)] == ['parse_per_file']
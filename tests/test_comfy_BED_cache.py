@@ -0,0 +1,97 @@
+import pytest
+import os
+import argparse
+
+from comfy_BED.comfy_BED_web import setCache, getLrgFromWeb, getLrgXml, checkCurrentLrgStatus
+from comfy_BED.comfy_BED_cache import LrgWebCache
+from comfy_BED.comfy_BED import setUpWeb
+from comfy_BED.comfy_BED_errors import InvalidInputError
+
+'''
+These tests run against a local stand-in for the LRG web services (see conftest.py)
+'''
+
+
+def setUpLrgResponses(server):
+    # Setup - LRG_5 is public, with an ETag on its xml
+    server.searchResponse('name:P3H1', ['LRG_5'])
+    server.searchResponse('LRG_5', ['LRG_5'])
+    server.statusResponse('LRG_5', 'public')
+    server.xmlResponse('LRG_5', 'tests/test_data/LRG_5.xml', headers={'ETag': '"LRG_5-v1"'})
+
+
+def requestedPaths(server):
+    return [path for path, port in server.requests]
+
+
+def test_freshResponsesAreCached(lrg_web_server, tmpdir):
+    setUpLrgResponses(lrg_web_server)
+    setCache(LrgWebCache(str(tmpdir)))
+
+    first_xml = getLrgFromWeb('P3H1')
+    assert len(lrg_web_server.requests) == 4
+
+    # the second run doesn't touch the network, even from a new cache object
+    setCache(LrgWebCache(str(tmpdir)))
+    assert getLrgFromWeb('P3H1') == first_xml
+    assert len(lrg_web_server.requests) == 4
+
+
+def test_staleResponsesAreRevalidated(lrg_web_server, tmpdir):
+    setUpLrgResponses(lrg_web_server)
+    cache = LrgWebCache(str(tmpdir), ttls={'xml': 0, 'status': 0})
+    setCache(cache)
+    xml_url = lrg_web_server.url + '/pub/databases/lrgex/LRG_5.xml'
+
+    first_xml = getLrgXml('LRG_5', 'public')
+    first_fetch = cache.get(xml_url).fetched_at
+
+    # the xml has an ETag, so the server answers 304 and the cached body is used
+    assert getLrgXml('LRG_5', 'public') == first_xml
+    assert cache.get(xml_url).fetched_at > first_fetch
+    assert requestedPaths(lrg_web_server).count('/pub/databases/lrgex/LRG_5.xml') == 2
+
+    # the status has no ETag, so it is downloaded again
+    checkCurrentLrgStatus('LRG_5')
+    checkCurrentLrgStatus('LRG_5')
+    assert requestedPaths(lrg_web_server).count('/ebisearch/ws/rest/lrg/entry/LRG_5?fields=status&format=json') == 2
+
+
+def test_cacheOnly(lrg_web_server, tmpdir):
+    setUpLrgResponses(lrg_web_server)
+    setCache(LrgWebCache(str(tmpdir)))
+    getLrgFromWeb('P3H1')
+
+    # stale entries are still used when offline, and nothing goes to the network
+    setCache(LrgWebCache(str(tmpdir), ttls={'search': 0, 'status': 0, 'xml': 0}, offline=True))
+    assert checkCurrentLrgStatus('LRG_5')[0] == 'public'
+    assert '<id>LRG_5</id>' in getLrgFromWeb('P3H1')
+    assert len(lrg_web_server.requests) == 4
+
+    # anything that isn't cached is an error
+    with pytest.raises(ValueError):
+        getLrgXml('LRG_9', 'pending')
+
+    # and the cache can't be offline without a cache directory
+    with pytest.raises(InvalidInputError):
+        setUpWeb(argparse.Namespace(cache_dir=None, cache_only=True, status_file=None, id_index=None))
+
+
+def test_lruEviction(tmpdir):
+    # Setup - room for two 100 byte bodies
+    cache = LrgWebCache(str(tmpdir), max_bytes=250)
+    cache.put('http://lrg/a', 'xml', b'a' * 100)
+    cache.put('http://lrg/b', 'xml', b'b' * 100)
+
+    # bodies are content addressed, so an identical body is only stored once
+    cache.put('http://lrg/a_copy', 'xml', b'a' * 100)
+    assert cache.totalSize() == 200
+
+    # using 'a' makes 'b' the least recently used, so 'b' is evicted for 'c'
+    cache.get('http://lrg/a')
+    cache.put('http://lrg/c', 'xml', b'c' * 100)
+    assert cache.get('http://lrg/b') is None
+    assert cache.readBody(cache.get('http://lrg/a')) == b'a' * 100
+    assert cache.readBody(cache.get('http://lrg/c')) == b'c' * 100
+    assert cache.totalSize() == 200
+    assert sum(len(files) for path, dirs, files in os.walk(cache.objects_dir)) == 2
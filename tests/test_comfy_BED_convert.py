@@ -0,0 +1,73 @@
+import pytest
+import os
+import xml.etree.ElementTree as ET
+
+from comfy_BED import comfy_BED_convert
+from comfy_BED.comfy_BED_convert import GenomeMapping, loadGenomeMapping, convertExons
+from comfy_BED.comfy_BED_errors import NoGenomeMappingError
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def converter(request, monkeypatch):
+    # run each test with and without NumPy
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+        # use NumPy however few positions there are
+        monkeypatch.setattr(comfy_BED_convert, 'NUMPY_MIN_POSITIONS', 0)
+    else:
+        monkeypatch.setattr(comfy_BED_convert, 'numpy', None)
+    return request.param
+
+
+def test_spanEnds(converter):
+    # every mapping span (including transcript mappings, which have many spans and indels)
+    # should convert its LRG start and end to its other start and end
+    for lrg_name in ['LRG_1', 'LRG_5', 'LRG_9', 'LRG_293']:
+        root = ET.parse(os.path.abspath('tests/test_data/{}.xml'.format(lrg_name))).getroot()
+        for mapping in root.iter('mapping'):
+            genome_mapping = loadGenomeMapping(root, mapping.get('coord_system'))
+            for m_span in mapping.iter('mapping_span'):
+                other_start, other_end = int(m_span.get('other_start')), int(m_span.get('other_end'))
+                expected = [other_start, other_end] if m_span.get('strand') == '1' else [other_end, other_start]
+                assert genome_mapping.toGenomic([int(m_span.get('lrg_start')), int(m_span.get('lrg_end'))]) == expected
+                assert genome_mapping.toLrg(expected) == [int(m_span.get('lrg_start')), int(m_span.get('lrg_end'))]
+
+
+def test_indels(converter):
+    # Setup - LRG_9 has a 1 base lrg_ins at 32041 on GRCh37, but none on GRCh38
+    root_LRG_9 = ET.parse(os.path.abspath('tests/test_data/LRG_9.xml')).getroot()
+    genome_mapping = loadGenomeMapping(root_LRG_9, 'GRCh37')
+    assert len(genome_mapping.segments) == 2
+    assert genome_mapping.toGenomic([1, 32040, 32042, 39784]) == [111952571, 111984610, 111984611, 111992353]
+    assert len(loadGenomeMapping(root_LRG_9, 'GRCh38').segments) == 1
+
+    # exons after the insertion are shifted back a base
+    assert convertExons({'exon_4': (38162, 39784)}, genome_mapping) == [('chr11', 111990731, 111992353, 'exon_4')]
+
+    # Setup - two spans on the 3' -> 5' strand with a gap, and a 2 base other_ins in the second
+    genome_mapping = GenomeMapping('chr2', [
+        (1, 100, 1901, 2000, -1, []),
+        (201, 300, 1000, 1101, -1, [('mismatch', 210, 210, 1091, 1091), ('other_ins', 250, 251, 1050, 1051)]),
+    ])
+    assert genome_mapping.toGenomic([1, 100, 201, 250, 251, 300]) == [2000, 1901, 1101, 1052, 1049, 1000]
+    assert convertExons({'exon_1': (211, 260)}, genome_mapping) == [('chr2', 1040, 1091, 'exon_1')]
+
+    # positions in the gap, or outside the spans, should throw a value error
+    for lrg_position in [0, 150, 301]:
+        with pytest.raises(ValueError):
+            genome_mapping.toGenomic([lrg_position])
+
+
+def test_loadGenomeMapping():
+    # Setup - LRG_293 with a patch mapping added before the assembly mapping
+    root = ET.parse(os.path.abspath('tests/test_data/LRG_293.xml')).getroot()
+    annotation_set = root.find('updatable_annotation/annotation_set')
+    patch = ET.Element('mapping', coord_system='GRCh38.p12', other_name='HG1_PATCH', type='patch')
+    ET.SubElement(patch, 'mapping_span', lrg_start='1', lrg_end='91193', other_start='1', other_end='91193', strand='1')
+    annotation_set.insert(0, patch)
+
+    assert loadGenomeMapping(root, 'GRCh38').chrom == 'chr13'
+    with pytest.raises(ValueError):
+        loadGenomeMapping(root, 'GRCh36')
+    with pytest.raises(NoGenomeMappingError):
+        GenomeMapping('chr13', [])
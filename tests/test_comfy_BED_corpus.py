@@ -0,0 +1,99 @@
+import pytest
+import os
+import gzip
+import shutil
+import datetime
+
+from comfy_BED.comfy_BED import loadLrgXml, convert
+from comfy_BED.comfy_BED_corpus import CORPUS_MANIFEST, CORPUS_PARTS_DIR, findCorpusFiles, runCorpus
+
+
+@pytest.fixture
+def corpus_dir(tmpdir):
+    corpus = tmpdir.mkdir('corpus')
+    for lrg_name in ['LRG_1', 'LRG_5', 'LRG_293']:
+        shutil.copy('tests/test_data/{}.xml'.format(lrg_name), str(corpus))
+    return corpus
+
+
+def readRows(path):
+    with open(path) as bed_file:
+        return [line.rstrip('\n').split('\t') for line in bed_file if not line.startswith('#')]
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_runCorpus(tmpdir, corpus_dir, processes):
+    output_dir = str(tmpdir.join('output'))
+    now = datetime.datetime(2020, 1, 2, 3, 4)
+    assert [os.path.basename(xml_path) for xml_path in findCorpusFiles(str(corpus_dir))] == [
+        'LRG_1.xml', 'LRG_293.xml', 'LRG_5.xml']
+
+    # the first run converts every file, and writes a merged, sorted file per build
+    summary = runCorpus(str(corpus_dir), output_dir, processes=processes, now=now)
+    assert len(summary['converted']) == 3 and summary['unchanged'] == [] and summary['failed'] == []
+    assert summary['outputs'] == [os.path.join(output_dir, 'lrg_corpus_GRCh37.bed'),
+                                  os.path.join(output_dir, 'lrg_corpus_GRCh38.bed')]
+    assert os.path.isfile(os.path.join(output_dir, CORPUS_MANIFEST))
+    assert len(os.listdir(os.path.join(output_dir, CORPUS_PARTS_DIR))) == 3
+    with open(summary['outputs'][0]) as bed_file:
+        assert bed_file.readline() == '#LRG corpus BED generated at: 2020-01-02 03:04\n'
+
+    # every transcript of every LRG is in the merged file, the same as converting them one by one
+    rows = readRows(summary['outputs'][0])
+    expected_rows = []
+    for xml_path in findCorpusFiles(str(corpus_dir)):
+        lrg = loadLrgXml(xml_path)
+        for record in convert(lrg, [transcript.get('name') for transcript in lrg.iter('transcript')
+                                    if transcript.get('name')], 'GRCh37'):
+            expected_rows.append([record.chrom, str(record.start), str(record.end),
+                                  '{}_{}_{}'.format(record.lrg_id, record.transcript, record.exon)])
+    assert sorted(rows) == sorted(expected_rows)
+    assert [(row[0], int(row[1])) for row in rows] == sorted((row[0], int(row[1])) for row in rows)
+
+    # nothing has changed, so nothing is converted or written again
+    summary = runCorpus(str(corpus_dir), output_dir, processes=processes, now=now)
+    assert summary['converted'] == [] and len(summary['unchanged']) == 3 and summary['outputs'] == []
+
+    # a touched file is hashed, but isn't converted unless its contents changed
+    lrg_5 = corpus_dir.join('LRG_5.xml')
+    os.utime(str(lrg_5), (0, 0))
+    summary = runCorpus(str(corpus_dir), output_dir, processes=processes, now=now)
+    assert summary['converted'] == [] and summary['outputs'] == []
+    lrg_5.write(lrg_5.read().replace('<id>LRG_5</id>', '<id>LRG_5 </id>', 1))
+    summary = runCorpus(str(corpus_dir), output_dir, processes=processes, now=now)
+    assert summary['converted'] == [str(lrg_5)] and len(summary['outputs']) == 2
+    assert len(os.listdir(os.path.join(output_dir, CORPUS_PARTS_DIR))) == 3
+
+    # a removed file's rows are taken out of the merged files
+    corpus_dir.join('LRG_1.xml').remove()
+    summary = runCorpus(str(corpus_dir), output_dir, processes=processes, now=now)
+    assert summary['removed'] == [str(corpus_dir.join('LRG_1.xml'))]
+    assert not [row for row in readRows(summary['outputs'][0]) if row[3].startswith('LRG_1_')]
+    assert len(os.listdir(os.path.join(output_dir, CORPUS_PARTS_DIR))) == 2
+
+    # changing the builds converts everything again, compressing only writes the outputs again
+    summary = runCorpus(str(corpus_dir), output_dir, ['GRCh38'], processes=processes, now=now)
+    assert len(summary['converted']) == 2 and len(summary['outputs']) == 1
+    summary = runCorpus(str(corpus_dir), output_dir, ['GRCh38'], processes=processes, now=now, index=True)
+    assert summary['converted'] == [] and summary['outputs'] == [os.path.join(output_dir, 'lrg_corpus_GRCh38.bed.gz')]
+    assert os.path.isfile(summary['outputs'][0] + '.tbi')
+    with gzip.open(summary['outputs'][0], 'rb') as bed_file:
+        assert len(bed_file.read().decode('utf-8').splitlines()) == len(rows) - len(
+            [row for row in rows if row[3].startswith('LRG_1_')]) + 2
+
+
+def test_runCorpus_failures(tmpdir, corpus_dir):
+    output_dir = str(tmpdir.join('output'))
+    corpus_dir.join('bad.xml').write('<notlrg/>')
+
+    # a file that can't be converted is reported, and the rest are still merged
+    summary = runCorpus(str(corpus_dir), output_dir)
+    assert summary['failed'] == [str(corpus_dir.join('bad.xml'))] and len(summary['converted']) == 4
+    assert set(row[3].split('_t')[0] for row in readRows(summary['outputs'][0])) == set(['LRG_1', 'LRG_5', 'LRG_293'])
+
+    # it stays failed until it is fixed
+    summary = runCorpus(str(corpus_dir), output_dir)
+    assert summary['failed'] == [str(corpus_dir.join('bad.xml'))] and summary['converted'] == []
+    shutil.copy('tests/test_data/LRG_9.xml', str(corpus_dir.join('bad.xml')))
+    summary = runCorpus(str(corpus_dir), output_dir)
+    assert summary['failed'] == [] and summary['converted'] == [str(corpus_dir.join('bad.xml'))]
@@ -0,0 +1,67 @@
+import pytest
+import datetime
+
+from comfy_BED import comfy_BED_web
+from comfy_BED.comfy_BED_web import getLrgId, checkLrgExists, loadIdIndex
+from comfy_BED.comfy_BED_ids import buildIdIndexFromXmls, buildIdIndexFromListing, writeIdIndex
+from comfy_BED.comfy_BED_errors import LrgNotFoundError, WebServiceError
+
+
+def test_buildIdIndexFromXmls():
+    id_index = buildIdIndexFromXmls(['tests/test_data/LRG_1.xml', 'tests/test_data/LRG_5.xml'])
+
+    # same identifiers as the web query tests, with and without versions
+    for identifier in ['LRG_1', 'COL1A1', 'ENSG00000108821', 'ENSP00000225964.5', 'ENST00000225964.9',
+                       'NM_000088.3', 'NM_000088', 'NG_007400.1', 'NP_000079.2']:
+        assert id_index[identifier] == set(['LRG_1']), identifier
+    assert id_index['P3H1'] == set(['LRG_5'])
+
+    # neighbouring genes in the updatable annotation aren't indexed
+    assert 'C1ORF50' not in id_index
+    assert 'NM_024097.3' not in id_index
+
+
+def test_buildIdIndexFromListing():
+    listing_text = (
+        '# Last modified: 12-12-2018\n'
+        '# LRG\tHGNC_SYMBOL\tREFSEQGENE\tLRG_TRANSCRIPT\tREFSEQ_TRANSCRIPT\tENSEMBL_TRANSCRIPT\tCCDS\n'
+        'LRG_1\tCOL1A1\tNG_007400.1\tt1\tNM_000088.3\tENST00000225964.9\tCCDS11561.1\n'
+        'LRG_5\tP3H1\tNG_008123.1\tt1\tNM_022356.3\t-\t\n'
+        'LRG_6\tP3H1\tNG_008123.1\tt2\tNM_001243246.1\t-\t\n'
+    )
+    id_index = buildIdIndexFromListing(listing_text)
+
+    assert id_index['COL1A1'] == set(['LRG_1'])
+    assert id_index['ENST00000225964'] == set(['LRG_1'])
+    assert id_index['NM_001243246.1'] == set(['LRG_6'])
+    assert id_index['P3H1'] == set(['LRG_5', 'LRG_6'])
+    assert 'T1' not in id_index and '-' not in id_index and 'CCDS11561.1' not in id_index
+
+    # a listing without its header line can't be read
+    with pytest.raises(WebServiceError):
+        buildIdIndexFromListing(listing_text.split('\n', 2)[2])
+
+
+def test_indexedLookups(lrg_web_server, tmpdir):
+    # Setup - index LRG_1 and an ambiguous symbol, COL1A1 isn't on the stand-in server
+    id_index = buildIdIndexFromXmls(['tests/test_data/LRG_1.xml'])
+    id_index['SHARED'] = set(['LRG_1', 'LRG_5'])
+    id_index_path = str(tmpdir.join('lrg_ids.tsv'))
+    writeIdIndex(id_index, id_index_path, datetime.datetime(2018, 12, 12, 9, 30))
+    loaded_index = loadIdIndex(id_index_path)
+    assert loaded_index['SHARED'] is None
+
+    # indexed identifiers and LRG IDs don't need the web
+    assert getLrgId('col1a1') == 'LRG_1'
+    assert getLrgId('NM_000088.9') == 'LRG_1'
+    assert checkLrgExists('LRG_1') == True
+    assert len(lrg_web_server.requests) == 0
+
+    # misses and ambiguous identifiers fall back to the web
+    lrg_web_server.searchResponse('name:P3H1', ['LRG_5'])
+    lrg_web_server.searchResponse('name:SHARED', ['LRG_1', 'LRG_5'])
+    lrg_web_server.searchResponse('SHARED', ['LRG_1', 'LRG_5'])
+    assert getLrgId('P3H1') == 'LRG_5'
+    with pytest.raises(LrgNotFoundError):
+        getLrgId('SHARED')
+    assert len(lrg_web_server.requests) == 3
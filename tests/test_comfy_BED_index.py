@@ -0,0 +1,131 @@
+import pytest
+import os
+import shutil
+import sqlite3
+
+from comfy_BED.comfy_BED import loadLrgXml, loadLrgInput, checkValidTranscripts, getLrgExons, getGenomeMapping
+from comfy_BED.comfy_BED_index import compileAnnotationIndex, loadLrgFromIndex, ANNOTATION_INDEX_VERSION
+from comfy_BED.comfy_BED_model import buildLrgModel
+from comfy_BED.comfy_BED_errors import AnnotationIndexError
+
+# an LRG with a transcript that has no exons
+NO_EXONS_XML = b'''<lrg>
+  <fixed_annotation>
+    <id>LRG_0</id>
+    <transcript name="t1">
+      <exon label="1"><coordinates coord_system="LRG_0" start="1" end="10"/></exon>
+    </transcript>
+    <transcript name="t2">
+      <coding_region><coordinates coord_system="LRG_0" start="5" end="8"/></coding_region>
+    </transcript>
+  </fixed_annotation>
+  <updatable_annotation>
+    <annotation_set type="lrg">
+      <mapping coord_system="GRCh37.p13" other_name="2" type="main_assembly">
+        <mapping_span lrg_start="1" lrg_end="100" other_start="1001" other_end="1100" strand="1"/>
+      </mapping>
+    </annotation_set>
+  </updatable_annotation>
+</lrg>'''
+
+
+def test_loadLrgFromIndex(tmpdir):
+    # Setup - index copies of the test LRGs
+    xml_paths = []
+    for lrg_name in ['LRG_1', 'LRG_5', 'LRG_9', 'LRG_293', 'LRG_293_mapping_removed']:
+        xml_path = str(tmpdir.join(lrg_name + '.xml'))
+        shutil.copy('tests/test_data/{}.xml'.format(lrg_name), xml_path)
+        xml_paths.append(xml_path)
+    index_path = str(tmpdir.join('lrg_annotation.sqlite'))
+    assert compileAnnotationIndex(xml_paths[:4], index_path) == (['LRG_1', 'LRG_5', 'LRG_9', 'LRG_293'], [])
+
+    # the index gives the same transcripts, exons and mappings as parsing the xml
+    for xml_path in xml_paths[:4]:
+        root = loadLrgXml(xml_path)
+        indexed_root = loadLrgFromIndex(index_path, xml_path)
+        lrg_id = indexed_root.find('fixed_annotation/id').text
+        assert checkValidTranscripts(['t1'], indexed_root) == (None)
+        assert [getLrgExons(t, lrg_id) for t in indexed_root.iter('transcript')] == [
+            getLrgExons(t, lrg_id) for t in root.iter('transcript')]
+        for genome_build in ['GRCh37', 'GRCh38']:
+            assert getGenomeMapping(indexed_root, genome_build) == getGenomeMapping(root, genome_build)
+        assert [(t.coding_start, t.coding_end) for t in buildLrgModel(indexed_root).transcripts.values()] == [
+            (t.coding_start, t.coding_end) for t in buildLrgModel(root).transcripts.values()]
+
+    # files that aren't indexed fall back to the xml
+    assert loadLrgFromIndex(index_path, xml_paths[4]) is None
+    root = loadLrgInput(local_input=xml_paths[4], annotation_index=index_path)
+    with pytest.raises(UnboundLocalError):
+        getGenomeMapping(root, 'GRCh37')
+
+    # unchanged files aren't indexed again, changed files are, and aren't used until they have been
+    assert compileAnnotationIndex(xml_paths, index_path) == (['LRG_293'], [])
+    shutil.copy('tests/test_data/LRG_293.xml', xml_paths[1])
+    os.utime(xml_paths[1], (0, 0))
+    assert loadLrgFromIndex(index_path, xml_paths[1]) is None
+    assert compileAnnotationIndex(xml_paths, index_path) == (['LRG_293'], [])
+    assert loadLrgFromIndex(index_path, xml_paths[1]).find('fixed_annotation/id').text == 'LRG_293'
+    assert loadLrgFromIndex(index_path, xml_paths[3]).find('fixed_annotation/id').text == 'LRG_293'
+
+
+def readBytes(path):
+    with open(path, 'rb') as read_file:
+        return read_file.read()
+
+
+def test_openIndex(tmpdir):
+    # Setup - index a copy of LRG_1
+    xml_path = str(tmpdir.join('LRG_1.xml'))
+    shutil.copy('tests/test_data/LRG_1.xml', xml_path)
+    index_path = str(tmpdir.join('lrg_annotation.sqlite'))
+    compileAnnotationIndex([xml_path], index_path)
+
+    # loading from the index doesn't write to it
+    index_bytes = readBytes(index_path)
+    assert loadLrgFromIndex(index_path, xml_path).find('fixed_annotation/id').text == 'LRG_1'
+    assert readBytes(index_path) == index_bytes
+
+    # a missing index isn't made, and an index of another version isn't read
+    with pytest.raises(AnnotationIndexError):
+        loadLrgFromIndex(str(tmpdir.join('missing.sqlite')), xml_path)
+    assert not tmpdir.join('missing.sqlite').exists()
+    connection = sqlite3.connect(index_path)
+    connection.execute('PRAGMA user_version = {}'.format(ANNOTATION_INDEX_VERSION - 1))
+    connection.commit()
+    connection.close()
+    index_bytes = readBytes(index_path)
+    with pytest.raises(AnnotationIndexError):
+        loadLrgFromIndex(index_path, xml_path)
+    with pytest.raises(AnnotationIndexError):
+        loadLrgInput(local_input=xml_path, annotation_index=index_path)
+    assert readBytes(index_path) == index_bytes
+
+    # compiling the index again updates it
+    assert compileAnnotationIndex([xml_path], index_path) == (['LRG_1'], [])
+    assert loadLrgFromIndex(index_path, xml_path).find('fixed_annotation/id').text == 'LRG_1'
+
+
+def test_compileAnnotationIndex(tmpdir):
+    # Setup - an LRG with a transcript that has no exons, and files that aren't LRGs
+    xml_paths = [str(tmpdir.join(name)) for name in ['LRG_0.xml', 'broken.xml', 'not_an_lrg.xml', 'no_id.xml']]
+    tmpdir.join('LRG_0.xml').write(NO_EXONS_XML, 'wb')
+    tmpdir.join('broken.xml').write(NO_EXONS_XML[:200], 'wb')
+    tmpdir.join('not_an_lrg.xml').write(b'<html><body/></html>', 'wb')
+    tmpdir.join('no_id.xml').write(NO_EXONS_XML.replace(b'<id>LRG_0</id>', b''), 'wb')
+    index_path = str(tmpdir.join('lrg_annotation.sqlite'))
+
+    # files that can't be read are skipped and listed, the rest are still indexed
+    assert compileAnnotationIndex(xml_paths, index_path) == (['LRG_0'], xml_paths[1:])
+    for xml_path in xml_paths[1:]:
+        assert loadLrgFromIndex(index_path, xml_path) is None
+
+    # transcripts with no exons are kept
+    model = buildLrgModel(loadLrgFromIndex(index_path, xml_paths[0]))
+    expected = buildLrgModel(loadLrgXml(xml_paths[0]))
+    assert list(model.transcripts) == list(expected.transcripts) == ['t1', 't2']
+    assert [(t.exon_labels, list(t.exon_starts), t.coding_start) for t in model.transcripts.values()] == [
+        (t.exon_labels, list(t.exon_starts), t.coding_start) for t in expected.transcripts.values()]
+
+    # a file that is fixed is indexed the next time
+    tmpdir.join('no_id.xml').write(NO_EXONS_XML, 'wb')
+    assert compileAnnotationIndex(xml_paths, index_path) == (['LRG_0'], xml_paths[1:3])
@@ -0,0 +1,81 @@
+import pytest
+import io
+import bz2
+import gzip
+
+from comfy_BED.comfy_BED import loadLrgInput
+from comfy_BED.comfy_BED_model import buildLrgModel
+from comfy_BED.comfy_BED_input import DecompressingReader, openLrgXml, stripLrgXmlSuffix, findLrgXmlFile
+from comfy_BED.comfy_BED_errors import InvalidInputError
+
+
+def gzipBytes(data):
+    compressed = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return compressed.getvalue()
+
+
+def describeLrg(root):
+    model = buildLrgModel(root)
+    return (model.lrg_id, [(name, transcript.exon_labels, list(transcript.exon_starts), list(transcript.exon_ends))
+                           for name, transcript in model.transcripts.items()],
+            [(mapping.coord_system, mapping.spans) for mapping in model.mappings])
+
+
+def readAll(lrg_file, size):
+    chunks = []
+    for chunk in iter(lambda: lrg_file.read(size), b''):
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+@pytest.mark.parametrize('size', [1, 100, 64 * 1024])
+def test_decompressingReader(size):
+    with open('tests/test_data/LRG_5.xml', 'rb') as xml_file:
+        xml = xml_file.read()
+
+    # plain, gzip and bzip2 streams, including ones made of several members (like BGZF)
+    for stream in (xml, gzipBytes(xml), gzipBytes(xml[:1000]) + gzipBytes(xml[1000:]),
+                   bz2.compress(xml), bz2.compress(xml[:5000]) + bz2.compress(xml[5000:])):
+        assert readAll(DecompressingReader(io.BytesIO(stream)), size) == xml
+
+    # data that isn't compressed after the compressed data, or broken compressed data, is an error
+    with pytest.raises(InvalidInputError):
+        readAll(DecompressingReader(io.BytesIO(gzipBytes(xml) + b'<lrg/>')), size)
+    with pytest.raises(InvalidInputError):
+        readAll(DecompressingReader(io.BytesIO(b'\x1f\x8b' + b'x' * 100)), size)
+
+
+def test_loadCompressedInput(tmpdir, monkeypatch):
+    # Setup - gzip and bzip2 copies of LRG_5
+    with open('tests/test_data/LRG_5.xml', 'rb') as xml_file:
+        xml = xml_file.read()
+    tmpdir.join('LRG_5.xml.gz').write(gzipBytes(xml), mode='wb')
+    tmpdir.join('LRG_5.xml.bz2').write(bz2.compress(xml), mode='wb')
+    tmpdir.join('LRG_5.txt').write(xml, mode='wb')
+    tmpdir.join('LRG_5_gzip.xml').write(gzipBytes(xml), mode='wb')
+
+    # uncompressed files are read as they are
+    with openLrgXml('tests/test_data/LRG_5.xml') as lrg_file:
+        assert readAll(lrg_file, 4096) == xml
+
+    # every input gives the same tree as the uncompressed file
+    expected = describeLrg(loadLrgInput(local_input='tests/test_data/LRG_5.xml'))
+    for file_name in ('LRG_5.xml.gz', 'LRG_5.xml.bz2', 'LRG_5_gzip.xml'):
+        assert describeLrg(loadLrgInput(local_input=str(tmpdir.join(file_name)))) == expected
+
+    # stdin can be compressed or not
+    for stream in (xml, gzipBytes(xml)):
+        monkeypatch.setattr('sys.stdin', type('Stdin', (object,), {'buffer': io.BytesIO(stream)})())
+        assert describeLrg(loadLrgInput(local_input='-')) == expected
+
+    with pytest.raises(InvalidInputError):
+        loadLrgInput(local_input=str(tmpdir.join('LRG_5.txt')))
+    with pytest.raises(InvalidInputError):
+        loadLrgInput()
+
+    # LRG files are found and named whatever their suffix
+    assert stripLrgXmlSuffix(str(tmpdir.join('LRG_5.xml.gz'))) == 'LRG_5'
+    assert findLrgXmlFile(str(tmpdir), 'LRG_5') == str(tmpdir.join('LRG_5.xml.gz'))
+    assert findLrgXmlFile(str(tmpdir), 'LRG_1') is None
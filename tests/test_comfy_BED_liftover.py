@@ -0,0 +1,70 @@
+import pytest
+import six
+import glob
+
+from comfy_BED import comfy_BED_convert
+from comfy_BED.comfy_BED_liftover import MappingLoader, liftoverLines, writeLiftover
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def mapping_loader(request, monkeypatch):
+    # run each test with and without NumPy, against the local test LRGs
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+        # use NumPy however few positions there are
+        monkeypatch.setattr(comfy_BED_convert, 'NUMPY_MIN_POSITIONS', 0)
+    else:
+        monkeypatch.setattr(comfy_BED_convert, 'numpy', None)
+    return MappingLoader('GRCh37', glob.glob('tests/test_data/LRG_*.xml'))
+
+
+def test_liftover(mapping_loader, monkeypatch):
+    # Setup - a VCF against LRGs, with rows of two LRGs mixed together, a position in
+    # LRG_9's 1 base insertion on GRCh37, an LRG that can't be loaded and a bad position
+    monkeypatch.setattr(mapping_loader, 'xml_paths', dict(mapping_loader.xml_paths, LRG_0='missing.xml'))
+    lines = [
+        '##fileformat=VCFv4.2\n',
+        '#CHROM\tPOS\tID\tREF\tALT\n',
+        'LRG_5\t5001\t.\tA\tG\n',
+        'LRG_9\t1\t.\tC\tT\n',
+        'LRG_5\t25750\t.\tA\tG\n',
+        'LRG_9\t32042\t.\tC\tT\n',
+        'LRG_0\t1\t.\tC\tT\n',
+        'LRG_9\tnot_a_position\t.\tC\tT\n',
+    ]
+
+    # small batches, so LRGs are split between batches
+    results = list(liftoverLines(lines, mapping_loader, batch_size=3))
+    assert results == [
+        ('##fileformat=VCFv4.2\n', True),
+        ('#CHROM\tPOS\tID\tREF\tALT\n', True),
+        ('chr1\t43232755\t.\tA\tG\n', True),
+        ('chr11\t111952571\t.\tC\tT\n', True),
+        ('chr1\t43212006\t.\tA\tG\n', True),
+        ('chr11\t111984611\t.\tC\tT\n', True),
+        ('LRG_0\t1\t.\tC\tT\n', False),
+        ('LRG_9\tnot_a_position\t.\tC\tT\n', False),
+    ]
+
+    # and back again, the inserted base in LRG_9 doesn't exist on the genome
+    genomic_lines = ['LRG_5\t43232755\n', 'LRG_9\t111984610\n', 'LRG_9\t111984611\n', 'LRG_9\t1\n']
+    assert list(liftoverLines(genomic_lines, mapping_loader, reverse=True)) == [
+        ('LRG_5\t5001\n', True), ('LRG_9\t32040\n', True), ('LRG_9\t32042\n', True), ('LRG_9\t1\n', False)]
+
+    # rows are written as they are converted, unconverted rows go to their own file
+    output_file = six.StringIO()
+    unmapped_file = six.StringIO()
+    assert writeLiftover(iter(results), output_file, unmapped_file) == (4, 2)
+    assert output_file.getvalue().splitlines()[2] == 'chr1\t43232755\t.\tA\tG'
+    assert unmapped_file.getvalue() == 'LRG_0\t1\t.\tC\tT\nLRG_9\tnot_a_position\t.\tC\tT\n'
+
+
+def test_liftoverIsLazy(mapping_loader):
+    # input is only read a batch at a time
+    def lines():
+        for i in range(10):
+            yield 'LRG_5\t{}\n'.format(5001 + i)
+        raise AssertionError('Read past the second batch')
+
+    results = liftoverLines(lines(), mapping_loader, batch_size=5)
+    assert [next(results)[0] for i in range(10)][-1] == 'chr1\t43232746\n'
@@ -0,0 +1,103 @@
+import json
+import logging
+import datetime
+
+from comfy_BED.comfy_BED_web import loadStatusSnapshot
+from comfy_BED.comfy_BED_batch import runBatch
+from comfy_BED.comfy_BED_logs import startLogging, stopLogging, logCorrelation
+
+logger = logging.getLogger('comfy_BED')
+
+
+def readJsonLines(log_file):
+    return [json.loads(line) for line in log_file.read().splitlines()]
+
+
+def test_jsonLogs(tmpdir):
+    log_file = tmpdir.join('run.jsonl')
+    run_id = startLogging(str(log_file), 'INFO', 'json')
+    try:
+        logger.info('Outside %s', 'any item')
+        with logCorrelation('LRG_5'):
+            logger.warning('Inside %s', 'LRG_5')
+            with logCorrelation('LRG_9'):
+                logger.info('Nested')
+            logger.info('Back in LRG_5')
+        try:
+            raise ValueError('bad LRG')
+        except ValueError:
+            logger.exception('Failed')
+        # below the log level
+        logger.debug('Not logged')
+    finally:
+        stopLogging()
+
+    entries = readJsonLines(log_file)
+    assert [(entry['message'], entry['level'], entry['correlation_id']) for entry in entries] == [
+        ('Outside any item', 'INFO', '-'),
+        ('Inside LRG_5', 'WARNING', 'LRG_5'),
+        ('Nested', 'INFO', 'LRG_9'),
+        ('Back in LRG_5', 'INFO', 'LRG_5'),
+        ('Failed', 'ERROR', '-')]
+    assert set(entry['run_id'] for entry in entries) == set([run_id])
+    assert 'ValueError: bad LRG' in entries[-1]['exception']
+
+    # after stopping, nothing more is written
+    logger.info('After stopping')
+    assert len(readJsonLines(log_file)) == len(entries)
+
+
+def test_textLogs(tmpdir):
+    log_file = tmpdir.join('run.log')
+    run_id = startLogging(str(log_file), 'DEBUG', 'text')
+    try:
+        with logCorrelation('LRG_5'):
+            logger.debug('Converted %s exons', 12)
+    finally:
+        stopLogging()
+    line, = log_file.read().splitlines()
+    assert ' DEBUG [{} LRG_5] '.format(run_id) in line
+    assert line.endswith('comfy_BED: Converted 12 exons')
+
+
+def test_lazyFormatting(tmpdir):
+    # Setup - an argument that counts how often it is formatted
+    class Counted(object):
+        formatted = 0
+
+        def __str__(self):
+            Counted.formatted += 1
+            return 'counted'
+
+    log_file = tmpdir.join('run.log')
+    startLogging(str(log_file), 'INFO', 'text')
+    try:
+        logger.debug('Skipped %s', Counted())
+        assert Counted.formatted == 0
+        logger.info('Written %s', Counted())
+        assert Counted.formatted > 0
+    finally:
+        stopLogging()
+    assert log_file.read().rstrip().endswith('Written counted')
+
+
+def test_multiprocessLogs(tmpdir):
+    # Setup - load the statuses from a snapshot, so they aren't checked with the web API
+    status_file = tmpdir.join('statuses.tsv')
+    status_file.write('#LRG statuses\nLRG_5\tpublic\nLRG_9\tpending\n')
+    loadStatusSnapshot(str(status_file))
+    batch_items = [('tests/test_data/LRG_5.xml', 't1', 'GRCh37'), ('tests/test_data/LRG_9.xml', 't1', 'GRCh37')]
+
+    log_file = tmpdir.join('batch.jsonl')
+    run_id = startLogging(str(log_file), 'DEBUG', 'json', multiprocess=True)
+    try:
+        results = runBatch(batch_items, 2, str(tmpdir), datetime.datetime(2024, 1, 1))
+    finally:
+        stopLogging()
+    assert all(success for batch_item, success, outcome in results)
+
+    # every worker's records reach the one log, whole, tagged with the run and their item
+    entries = readJsonLines(log_file)
+    assert set(entry['run_id'] for entry in entries) == set([run_id])
+    worker_entries = [entry for entry in entries if entry['process'] != 'MainProcess']
+    assert set(entry['correlation_id'] for entry in worker_entries) == set(lrg for lrg, transcripts, genome_build in batch_items)
@@ -0,0 +1,123 @@
+import pytest
+import os
+import xml.etree.ElementTree as ET
+
+from comfy_BED.comfy_BED import loadLrgXml, getLrgExons, convert
+from comfy_BED.comfy_BED_convert import loadGenomeMapping
+from comfy_BED.comfy_BED_model import buildLrgModel, splitTranscripts, convertTranscript, codingTranscript, mergeExons, flankExons
+from comfy_BED.comfy_BED_errors import InvalidInputError, InvalidTranscriptError
+
+# an LRG with transcripts whose names start with each other
+NESTED_TRANSCRIPTS_XML = b'''<lrg>
+  <fixed_annotation>
+    <id>LRG_0</id>
+    <transcript name="t1">
+      <exon label="1"><coordinates coord_system="LRG_0" start="1" end="10"/></exon>
+      <exon label="2"><coordinates coord_system="LRG_0t1" start="1" end="5"/><coordinates coord_system="LRG_0" start="21" end="30"/></exon>
+    </transcript>
+    <transcript name="t11">
+      <exon label="1"><coordinates coord_system="LRG_0" start="41" end="50"/></exon>
+    </transcript>
+  </fixed_annotation>
+  <updatable_annotation>
+    <annotation_set type="lrg">
+      <mapping coord_system="GRCh37.p13" other_name="2" type="main_assembly">
+        <mapping_span lrg_start="1" lrg_end="100" other_start="1001" other_end="1100" strand="1"/>
+      </mapping>
+    </annotation_set>
+  </updatable_annotation>
+</lrg>'''
+
+
+def test_buildLrgModel():
+    for lrg_name in ['LRG_1', 'LRG_5', 'LRG_9', 'LRG_293']:
+        xml_path = os.path.abspath('tests/test_data/{}.xml'.format(lrg_name))
+        root = ET.parse(xml_path).getroot()
+        model = buildLrgModel(root)
+        assert model.lrg_id == lrg_name
+        assert list(model.transcripts) == [transcript.get('name') for transcript in root.find('fixed_annotation').iter('transcript')]
+
+        # the pruned tree gives the same model as the whole file
+        pruned_model = buildLrgModel(loadLrgXml(xml_path))
+        assert list(pruned_model.transcripts) == list(model.transcripts)
+        assert [mapping.coord_system for mapping in pruned_model.mappings] == [
+            mapping.coord_system for mapping in model.mappings]
+
+        # exons are in file order, with the same positions as getLrgExons
+        for transcript in root.find('fixed_annotation').iter('transcript'):
+            lrg_transcript = model.transcripts[transcript.get('name')]
+            assert lrg_transcript.exon_labels == ['exon_{}'.format(exon.get('label')) for exon in transcript.iter('exon')]
+            exons = getLrgExons(transcript, lrg_name)
+            assert [exons[label] for label in lrg_transcript.exon_labels] == list(
+                zip(lrg_transcript.exon_starts, lrg_transcript.exon_ends))
+
+            # and convert to the same genomic positions
+            for genome_build in ['GRCh37', 'GRCh38']:
+                genome_mapping = model.getGenomeMapping(genome_build)
+                assert model.getGenomeMapping(genome_build) is genome_mapping
+                assert convertTranscript(lrg_transcript, genome_mapping) == [
+                    (genome_mapping.chrom,) + tuple(sorted(loadGenomeMapping(root, genome_build).toGenomic(exons[label]))) + (label,)
+                    for label in lrg_transcript.exon_labels]
+
+
+def test_selectTranscripts():
+    model = buildLrgModel(ET.fromstring(NESTED_TRANSCRIPTS_XML))
+    assert list(model.transcripts) == ['t1', 't11']
+    assert model.transcripts['t1'].exon_starts.tolist() == [1, 21]
+
+    # transcripts are selected by their exact name, in the order asked for
+    assert [transcript.name for transcript in model.selectTranscripts(['t11'])] == ['t11']
+    assert [transcript.name for transcript in model.selectTranscripts(splitTranscripts('t11, t1,t11'))] == ['t11', 't1']
+    assert [record.transcript for record in convert(model, 't1', 'GRCh37')] == ['t1', 't1']
+    assert convert(NESTED_TRANSCRIPTS_XML, 't11', 'GRCh37') == [('chr2', 1041, 1050, 'exon_1', 'LRG_0', 't11')]
+    with pytest.raises(InvalidTranscriptError):
+        model.selectTranscripts(['t'])
+
+    # exons without LRG coordinates can't be converted
+    with pytest.raises(InvalidInputError):
+        buildLrgModel(ET.fromstring(NESTED_TRANSCRIPTS_XML.replace(b'"LRG_0" start="41"', b'"LRG_0t11" start="41"')))
+
+
+def test_derivedRegions():
+    # coding only: exons are cut down to the coding region, on either strand
+    for lrg_name in ['LRG_1', 'LRG_5']:
+        root = ET.parse('tests/test_data/{}.xml'.format(lrg_name)).getroot()
+        model = buildLrgModel(loadLrgXml('tests/test_data/{}.xml'.format(lrg_name)))
+        transcript = model.transcripts['t1']
+        coordinates = [coordinate for coordinate in root.find('fixed_annotation/transcript').find('coding_region').iter(
+            'coordinates') if coordinate.get('coord_system') == lrg_name][0]
+        assert (transcript.coding_start, transcript.coding_end) == (int(coordinates.get('start')), int(coordinates.get('end')))
+        coding = codingTranscript(transcript)
+        assert min(coding.exon_starts) == transcript.coding_start and max(coding.exon_ends) == transcript.coding_end
+        exons = dict((exon[3], exon) for exon in convert(model, 't1', 'GRCh37'))
+        coding_exons = convert(model, 't1', 'GRCh37', coding_only=True)
+        assert sum(end - start for chrom, start, end, exon, lrg_id, transcript_name in coding_exons) < sum(
+            exon.end - exon.start for exon in exons.values())
+        for chrom, start, end, exon, lrg_id, transcript_name in coding_exons:
+            assert exons[exon].start <= start <= end <= exons[exon].end
+
+    # flanks widen each exon, and merging collapses the overlaps of all the transcripts
+    model = buildLrgModel(ET.fromstring(NESTED_TRANSCRIPTS_XML))
+    assert [record[:4] for record in convert(model, 'all', 'GRCh37', flank=5)] == [
+        ('chr2', 996, 1015, 'exon_1'), ('chr2', 1016, 1035, 'exon_2'), ('chr2', 1036, 1055, 'exon_1')]
+    assert convert(model, 't11,t1', 'GRCh37', merge=True) == [
+        ('chr2', 1001, 1010, 't1_exon_1', 'LRG_0', 'merged'), ('chr2', 1021, 1030, 't1_exon_2', 'LRG_0', 'merged'),
+        ('chr2', 1041, 1050, 't11_exon_1', 'LRG_0', 'merged')]
+    assert convert(model, 'all', 'GRCh37', flank=10, merge=True) == [
+        ('chr2', 991, 1060, 't1_exon_1,t1_exon_2,t11_exon_1', 'LRG_0', 'merged')]
+    assert mergeExons([('t1', [('chr1', 1, 10, 'exon_1'), ('chr1', 30, 40, 'exon_2')]),
+                       ('t2', [('chr1', 5, 30, 'exon_1')])]) == [('chr1', 1, 40, 't1_exon_1,t2_exon_1,t1_exon_2')]
+
+    # adjacent exons merge, exons with a base between them don't
+    assert mergeExons([('t1', [('chr1', 100, 200, 'exon_1'), ('chr1', 201, 300, 'exon_2'), ('chr1', 302, 400, 'exon_3')])]) == [
+        ('chr1', 100, 300, 't1_exon_1,t1_exon_2'), ('chr1', 302, 400, 't1_exon_3')]
+
+    # flanks stop at the first base of the chromosome
+    assert flankExons([('chr1', 3, 20, 'exon_1'), ('chr1', 40, 50, 'exon_2')], 5) == [
+        ('chr1', 1, 25, 'exon_1'), ('chr1', 35, 55, 'exon_2')]
+
+    # non-coding transcripts have no coding part
+    with pytest.raises(InvalidTranscriptError):
+        convert(model, 't1', 'GRCh37', coding_only=True)
+    with pytest.raises(InvalidInputError):
+        convert(model, 't1', 'GRCh37', flank=-1)
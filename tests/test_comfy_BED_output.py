@@ -0,0 +1,138 @@
+import pytest
+import io
+import os
+import sys
+import gzip
+import zlib
+import struct
+import random
+import datetime
+
+from comfy_BED import comfy_BED_web
+from comfy_BED.comfy_BED_web import loadStatusSnapshot
+from comfy_BED.comfy_BED import (loadLrgXml, makeBedFiles, makeBedRecords, makeBuildBedRecords, addBuildToPath,
+                                 writeCombinedBed)
+from comfy_BED.comfy_BED_errors import NoGenomeMappingError
+from comfy_BED.comfy_BED_output import BGZF_EOF, BedSorter, BedOutput, bedSortKey, chromSortKey, regionToBin
+
+
+def readGzip(path):
+    with gzip.open(path, 'rb') as gzip_file:
+        return gzip_file.read().decode('utf-8')
+
+
+def test_sortRows(tmpdir):
+    assert sorted(['chrX', 'chr10', 'chrM', 'chr2', 'chr1', 'chrUn'], key=chromSortKey) == [
+        'chr1', 'chr2', 'chr10', 'chrX', 'chrM', 'chrUn']
+
+    # rows sorted through temporary files come out the same as sorting in memory
+    random.seed(0)
+    rows = [('chr' + random.choice(['1', '2', '10', 'X']), random.randint(1, 10000), 0, 'row_{}'.format(i))
+            for i in range(1000)]
+    rows = [(chrom, start, start + random.randint(0, 500), name) for chrom, start, end, name in rows]
+    for chunk_size in [1000000, 64]:
+        sorter = BedSorter(chunk_size, str(tmpdir))
+        for row in rows:
+            sorter.add(row)
+        assert list(sorter.sortedRows()) == sorted(rows, key=bedSortKey)
+        assert len(sorter.runs) == (0 if chunk_size > len(rows) else 16)
+        sorter.close()
+
+
+def test_bedOutput(tmpdir):
+    rows = [('chr2', 300, 400, 'b'), ('chr1', 20000, 20100, 'c'), ('chr1', 100, 200, 'a')]
+
+    # unsorted, plain output is written in the order given, with comments where they were written
+    with BedOutput(str(tmpdir.join('plain.bed'))) as bed_output:
+        bed_output.writeComment('header')
+        bed_output.writeRows(rows)
+    assert tmpdir.join('plain.bed').read() == '#header\nchr2\t300\t400\tb\nchr1\t20000\t20100\tc\nchr1\t100\t200\ta\n'
+
+    # BGZF output can be read with gzip, and ends with the BGZF end of file block
+    with BedOutput(str(tmpdir.join('sorted.bed.gz')), sort=True, compress=True, chunk_size=2) as bed_output:
+        bed_output.writeRows(rows)
+        bed_output.writeComment('header')
+    assert readGzip(str(tmpdir.join('sorted.bed.gz'))) == (
+        '#header\nchr1\t100\t200\ta\nchr1\t20000\t20100\tc\nchr2\t300\t400\tb\n')
+    assert tmpdir.join('sorted.bed.gz').read_binary().endswith(BGZF_EOF)
+
+    # blocks are at most 64 KB, so large files have many
+    many_rows = [('chr1', start, start + 10, 'row_{}'.format(start)) for start in range(20000)]
+    with BedOutput(str(tmpdir.join('large.bed.gz')), compress=True) as bed_output:
+        bed_output.writeRows(many_rows)
+    assert readGzip(str(tmpdir.join('large.bed.gz'))).count('\n') == 20000
+    assert tmpdir.join('large.bed.gz').read_binary().count(b'\x1f\x8b\x08\x04') > 5
+
+    # the tabix index lists the chromosomes in file order, with a chunk for the bin of each row
+    with BedOutput(str(tmpdir.join('indexed.bed.gz')), index=True) as bed_output:
+        bed_output.writeRows(rows)
+    index = zlib.decompress(tmpdir.join('indexed.bed.gz.tbi').read_binary(), 31)
+    assert index[:4] == b'TBI\x01'
+    n_ref, index_format, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack('<8i', index[4:36])
+    assert (n_ref, index_format, col_seq, col_beg, col_end, meta, skip) == (2, 0x10000, 1, 2, 3, ord('#'), 0)
+    assert index[36:36 + l_nm] == b'chr1\0chr2\0'
+    n_bin, first_bin = struct.unpack('<iI', index[36 + l_nm:44 + l_nm])
+    assert (n_bin, first_bin) == (2, regionToBin(100, 200))
+    assert regionToBin(100, 200) == 4681 and regionToBin(16000, 17000) == 585 and regionToBin(0, 1 << 30) == 0
+
+    # an index needs a file
+    with pytest.raises(ValueError):
+        BedOutput('-', index=True)
+
+
+def test_makeBedOutput(tmpdir, monkeypatch):
+    # Setup - load the status from a snapshot, so it isn't checked with the web API
+    status_file = tmpdir.join('statuses.tsv')
+    status_file.write('LRG_5\tpublic\nLRG_293\tpublic\n')
+    loadStatusSnapshot(str(status_file))
+    now = datetime.datetime(2020, 1, 2, 3, 4)
+    lrg_5 = loadLrgXml('tests/test_data/LRG_5.xml')
+    lrg_293 = loadLrgXml('tests/test_data/LRG_293.xml')
+
+    # a file per transcript, compressed and indexed
+    file_names = makeBedFiles(lrg_5, 't1', 'GRCh37', now, str(tmpdir), index=True)
+    assert file_names == [str(tmpdir.join('LRG_5_t1.bed.gz'))]
+    assert tmpdir.join('LRG_5_t1.bed.gz.tbi').check()
+    lines = readGzip(file_names[0]).splitlines()
+    assert lines[0] == '#BED file generated at: 2020-01-02 03:04'
+    starts = [int(line.split('\t')[1]) for line in lines[2:]]
+    assert starts == sorted(starts)
+
+    # every LRG and transcript in one file, streamed to stdout
+    stdout = io.BytesIO()
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    bed_records = [makeBedRecords(lrg_5, 't1,t2', 'GRCh37'), makeBedRecords(lrg_293, 't1', 'GRCh37')]
+    assert writeCombinedBed(bed_records, '-', now, sort=True) == ['LRG_5', 'LRG_293']
+    lines = stdout.getvalue().decode('utf-8').splitlines()
+    assert lines[1].startswith('#LRG_5 public: ') and lines[2].startswith('#LRG_293 public: ')
+    rows = [line.split('\t') for line in lines[3:]]
+    assert len(rows) == sum(len(exons) for bed_record in bed_records for transcript, exons in bed_record[3])
+    assert [row[0] for row in rows] == sorted([row[0] for row in rows], key=chromSortKey)
+    assert set(row[3].rsplit('_exon_', 1)[0] for row in rows) == set(['LRG_5_t1', 'LRG_5_t2', 'LRG_293_t1'])
+
+
+def test_makeBuildBedFiles(tmpdir, monkeypatch):
+    # Setup - count the status lookups
+    status_lookups = []
+    monkeypatch.setattr(comfy_BED_web, 'getLrgStatus',
+                        lambda lrg_id: status_lookups.append(lrg_id) or ('public', 'LRG is public'))
+    now = datetime.datetime(2020, 1, 2, 3, 4)
+    lrg_5 = loadLrgXml('tests/test_data/LRG_5.xml')
+
+    # a file per transcript and build, from one status lookup, with the same rows as converting each build alone
+    file_names = makeBedFiles(lrg_5, 't1,t2', ['GRCh37', 'GRCh38'], now, str(tmpdir))
+    assert file_names == [str(tmpdir.join(file_name)) for file_name in [
+        'LRG_5_t1_GRCh37.bed', 'LRG_5_t2_GRCh37.bed', 'LRG_5_t1_GRCh38.bed', 'LRG_5_t2_GRCh38.bed']]
+    assert status_lookups == ['LRG_5']
+    for genome_build in ['GRCh37', 'GRCh38']:
+        rows = [tuple(line.split('\t')) for line in tmpdir.join('LRG_5_t2_' + genome_build + '.bed').read().splitlines()[2:]]
+        assert rows == [(chrom, str(start), str(end), exon) for chrom, start, end, exon in
+                        makeBedRecords(lrg_5, 't2', genome_build)[3][0][1]]
+
+    # 'all' is every assembly the LRG is mapped onto, by its full coord system
+    lrg_id, lrg_status, lrg_status_message, build_records = makeBuildBedRecords(lrg_5, 't1', 'all')
+    assert [genome_build for genome_build, transcript_records in build_records] == ['GRCh37.p13', 'GRCh38.p12']
+    assert addBuildToPath('out/panel.bed.gz', 'GRCh38') == os.path.join('out', 'panel_GRCh38.bed.gz')
+    assert addBuildToPath('panel', 'GRCh37') == 'panel_GRCh37'
+    with pytest.raises(NoGenomeMappingError):
+        makeBuildBedRecords(lrg_5, 't1', 'GRCh37,NCBI36')
@@ -0,0 +1,62 @@
+import pytest
+import glob
+import random
+import datetime
+
+from comfy_BED.comfy_BED_regions import parseRegion, readBedRegions, buildRegionIndex, writeRegionIndex
+from comfy_BED.comfy_BED_regions import loadRegionIndex, RegionIndex, queryRegions
+
+
+def test_parseRegion():
+    assert parseRegion('chr1:43232200-43232300') == ('chr1', 43232200, 43232300)
+    assert parseRegion('1:43,232,200-43,232,300') == ('chr1', 43232200, 43232300)
+    assert parseRegion('chrX:5-5') == ('chrX', 5, 5)
+
+    # Invalid regions should throw a value error
+    for region in ['chr1', 'chr1:300-200', 'chr1:a-b']:
+        with pytest.raises(ValueError):
+            parseRegion(region)
+
+
+def test_regionIndex(tmpdir):
+    # Setup - index the test LRGs, LRG_293_mapping_removed can't be indexed and is skipped
+    regions = buildRegionIndex(sorted(glob.glob('tests/test_data/LRG_*.xml')))
+    assert sorted(set(region[4] for region in regions)) == ['LRG_1', 'LRG_293', 'LRG_5', 'LRG_9']
+    region_index_path = str(tmpdir.join('lrg_regions.tsv'))
+    writeRegionIndex(regions, region_index_path, datetime.datetime(2018, 12, 12, 9, 30))
+    region_index = loadRegionIndex(region_index_path)
+    assert len(region_index) == len(regions)
+
+    # exon 1 of LRG_5 t1 is chr1 43232178-43232755 on GRCh37
+    overlaps = region_index.overlaps('GRCh37', 'chr1', 43232755, 43232800)
+    assert ('GRCh37', 'chr1', 43232178, 43232755, 'LRG_5', 't1', 'exon_1') in overlaps
+    assert region_index.overlaps('GRCh37', '1', 43232756, 43232800) == []
+    assert region_index.overlaps('GRCh37', 'chr2', 43232178, 43232755) == []
+    assert all(region[0] == 'GRCh38' for region in region_index.overlaps('GRCh38', 'chr1', 1, 10 ** 9))
+
+    # queries give the same answer as checking every region
+    random.seed(0)
+    for i in range(500):
+        build, chrom, start, end = random.choice(regions)[:4]
+        query_start = random.randint(start - 2000, end + 2000)
+        query_end = query_start + random.randint(0, 3000)
+        expected = sorted(region for region in regions if region[0] == build and region[1] == chrom and
+                          region[2] <= query_end and region[3] >= query_start)
+        assert region_index.overlaps(build, chrom, query_start, query_end) == expected
+
+
+def test_queryRegions(tmpdir):
+    region_index = RegionIndex([
+        ('GRCh37', 'chr1', 100, 200, 'LRG_A', 't1', 'exon_1'),
+        ('GRCh37', 'chr1', 150, 5000, 'LRG_B', 't1', 'exon_1'),
+        ('GRCh38', 'chr1', 100, 200, 'LRG_A', 't1', 'exon_1'),
+    ])
+    bed_file = tmpdir.join('regions.bed')
+    bed_file.write('track name=variants\nchr1\t199\t200\tvariant_1\n1\t200\t201\nchr1\t4000\t4001\tvariant_3\n')
+
+    # BED starts are 0-based
+    regions = readBedRegions(str(bed_file))
+    assert regions == [('chr1', 200, 200, 'variant_1'), ('chr1', 201, 201, None), ('chr1', 4001, 4001, 'variant_3')]
+    results = queryRegions(region_index, 'GRCh37', regions)
+    assert [[region[4] for region in overlaps] for region, overlaps in results] == [
+        ['LRG_A', 'LRG_B'], ['LRG_B'], ['LRG_B']]
@@ -0,0 +1,162 @@
+import pytest
+import os
+import shutil
+import socket
+import threading
+
+import requests
+
+from comfy_BED import comfy_BED_web
+from comfy_BED.comfy_BED_web import loadStatusSnapshot, setCache
+from comfy_BED.comfy_BED_cache import LrgWebCache
+from comfy_BED.comfy_BED_server import LrgCache, BedServer, UnixBedServer
+
+
+@pytest.fixture
+def lrg_dir(tmpdir):
+    # Setup - a directory of local LRGs, with statuses from a snapshot so the web isn't used
+    lrg_dir = tmpdir.mkdir('lrgs')
+    for lrg_id in ['LRG_5', 'LRG_9', 'LRG_293']:
+        shutil.copy('tests/test_data/{}.xml'.format(lrg_id), str(lrg_dir))
+    status_file = tmpdir.join('statuses.tsv')
+    status_file.write('LRG_5\tpublic\nLRG_9\tpending\nLRG_293\tpublic\n')
+    loadStatusSnapshot(str(status_file))
+    yield str(lrg_dir)
+    comfy_BED_web.LRG_STATUSES.clear()
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+
+
+def test_server(lrg_dir):
+    server = BedServer(0, LrgCache(lrg_dir, max_size=2))
+    serve(server)
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        response = requests.get(url + '/bed', params={'lrg': 'LRG_5', 'transcripts': 't1,t2', 'build': 'GRCh37'})
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert lines[1].startswith('#public: ')
+        assert lines[2] == '#transcript: t1'
+        assert 'chr1\t43232178\t43232755\texon_1' in lines
+        assert lines.count('#transcript: t2') == 1
+
+        # bad requests and failed conversions are reported, not fatal
+        assert requests.get(url + '/bed', params={'lrg': 'LRG_5'}).status_code == 400
+        response = requests.get(url + '/bed', params={'lrg': 'LRG_5', 'transcripts': 't9'})
+        assert response.status_code == 400 and 'Invalid transcript name' in response.text
+        assert requests.get(url + '/other').status_code == 404
+
+        # concurrent requests share the parsed LRGs, the least recently used are dropped
+        session = requests.Session()
+        results = []
+        def request(lrg_id):
+            results.append(session.get(url + '/bed', params={'lrg': lrg_id, 'transcripts': 't1'}).status_code)
+        threads = [threading.Thread(target=request, args=(lrg_id,)) for lrg_id in ['LRG_5', 'LRG_293'] * 5]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [200] * 10
+        assert server.lrg_cache.misses == 2
+        requests.get(url + '/bed', params={'lrg': 'LRG_9', 'transcripts': 't1'})
+        assert len(server.lrg_cache.entries) == 2 and list(server.lrg_cache.entries)[-1] == 'LRG_9'
+        assert 'cached: 2' in requests.get(url + '/health').text
+
+        # changed files are parsed again
+        misses = server.lrg_cache.misses
+        lrg_path = os.path.join(lrg_dir, 'LRG_9.xml')
+        os.utime(lrg_path, (0, 0))
+        requests.get(url + '/bed', params={'lrg': 'LRG_9', 'transcripts': 't1'})
+        assert server.lrg_cache.misses == misses + 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serverErrors(lrg_web_server, lrg_dir, monkeypatch, tmpdir):
+    # Setup - a search with no hits, and one that fails
+    lrg_web_server.searchResponse('name:NOGENE', [])
+    lrg_web_server.searchResponse('NOGENE', [])
+    lrg_web_server.failures['/ebisearch/ws/rest/lrg?query=name:DOWN'] = 10
+    monkeypatch.setattr(comfy_BED_web, 'WEB_RETRIES', 1)
+    server = BedServer(0, LrgCache(lrg_dir))
+    serve(server)
+    url = 'http://127.0.0.1:{}/bed'.format(server.server_address[1])
+    try:
+        # LRGs that don't exist aren't found, failures of the web services are the gateway's
+        assert requests.get(url, params={'lrg': 'NOGENE', 'transcripts': 't1'}).status_code == 404
+        assert requests.get(url, params={'lrg': 'DOWN', 'transcripts': 't1'}).status_code == 502
+        assert requests.get(url, params={'lrg': 'LRG_5', 'transcripts': 't9'}).status_code == 400
+        setCache(LrgWebCache(str(tmpdir.mkdir('cache')), offline=True))
+        assert requests.get(url, params={'lrg': 'OFFLINE', 'transcripts': 't1'}).status_code == 503
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_lrgCacheAliases(lrg_web_server):
+    # Setup - LRG_5 is found by its gene name, LRG_9 by its ID
+    lrg_web_server.searchResponse('name:P3H1', ['LRG_5'])
+    for lrg_id, status in [('LRG_5', 'public'), ('LRG_9', 'pending')]:
+        lrg_web_server.searchResponse(lrg_id, [lrg_id])
+        lrg_web_server.statusResponse(lrg_id, status)
+        lrg_web_server.xmlResponse(lrg_id, 'tests/test_data/{}.xml'.format(lrg_id), status)
+    lrg_cache = LrgCache(max_size=1)
+
+    # an LRG asked for by its name and by its ID is only loaded and kept once
+    assert lrg_cache.get('P3H1').lrg_id == 'LRG_5'
+    assert lrg_cache.get('LRG_5') is lrg_cache.get('P3H1')
+    assert (lrg_cache.hits, lrg_cache.misses) == (2, 1)
+    assert list(lrg_cache.entries) == ['LRG_5']
+
+    # and its aliases are dropped with it
+    lrg_cache.get('LRG_9')
+    assert list(lrg_cache.entries) == ['LRG_9']
+    assert lrg_cache.aliases == {'LRG_9': 'LRG_9'}
+
+
+def test_lrgCacheStatuses(lrg_dir, tmpdir):
+    # Setup - a cache taking statuses from the snapshot that LRG_9 is pending in
+    status_file = tmpdir.join('statuses.tsv')
+    lrg_cache = LrgCache(lrg_dir, status_file=str(status_file))
+    assert lrg_cache.get('LRG_9').lrg_id == 'LRG_9'
+    assert comfy_BED_web.LRG_STATUSES['LRG_9'][0] == 'pending'
+
+    # a change to the snapshot is seen by the next request
+    status_file.write('LRG_5\tpublic\nLRG_9\tpublic\nLRG_293\tpublic\n')
+    os.utime(str(status_file), (0, 0))
+    lrg_cache.get('LRG_9')
+    assert comfy_BED_web.LRG_STATUSES['LRG_9'][0] == 'public'
+    assert (lrg_cache.hits, lrg_cache.misses) == (1, 1)
+
+    # local files are loaded again once they are older than max_age, keeping the snapshot statuses
+    lrg_cache.max_age = 0
+    lrg_cache.get('LRG_9')
+    assert lrg_cache.misses == 2
+    assert comfy_BED_web.LRG_STATUSES['LRG_9'][0] == 'public'
+
+
+def test_unixSocketServer(lrg_dir, tmpdir):
+    socket_path = str(tmpdir.join('comfy_BED.sock'))
+    server = UnixBedServer(socket_path, LrgCache(lrg_dir))
+    serve(server)
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+        client.sendall(b'GET /bed?lrg=LRG_293&transcripts=t1&build=GRCh38 HTTP/1.0\r\n\r\n')
+        response = b''
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            response += data
+        client.close()
+        assert response.startswith(b'HTTP/1.0 200') or response.startswith(b'HTTP/1.1 200')
+        assert b'\nchr13\t' in response
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,95 @@
+import os
+import json
+
+from comfy_BED.comfy_BED_web import loadStatusSnapshot
+from comfy_BED.comfy_BED_sync import runSync, listLrgFolder, SYNC_MANIFEST, SYNC_STATUS_FILE
+
+XML_PATHS = {'LRG_5': 'tests/test_data/LRG_5.xml', 'LRG_9': 'tests/test_data/LRG_9.xml'}
+
+
+def readBytes(path):
+    with open(path, 'rb') as read_file:
+        return read_file.read()
+
+
+def fileRequests(server):
+    return [path for path, port in server.requests if path.endswith('.xml')]
+
+
+def test_listLrgFolder(lrg_web_server):
+    lrg_web_server.folderListing([('LRG_5', '2024-01-31 10:15'), ('LRG_9', '2024-02-01 09:00')])
+    assert listLrgFolder('') == {'LRG_5.xml': '2024-01-31 10:15', 'LRG_9.xml': '2024-02-01 09:00'}
+
+
+def test_runSync(lrg_web_server, tmpdir):
+    # Setup - LRG_5 is public and LRG_9 is pending
+    store = str(tmpdir.join('store'))
+    lrg_web_server.folderListing([('LRG_5', '2024-01-31 10:15')])
+    lrg_web_server.folderListing([('LRG_9', '2024-01-31 10:15')], 'pending')
+    lrg_web_server.xmlResponse('LRG_5', XML_PATHS['LRG_5'], headers={'ETag': '"LRG_5-v1"'})
+    lrg_web_server.xmlResponse('LRG_9', XML_PATHS['LRG_9'], 'pending', headers={'Last-Modified': 'Wed, 31 Jan 2024 10:15:00 GMT'})
+
+    summary = runSync(store, max_in_flight=2)
+    assert summary['downloaded'] == ['pending/LRG_9.xml', 'public/LRG_5.xml']
+    assert readBytes(os.path.join(store, 'public', 'LRG_5.xml')) == readBytes(XML_PATHS['LRG_5'])
+    assert readBytes(os.path.join(store, 'pending', 'LRG_9.xml')) == readBytes(XML_PATHS['LRG_9'])
+    assert not [file_name for file_name in os.listdir(os.path.join(store, 'public')) if '.part' in file_name]
+
+    # the status snapshot is all a local run needs
+    statuses = loadStatusSnapshot(os.path.join(store, SYNC_STATUS_FILE))
+    assert dict((lrg_id, status) for lrg_id, (status, message) in statuses.items()) == {
+        'LRG_5': 'public', 'LRG_9': 'pending'}
+
+    # Nothing listed has changed, so no file is requested
+    del lrg_web_server.requests[:]
+    summary = runSync(store)
+    assert summary['unchanged'] == ['pending/LRG_9.xml', 'public/LRG_5.xml']
+    assert fileRequests(lrg_web_server) == []
+
+    # A newer listing date means a conditional request, which isn't downloaded again if the file hasn't changed
+    lrg_web_server.folderListing([('LRG_5', '2024-03-01 08:00')])
+    summary = runSync(store)
+    assert summary['unchanged'] == ['pending/LRG_9.xml', 'public/LRG_5.xml']
+    assert fileRequests(lrg_web_server) == ['/pub/databases/lrgex/LRG_5.xml']
+
+    # LRG_9 is made public
+    lrg_web_server.folderListing([('LRG_5', '2024-03-01 08:00'), ('LRG_9', '2024-03-01 08:00')])
+    lrg_web_server.folderListing([], 'pending')
+    lrg_web_server.xmlResponse('LRG_9', XML_PATHS['LRG_9'])
+    summary = runSync(store)
+    assert summary['downloaded'] == ['public/LRG_9.xml']
+    assert summary['removed'] == ['pending/LRG_9.xml']
+    assert not os.path.exists(os.path.join(store, 'pending', 'LRG_9.xml'))
+    with open(os.path.join(store, SYNC_MANIFEST)) as manifest_file:
+        assert sorted(json.load(manifest_file)['files']) == ['public/LRG_5.xml', 'public/LRG_9.xml']
+    statuses = loadStatusSnapshot(os.path.join(store, SYNC_STATUS_FILE))
+    assert statuses['LRG_9'][0] == 'public'
+
+
+def test_resumeSync(lrg_web_server, tmpdir):
+    # Setup - an interrupted download of LRG_5, and a failing LRG_6
+    store = tmpdir.mkdir('store')
+    lrg_web_server.folderListing([('LRG_5', '2024-01-31 10:15'), ('LRG_6', '2024-01-31 10:15')])
+    lrg_web_server.xmlResponse('LRG_5', XML_PATHS['LRG_5'], headers={'ETag': '"LRG_5-v1"'})
+    content = readBytes(XML_PATHS['LRG_5'])
+    public_dir = store.mkdir('public')
+    public_dir.join('LRG_5.xml.part').write(content[:1000], 'wb')
+    public_dir.join('LRG_5.xml.part.json').write(json.dumps(
+        {'url': lrg_web_server.url + '/pub/databases/lrgex/LRG_5.xml', 'validator': '"LRG_5-v1"'}))
+
+    summary = runSync(str(store), ['public'])
+    assert summary['resumed'] == ['public/LRG_5.xml']
+    assert summary['failed'] == ['public/LRG_6.xml']
+    assert lrg_web_server.range_requests == [('/pub/databases/lrgex/LRG_5.xml', 'bytes=1000-')]
+    assert public_dir.join('LRG_5.xml').read('rb') == content
+    assert sorted(os.listdir(str(public_dir))) == ['LRG_5.xml']
+
+    # A partial download of an older version is started again
+    lrg_web_server.folderListing([('LRG_5', '2024-02-01 10:15')])
+    public_dir.join('LRG_5.xml').remove()
+    public_dir.join('LRG_5.xml.part').write(b'<stale>', 'wb')
+    public_dir.join('LRG_5.xml.part.json').write(json.dumps(
+        {'url': lrg_web_server.url + '/pub/databases/lrgex/LRG_5.xml', 'validator': '"LRG_5-v0"'}))
+    summary = runSync(str(store), ['public'])
+    assert summary['downloaded'] == ['public/LRG_5.xml']
+    assert public_dir.join('LRG_5.xml').read('rb') == content
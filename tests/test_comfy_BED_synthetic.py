@@ -0,0 +1,27 @@
+import pytest
+
+from comfy_BED.comfy_BED import loadLrgXml
+from comfy_BED.comfy_BED_model import buildLrgModel, convertTranscript
+from comfy_BED.comfy_BED_synthetic import makeSyntheticLrg, writeSyntheticLrgs
+
+
+def test_makeSyntheticLrg(tmpdir):
+    # the same seed always gives the same LRG
+    assert makeSyntheticLrg(90000, 3, 30, 3) == makeSyntheticLrg(90000, 3, 30, 3)
+    assert makeSyntheticLrg(90000, 3, 30, 3) != makeSyntheticLrg(90000, 3, 30, 3, seed=1)
+
+    xml_path, = writeSyntheticLrgs(str(tmpdir), 1, transcripts=3, exons=30, spans=3)
+    model = buildLrgModel(loadLrgXml(xml_path))
+    assert model.lrg_id == 'LRG_90000'
+    assert sorted(model.transcripts) == ['t1', 't2', 't3']
+    assert len(model.transcripts['t1']) == 30
+
+    # every exon keeps its length on both strands, as the mapping spans break in introns
+    for genome_build, strand in (('GRCh37', 1), ('GRCh38', -1)):
+        genome_mapping = model.getGenomeMapping(genome_build)
+        assert genome_mapping.strand == strand
+        for transcript in model.transcripts.values():
+            exons = convertTranscript(transcript, genome_mapping)
+            assert [end - start for chrom, start, end, label in exons] == [
+                end - start for start, end in zip(transcript.exon_starts, transcript.exon_ends)]
+            assert [exon[1] for exon in exons] == sorted(exon[1] for exon in exons)[::strand]
@@ -0,0 +1,98 @@
+import pytest
+import os
+import json
+import datetime
+
+from comfy_BED import comfy_BED_timing
+from comfy_BED.comfy_BED import loadLrgInput, makeBedFiles
+from comfy_BED.comfy_BED_batch import runBatch
+from comfy_BED.comfy_BED_web import loadStatusSnapshot
+from comfy_BED.comfy_BED_timing import (RunTimings, startTimings, stopTimings, timeStage, writeTimings,
+                                        formatTimingTable)
+
+
+def test_runTimings(monkeypatch):
+    # Setup - a clock that moves on a second each time it is read
+    clock = iter(range(100))
+    monkeypatch.setattr(comfy_BED_timing.time, 'time', lambda: next(clock))
+
+    # time in an inner stage only counts towards that stage
+    timings = RunTimings()
+    with timings.stage('fetch'):
+        timings.addHttpCall()
+        with timings.stage('status'):
+            timings.addHttpCall()
+            timings.addBytes(10)
+        timings.addBytes(100)
+    with timings.stage('parse'):
+        pass
+    records = timings.toRecords()
+    assert [record['stage'] for record in records] == ['fetch', 'parse', 'status']
+    assert [(record['calls'], record['seconds'], record['bytes'], record['http_calls']) for record in records] == [
+        (1, 2, 100, 1), (1, 1, 0, 0), (1, 1, 10, 1)]
+
+    # the timings of other runs can be added
+    timings.addRecords(records)
+    assert [(record['calls'], record['seconds']) for record in timings.toRecords()] == [(2, 4), (2, 2), (2, 2)]
+
+    # stages aren't timed unless timings have been started
+    assert comfy_BED_timing.TIMINGS is None
+    with timeStage('parse'):
+        comfy_BED_timing.addBytes(10)
+    assert comfy_BED_timing.TIMINGS is None
+
+
+def test_timedRun(lrg_web_server, tmpdir):
+    # Setup - LRG_5 is served by the stand-in web server
+    lrg_web_server.searchResponse('LRG_5', ['LRG_5'])
+    lrg_web_server.statusResponse('LRG_5', 'public')
+    lrg_web_server.xmlResponse('LRG_5', 'tests/test_data/LRG_5.xml')
+
+    timings = startTimings()
+    try:
+        root = loadLrgInput(web_input='LRG_5')
+        file_names = makeBedFiles(root, 't1,t2', ['GRCh37', 'GRCh38'], datetime.datetime.now(), str(tmpdir))
+    finally:
+        assert stopTimings() is timings
+    assert [record['stage'] for record in timings.toRecords()] == [
+        'fetch', 'parse', 'status', 'mapping', 'convert', 'write']
+    records = dict((record['stage'], record) for record in timings.toRecords())
+
+    # every request is made while fetching (the status is kept from then), and parsing stops before the end of the file
+    assert records['fetch']['http_calls'] == len(lrg_web_server.requests)
+    assert records['status']['http_calls'] == 0
+    assert records['fetch']['bytes'] > os.path.getsize('tests/test_data/LRG_5.xml') > records['parse']['bytes'] > 0
+    assert records['mapping']['calls'] == 2 and records['write']['calls'] == 4
+    assert records['write']['bytes'] == sum(os.path.getsize(file_name) for file_name in file_names)
+    assert all(record['seconds'] >= 0 for record in records.values())
+
+    # timings are written as JSON lines, or a table
+    timings_file = tmpdir.join('timings.jsonl')
+    writeTimings(timings.toRecords(), str(timings_file), lrg='LRG_5')
+    lines = [json.loads(line) for line in timings_file.read().splitlines()]
+    assert [line['stage'] for line in lines] == [record['stage'] for record in timings.toRecords()]
+    assert all(line['lrg'] == 'LRG_5' for line in lines)
+    table = formatTimingTable(timings.toRecords()).splitlines()
+    assert table[0].split() == ['stage', 'calls', 'seconds', 'bytes', 'http_calls', 'peak_rss_kb']
+    assert table[-1].split()[:2] == ['total', str(sum(record['calls'] for record in records.values()))]
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_timedBatch(tmpdir, processes):
+    # Setup - load the statuses from a snapshot, so they aren't checked with the web API
+    status_file = tmpdir.join('statuses.tsv')
+    status_file.write('LRG_5\tpublic\nLRG_293\tpublic\n')
+    loadStatusSnapshot(str(status_file))
+    batch_items = [('tests/test_data/LRG_5.xml', 't1', 'GRCh37'), ('tests/test_data/LRG_293.xml', 't1', 'GRCh37')]
+
+    # each item is timed in its own process, and the timings are added together
+    timings = RunTimings()
+    timings_file = tmpdir.join('timings.jsonl')
+    results = runBatch(batch_items, processes, str(tmpdir), timings=timings, timings_file=str(timings_file))
+    assert [result[1] for result in results] == [True, True]
+    records = dict((record['stage'], record) for record in timings.toRecords())
+    assert 0 < records['parse']['bytes'] <= sum(os.path.getsize(lrg) for lrg, transcripts, genome_build in batch_items)
+    assert records['write']['calls'] == 2
+    lines = [json.loads(line) for line in timings_file.read().splitlines()]
+    assert set(line['lrg'] for line in lines) == set(lrg for lrg, transcripts, genome_build in batch_items)
+    assert comfy_BED_timing.TIMINGS is None
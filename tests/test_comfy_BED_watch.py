@@ -0,0 +1,91 @@
+import os
+import time
+import shutil
+import threading
+
+from comfy_BED.comfy_BED_web import loadStatusSnapshot
+from comfy_BED.comfy_BED_watch import Debouncer, watchDirectory
+
+
+def setUpStatuses(tmpdir):
+    # load the statuses from a snapshot, so they aren't checked with the web API
+    status_file = tmpdir.join('statuses.tsv')
+    status_file.write('#LRG statuses\nLRG_5\tpublic\nLRG_9\tpending\n')
+    loadStatusSnapshot(str(status_file))
+
+
+def test_debouncer():
+    debouncer = Debouncer(2.0)
+    debouncer.add(['LRG_5.xml'], 0.0)
+    debouncer.add(['LRG_9.xml'], 0.5)
+    # LRG_5 changes again before it is ready
+    debouncer.add(['LRG_5.xml'], 1.5)
+    assert debouncer.nextDue(1.5) == 1.0
+    assert debouncer.ready(2.0) == []
+    assert debouncer.ready(2.5) == ['LRG_9.xml']
+    assert debouncer.nextDue(2.5) == 1.0
+    # files being converted wait until they are done
+    assert debouncer.ready(3.5, busy=set(['LRG_5.xml'])) == []
+    assert debouncer.nextDue(3.5, busy=set(['LRG_5.xml'])) is None
+    assert debouncer.ready(3.5) == ['LRG_5.xml']
+    assert debouncer.nextDue(3.5) is None
+
+
+def test_watchDirectoryOnce(tmpdir):
+    setUpStatuses(tmpdir)
+    watched = tmpdir.mkdir('watched')
+    output_dir = str(tmpdir.join('beds'))
+    shutil.copy('tests/test_data/LRG_5.xml', str(watched))
+    watched.join('notes.txt').write('not an LRG')
+
+    results = watchDirectory(str(watched), 't1', 'GRCh37', output_dir, once=True)
+    assert [(batch_item[0], success) for batch_item, success, outcome in results] == [
+        (str(watched.join('LRG_5.xml')), True)]
+    assert os.path.isfile(os.path.join(output_dir, 'LRG_5_t1.bed'))
+
+    # Unchanged files aren't converted again, even if they have been touched
+    assert watchDirectory(str(watched), 't1', 'GRCh37', output_dir, once=True) == []
+    os.utime(str(watched.join('LRG_5.xml')), (time.time() + 10, time.time() + 10))
+    assert watchDirectory(str(watched), 't1', 'GRCh37', output_dir, once=True) == []
+
+    # Changed files and new settings are
+    shutil.copy('tests/test_data/LRG_9.xml', str(watched.join('LRG_5.xml')))
+    results = watchDirectory(str(watched), 't1', 'GRCh37', output_dir, once=True)
+    assert results[0][2] == [os.path.join(output_dir, 'LRG_9_t1.bed')]
+    assert len(watchDirectory(str(watched), 't1', 'GRCh38', output_dir, once=True)) == 1
+
+
+def test_watchDirectory(tmpdir):
+    setUpStatuses(tmpdir)
+    watched = tmpdir.mkdir('watched')
+    output_dir = str(tmpdir.join('beds'))
+    stop = threading.Event()
+    results = []
+
+    def watch():
+        results.extend(watchDirectory(str(watched), 't1', 'GRCh37', output_dir, processes=2, watcher='poll',
+                                      debounce=0.3, poll_interval=0.05, stop=stop))
+    thread = threading.Thread(target=watch)
+    thread.start()
+    try:
+        # LRG_5 lands in several writes, LRG_9 in one
+        with open('tests/test_data/LRG_5.xml', 'rb') as lrg_file:
+            content = lrg_file.read()
+        with open(str(watched.join('LRG_5.xml')), 'wb') as landing_file:
+            for start in range(0, len(content), len(content) // 4 + 1):
+                landing_file.write(content[start:start + len(content) // 4 + 1])
+                landing_file.flush()
+                time.sleep(0.1)
+        shutil.copy('tests/test_data/LRG_9.xml', str(watched))
+
+        expected = [os.path.join(output_dir, 'LRG_5_t1.bed'), os.path.join(output_dir, 'LRG_9_t1.bed')]
+        deadline = time.time() + 20
+        while not all(os.path.isfile(path) for path in expected) and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+
+    # each file is converted once, when it has been written
+    assert sorted((os.path.basename(batch_item[0]), success) for batch_item, success, outcome in results) == [
+        ('LRG_5.xml', True), ('LRG_9.xml', True)]
@@ -3,6 +3,7 @@ import os
 import hashlib
 
 from comfy_BED.comfy_BED_web import getLrgId, checkLrgExists, checkCurrentLrgStatus, getLrgXml
+from comfy_BED.comfy_BED_errors import LrgNotFoundError
 
 
 def test_getLrgId():
@@ -20,8 +21,8 @@ def test_getLrgId():
     assert getLrgId('NG_007400.1') == 'LRG_1'
     assert getLrgId('NP_000079.2') == 'LRG_1'
 
-    # Invalid inputs should throw an assertion error or value error
-    with pytest.raises((ValueError, AssertionError)):
+    # Invalid inputs should throw an LrgNotFoundError
+    with pytest.raises(LrgNotFoundError):
         getLrgId('invalid_input')
 
 
@@ -29,8 +30,8 @@ def test_checkLrgExists():
     # LRG ID that exists
     assert checkLrgExists('LRG_1') == True
 
-    # LRG ID that doesn't exist - should throw assertion error
-    with pytest.raises(AssertionError):
+    # LRG ID that doesn't exist - should throw an LrgNotFoundError
+    with pytest.raises(LrgNotFoundError):
         checkLrgExists('invalid_input')
 
 
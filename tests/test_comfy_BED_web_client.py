@@ -0,0 +1,134 @@
+import pytest
+import io
+import datetime
+
+from comfy_BED import comfy_BED_web
+from comfy_BED.comfy_BED_web import getLrgId, checkLrgExists, checkCurrentLrgStatus, getLrgXml, getLrgFromWeb, getLrgsFromWeb
+from comfy_BED.comfy_BED_web import getLrgStatus, checkLrgStatuses, loadStatusSnapshot, writeStatusSnapshot
+from comfy_BED.comfy_BED import loadLrgXml, makeBedFiles
+from comfy_BED.comfy_BED_errors import LrgNotFoundError, WebServiceError
+
+'''
+These tests run against a local stand-in for the LRG web services (see
+conftest.py), so they don't need a connection to the EBI.
+'''
+
+
+def setUpLrgResponses(server):
+    # Setup - LRG_5 is public, LRG_9 is pending, COL1A1 is only found by name
+    server.searchResponse('name:P3H1', ['LRG_5'])
+    server.searchResponse('name:NM_000088.3', [])
+    server.searchResponse('NM_000088.3', ['LRG_1'])
+    server.searchResponse('name:invalid_input', [])
+    server.searchResponse('invalid_input', [])
+    for lrg_id, status in [('LRG_1', 'public'), ('LRG_5', 'public'), ('LRG_9', 'pending')]:
+        server.searchResponse(lrg_id, [lrg_id])
+        server.statusResponse(lrg_id, status)
+        server.xmlResponse(lrg_id, 'tests/test_data/{}.xml'.format(lrg_id), status)
+
+
+def test_webQueries(lrg_web_server):
+    setUpLrgResponses(lrg_web_server)
+
+    assert getLrgId('LRG_5') == 'LRG_5'
+    assert getLrgId('P3H1') == 'LRG_5'
+    assert getLrgId('NM_000088.3') == 'LRG_1'
+    with pytest.raises(LrgNotFoundError):
+        getLrgId('invalid_input')
+
+    assert checkLrgExists('LRG_5') == True
+    with pytest.raises(LrgNotFoundError):
+        checkLrgExists('invalid_input')
+
+    assert checkCurrentLrgStatus('LRG_5')[0] == 'public'
+    assert checkCurrentLrgStatus('LRG_9')[0] == 'pending'
+
+    with io.open('tests/test_data/LRG_9.xml', encoding='utf-8') as LRG_9:
+        assert getLrgXml('LRG_9', 'pending') == LRG_9.read()
+
+
+def test_connectionReuse(lrg_web_server):
+    setUpLrgResponses(lrg_web_server)
+
+    getLrgFromWeb('P3H1')
+
+    # name search, exists check, status check and xml download all go over one connection
+    assert len(lrg_web_server.requests) == 4
+    assert len(set(port for path, port in lrg_web_server.requests)) == 1
+
+
+def test_retries(lrg_web_server, monkeypatch):
+    setUpLrgResponses(lrg_web_server)
+    status_path = '/ebisearch/ws/rest/lrg/entry/LRG_5?fields=status&format=json'
+
+    # server errors are retried with backoff
+    lrg_web_server.failures[status_path] = 2
+    assert checkCurrentLrgStatus('LRG_5')[0] == 'public'
+    assert [path for path, port in lrg_web_server.requests].count(status_path) == 3
+
+    # and give up once the retries run out
+    monkeypatch.setattr(comfy_BED_web, 'SESSION', None)
+    monkeypatch.setattr(comfy_BED_web, 'WEB_RETRIES', 1)
+    lrg_web_server.failures['/ebisearch/ws/rest/lrg?query=LRG_5'] = 2
+    with pytest.raises(WebServiceError):
+        checkLrgExists('LRG_5')
+
+    # a failed search isn't mistaken for an identifier with no LRG
+    lrg_web_server.failures['/ebisearch/ws/rest/lrg?query=name:P3H1'] = 2
+    with pytest.raises(WebServiceError) as error:
+        getLrgId('P3H1')
+    assert not isinstance(error.value, LrgNotFoundError)
+
+
+def test_getLrgsFromWeb(lrg_web_server):
+    setUpLrgResponses(lrg_web_server)
+    input_texts = ['LRG_5', 'invalid_input', 'LRG_9', 'P3H1', 'LRG_1']
+
+    results = getLrgsFromWeb(input_texts, max_in_flight=3)
+
+    # results are in input order, with failures caught
+    assert [result[0] for result in results] == input_texts
+    assert [result[1] for result in results] == [True, False, True, True, True]
+    assert results[0][2] == results[3][2]
+    assert '<id>LRG_9</id>' in results[2][2]
+
+    # no more connections are opened than requests are allowed in flight
+    assert len(set(port for path, port in lrg_web_server.requests)) <= 3
+
+
+def test_statusIsOnlyCheckedOnce(lrg_web_server, tmpdir):
+    setUpLrgResponses(lrg_web_server)
+    status_path = '/ebisearch/ws/rest/lrg/entry/LRG_5?fields=status&format=json'
+
+    # getting the xml checks the status, making the BED files reuses it
+    lrg_xml = getLrgFromWeb('LRG_5')
+    makeBedFiles(loadLrgXml(io.BytesIO(lrg_xml.encode('utf-8'))), 't1', 'GRCh37', datetime.datetime.now(), str(tmpdir))
+    assert getLrgStatus('LRG_5')[0] == 'public'
+    assert [path for path, port in lrg_web_server.requests].count(status_path) == 1
+
+
+def test_bulkStatuses(lrg_web_server, monkeypatch, tmpdir):
+    # Setup - two bulk queries of 2 and 1 LRGs, LRG_404 doesn't exist
+    monkeypatch.setattr(comfy_BED_web, 'STATUS_QUERY_SIZE', 2)
+    lrg_web_server.bulkStatusResponse([('LRG_5', 'public'), ('LRG_9', 'pending')])
+    lrg_web_server.responses['/ebisearch/ws/rest/lrg/entry/LRG_1,LRG_404?fields=status&format=json'] = (
+        200, '{"entries": [{"id": "LRG_1", "source": "lrg", "fields": {"status": ["public"]}}]}', {})
+
+    statuses = checkLrgStatuses(['LRG_9', 'LRG_404', 'LRG_5', 'LRG_1', 'LRG_5'])
+    assert sorted((lrg_id, status[0]) for lrg_id, status in statuses.items()) == [
+        ('LRG_1', 'public'), ('LRG_5', 'public'), ('LRG_9', 'pending')]
+    assert len(lrg_web_server.requests) == 2
+
+    # the statuses are kept for the rest of the run
+    assert getLrgStatus('LRG_9') == statuses['LRG_9']
+    assert len(lrg_web_server.requests) == 2
+
+    # and can be saved and loaded from a snapshot, without going to the web
+    status_file = str(tmpdir.join('statuses.tsv'))
+    writeStatusSnapshot(status_file, ['LRG_5', 'LRG_9'], datetime.datetime(2018, 12, 12, 9, 30))
+    with open(status_file) as snapshot:
+        assert snapshot.read() == '#LRG statuses fetched at: 2018-12-12 09:30\nLRG_5\tpublic\nLRG_9\tpending\n'
+    comfy_BED_web.LRG_STATUSES.clear()
+    assert loadStatusSnapshot(status_file) == {'LRG_5': statuses['LRG_5'], 'LRG_9': statuses['LRG_9']}
+    assert getLrgStatus('LRG_5')[0] == 'public'
+    assert len(lrg_web_server.requests) == 3
@@ -0,0 +1,116 @@
+import pytest
+import os
+
+from comfy_BED import comfy_BED_xml
+from comfy_BED.comfy_BED import LRG_KEEP_PATHS, LRG_READ_CHUNK_SIZE, loadLrgXml, checkValidTranscripts, getLrgExons, getGenomeMapping, convertLrg
+from comfy_BED.comfy_BED_model import buildLrgModel
+from comfy_BED.comfy_BED_synthetic import writeSyntheticLrgs, makeSyntheticLrg
+from comfy_BED.comfy_BED_xml import setXmlBackend, getXmlBackend
+from comfy_BED.comfy_BED_errors import InvalidInputError, InvalidXmlError
+
+TEST_LRGS = ['tests/test_data/{}.xml'.format(lrg_name) for lrg_name in ['LRG_1', 'LRG_5', 'LRG_9', 'LRG_293']]
+
+SEARCH_RESPONSE = (u'<?xml version="1.0" encoding="UTF-8"?>\n<result><hitCount>1</hitCount>'
+                   u'<entries><entry id="LRG_5" source="lrg"><name>CAMKK2 \u2013 kinase</name></entry></entries></result>')
+
+
+@pytest.fixture
+def xml_backend(monkeypatch):
+    # each test chooses its own backend, and the one in use is put back afterwards
+    monkeypatch.setattr(comfy_BED_xml, 'XML_BACKEND', None)
+
+
+def readWithBackend(backend_name, xml_path):
+    '''
+    Everything comfy_BED reads from an LRG, with one backend
+    '''
+    xml_backend = setXmlBackend(backend_name)
+    root = loadLrgXml(xml_path)
+    model = buildLrgModel(root)
+    transcripts = xml_backend.transcripts(root)
+    results = {
+        'transcripts': [(name, transcript.exon_labels, list(transcript.exon_starts), list(transcript.exon_ends),
+                         transcript.coding_start, transcript.coding_end)
+                        for name, transcript in model.transcripts.items()],
+        'mappings': [(mapping.coord_system, mapping.other_name, mapping.mapping_type, mapping.spans)
+                     for mapping in model.mappings],
+        'exons': [getLrgExons(transcript, model.lrg_id) for transcript in transcripts],
+        'coding': [[(coordinate.get('start'), coordinate.get('end'))
+                    for coordinate in xml_backend.codingCoordinates(transcript, model.lrg_id)]
+                   for transcript in transcripts],
+        'search': [(child.tag, child.text, child.get('id'))
+                   for child in xml_backend.fromstring(SEARCH_RESPONSE).iter() if child.tag in ('hitCount', 'entry', 'name')],
+        'sequences': len(list(root.iter('sequence'))),
+    }
+    checkValidTranscripts([name for name, transcript in model.transcripts.items()], root)
+    for genome_build in model.getGenomeBuilds():
+        results[genome_build] = (getGenomeMapping(root, genome_build),
+                                 convertLrg(root, 'all', genome_build, coding_only=False, merge=True))
+    return results
+
+
+def test_etreeBackend(xml_backend, monkeypatch):
+    # the backend can be chosen by name or environment variable, and unknown names are an error
+    assert setXmlBackend('etree').name == 'etree'
+    assert getXmlBackend().name == 'etree'
+    monkeypatch.setattr(comfy_BED_xml, 'XML_BACKEND', None)
+    monkeypatch.setenv(comfy_BED_xml.XML_BACKEND_VARIABLE, 'etree')
+    assert getXmlBackend().name == 'etree'
+    with pytest.raises(InvalidInputError):
+        setXmlBackend('libxml')
+
+    # the pruned tree has no sequences, and only the LRG's own transcripts
+    results = readWithBackend('etree', 'tests/test_data/LRG_5.xml')
+    assert results['sequences'] == 0
+    assert [transcript[0] for transcript in results['transcripts']] == ['t1', 't2', 't3']
+    assert results['search'] == [('hitCount', '1', None), ('entry', None, 'LRG_5'), ('name', u'CAMKK2 \u2013 kinase', None)]
+
+
+def test_backendParity(xml_backend, tmpdir):
+    # lxml is optional, and must give exactly the same results as ElementTree
+    pytest.importorskip('lxml')
+    synthetic_lrgs = writeSyntheticLrgs(str(tmpdir), 2, transcripts=4, exons=40, spans=3)
+    for xml_path in TEST_LRGS + synthetic_lrgs:
+        assert readWithBackend('lxml', xml_path) == readWithBackend('etree', xml_path)
+    assert setXmlBackend('auto').name == 'lxml'
+
+    # lxml searches trees built by ElementTree too, e.g. from the annotation index
+    setXmlBackend('etree')
+    root = loadLrgXml('tests/test_data/LRG_1.xml')
+    assert setXmlBackend('lxml').transcripts(root) == comfy_BED_xml.EtreeBackend().transcripts(root)
+
+    # malformed and truncated xml is the same error with either backend
+    with open('tests/test_data/LRG_5.xml', 'rb') as lrg_file:
+        truncated = lrg_file.read()[:40000]
+    tmpdir.join('LRG_5_truncated.xml').write(truncated, 'wb')
+    for backend_name in ['lxml', 'etree']:
+        setXmlBackend(backend_name)
+        with pytest.raises(InvalidXmlError):
+            loadLrgXml(str(tmpdir.join('LRG_5_truncated.xml')))
+        with pytest.raises(InvalidXmlError):
+            getXmlBackend().fromstring(SEARCH_RESPONSE[:60])
+        with pytest.raises(InvalidXmlError):
+            getXmlBackend().fromstring(u'<result><hitCount>1</result>')
+
+    # a mapping that is missing is still an error
+    with pytest.raises(UnboundLocalError):
+        getGenomeMapping(loadLrgXml('tests/test_data/LRG_293_mapping_removed.xml'), 'GRCh37')
+
+
+def test_lxmlLrgParser(xml_backend):
+    # sequences are removed from the tree as soon as they end, so at most the one being parsed is ever held
+    pytest.importorskip('lxml')
+    xml = makeSyntheticLrg(transcripts=6, exons=20)
+    parser = setXmlBackend('lxml').makeLrgParser(LRG_KEEP_PATHS)
+    most_sequences = 0
+    for start in range(0, len(xml), LRG_READ_CHUNK_SIZE // 16):
+        parser.feed(xml[start:start + LRG_READ_CHUNK_SIZE // 16])
+        if parser.root is not None:
+            most_sequences = max(most_sequences, len(list(parser.root.iter('sequence'))))
+        if parser.done:
+            break
+    root = parser.close()
+    assert parser.done
+    assert most_sequences == 1
+    assert len(list(root.iter('sequence'))) == 0
+    assert [element.tag for element in root] == ['fixed_annotation', 'updatable_annotation']